@@ -0,0 +1,133 @@
+# bench.py
+# Timing harness and baseline comparison for the benchmark suite (see run.py)
+import gc
+import json
+import math
+import platform
+import statistics
+import sys
+import time
+
+
+def percentile(values, fraction):
+    """ Nearest-rank percentile of a non-empty list """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+def summarize(samples, ops):
+    """ Result entry for per-operation times (seconds) """
+    return {
+        'unit': 'sec/op',
+        'ops': ops,
+        'samples': len(samples),
+        'mean': statistics.fmean(samples),
+        'min': min(samples),
+        'p50': percentile(samples, 0.50),
+        'p99': percentile(samples, 0.99),
+        'max': max(samples),
+        'ops_per_sec': 1.0 / statistics.fmean(samples) if statistics.fmean(samples) > 0 else 0.0,
+    }
+
+
+def measure(fn, samples=30, inner=None, min_sample_sec=0.002):
+    """ Time fn(). Each sample runs fn inner times (calibrated so a sample takes at least min_sample_sec) and
+        records the time per call.
+    """
+    fn()
+    if inner is None:
+        inner = 1
+        while True:
+            started = time.perf_counter()
+            for _ in range(inner):
+                fn()
+            if time.perf_counter() - started >= min_sample_sec or inner >= 1 << 20:
+                break
+            inner *= 2
+
+    times = []
+    # like timeit, keep garbage collection out of the timings
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(samples):
+            started = time.perf_counter()
+            for _ in range(inner):
+                fn()
+            times.append((time.perf_counter() - started) / inner)
+    finally:
+        gc.enable()
+    return summarize(times, samples * inner)
+
+
+async def measure_async(coro_fn, samples=30, inner=1):
+    """ measure() for coroutine functions """
+    await coro_fn()
+    times = []
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(samples):
+            started = time.perf_counter()
+            for _ in range(inner):
+                await coro_fn()
+            times.append((time.perf_counter() - started) / inner)
+    finally:
+        gc.enable()
+    return summarize(times, samples * inner)
+
+
+def report(results):
+    """ Machine readable report of a benchmark run """
+    return {
+        'meta': {
+            'python': sys.version.split()[0],
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'system': platform.system(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+def load(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def save(path, data):
+    with open(path, 'w') as file:
+        json.dump(data, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+
+def best(runs, metric='min'):
+    """ Merge the results of repeated runs, keeping each benchmark's run with the lowest metric """
+    merged = {}
+    for results in runs:
+        for name, result in results.items():
+            if name not in merged or result[metric] < merged[name][metric]:
+                merged[name] = result
+    return merged
+
+
+def compare(results, baseline, tolerance=0.5, metric='min', fast_sec=10e-6, fast_tolerance=1.0):
+    """ Compare results against baseline results. A benchmark regresses when metric grew by more than tolerance
+        (fraction), or by more than fast_tolerance for benchmarks whose baseline is below fast_sec: timings of a few
+        microseconds move with CPU frequency and cache state more than longer ones.
+        Returns a list of (name, baseline, current, ratio, regressed) for benchmarks in both.
+    """
+    rows = []
+    for name, current in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous is None or not previous.get(metric):
+            continue
+        ratio = current[metric] / previous[metric]
+        allowed = max(tolerance, fast_tolerance) if previous[metric] < fast_sec else tolerance
+        rows.append((name, previous[metric], current[metric], ratio, ratio > 1.0 + allowed))
+    return rows
+
+
+if __name__ == '__main__':
+    print("=== Benchmark Harness ===")
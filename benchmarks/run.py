@@ -0,0 +1,316 @@
+# run.py
+# Offline benchmark suite for the client stack. No gateway needed: HTTP and websocket benchmarks use local servers.
+# Usage (from the repository root):
+#   python -m benchmarks.run                          run everything, compare with benchmarks/baseline.json
+#   python -m benchmarks.run --only http,config       run some groups
+#   python -m benchmarks.run --output results.json    also write the results
+#   python -m benchmarks.run --update-baseline        store the results as the new baseline
+# Exit code 1 when a benchmark is slower than the baseline by more than --tolerance (--fast-tolerance below 10 us).
+# Every group runs --repeat times and the best run counts. Groups with regressions run up to --confirm more times
+# before they are reported, so a burst of load on the machine does not fail the check.
+# Baselines are machine specific: regenerate benchmarks/baseline.json on the machine used for comparisons.
+import argparse
+import asyncio
+import json
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import certifi
+import websockets
+
+from benchmarks import bench
+from ib.clientportal_http import ClientPortalHttp
+from ib.clientportal_http_async import ClientPortalHttpAsync
+from ib.clientportal_websockets import ClientPortalWebsocketsBase
+from ib.dispatch import Message, MessageDispatcher
+from ib.endpoints import Endpoints
+from ib.simulator import GatewaySimulator
+from ib.streamlog import StreamReader, StreamRecorder
+from lib import log as log_config
+from lib.certificate import Certificate
+from lib.configuration.configuration import Configuration
+from lib.httpendpoints import HttpEndpoints
+from lib.jsonstream import iter_json
+from lib.scheduler import PeriodicScheduler
+
+BASELINE_PATH = Path(__file__).with_name('baseline.json')
+CONFIG_PATH = Path(__file__).resolve().parent.parent / 'lib' / 'configuration' / 'test'
+
+
+def bench_http():
+    """ Blocking and asyncio request round-trips against the gateway simulator """
+    results = {}
+    gateway = GatewaySimulator(seed=1)
+    gateway.add_trades(50)
+    gateway.start_background()
+    try:
+        client = ClientPortalHttp(scheduler=PeriodicScheduler(autostart=False))
+        client.url_http = gateway.url_http
+        results['http.get_roundtrip'] = bench.measure(client.clientrequest_validate, samples=200, inner=1)
+        results['http.post_roundtrip'] = bench.measure(client.clientrequest_authentication_status, samples=200,
+                                                       inner=1)
+        # without coalescing, so every item is a gateway round-trip
+        client.coalesce_methods = ()
+        items = [('GET', Endpoints.BrokerageAccounts.value)] * 50
+        results['http.batch_50'] = bench.measure(lambda: client.clientrequest_batch(items), samples=20, inner=1)
+        client.session_pool.close()
+
+        async def run_async():
+            async with ClientPortalHttpAsync() as async_client:
+                async_client.url_http = gateway.url_http
+                async_client.coalesce_methods = ()
+                return {
+                    'http_async.get_roundtrip': await bench.measure_async(async_client.clientrequest_validate,
+                                                                          samples=200),
+                    'http_async.batch_50': await bench.measure_async(
+                        lambda: async_client.clientrequest_batch(items), samples=20),
+                }
+        results.update(asyncio.run(run_async()))
+    finally:
+        gateway.stop_background()
+    return results
+
+
+def bench_decode():
+    """ check_response() decoding of trade lists of realistic sizes """
+    results = {}
+    gateway = GatewaySimulator(seed=1)
+    for count in (10, 1000, 10000):
+        gateway.trades.clear()
+        gateway.add_trades(count)
+        content = json.dumps(gateway.trades).encode()
+        resp = SimpleNamespace(status_code=200, ok=True, content=content)
+        name = f'decode.trades_{count}_{len(content) // 1024}kb'
+        results[name] = bench.measure(lambda: HttpEndpoints.check_response('', resp, None), samples=20)
+        results[name + '_lazy'] = bench.measure(lambda: HttpEndpoints.check_response('', resp, None, lazy_json=True),
+                                                samples=20)
+        chunks = [content[i:i + 64 * 1024] for i in range(0, len(content), 64 * 1024)]
+        results[name + '_stream'] = bench.measure(lambda: sum(1 for _ in iter_json(chunks)), samples=20)
+    return results
+
+
+def tick_frames(count, conids=8):
+    return [json.dumps({'topic': f'smd+{1000 + i % conids}', 'conid': 1000 + i % conids, '_updated': i,
+                        '31': f'{100 + i % 100 / 100:.2f}', '84': '99.99', '86': '100.01', '7059': '100'})
+            for i in range(count)]
+
+
+def bench_websocket():
+    """ Frame parse + dispatch in process, and receive + dispatch over a local websocket """
+    results = {}
+    frames = tick_frames(10000)
+    results['ws.parse'] = bench.measure(lambda: Message.parse(frames[0]), samples=30)
+
+    async def dispatch_all():
+        dispatcher = MessageDispatcher()
+        handled = []
+        dispatcher.register('smd', handled.append)
+        dispatcher.open()
+        runner = asyncio.create_task(dispatcher.run())
+        for frame in frames:
+            await dispatcher.feed(frame)
+        dispatcher.close()
+        await runner
+
+    async def dispatch_bench():
+        return await bench.measure_async(dispatch_all, samples=10)
+
+    result = asyncio.run(dispatch_bench())
+    results['ws.dispatch_10000'] = result
+
+    async def receive_bench():
+        count = len(frames)
+
+        async def gateway(websocket):
+            await websocket.send('{"topic": "system", "success": "bench"}')
+            for frame in frames:
+                await websocket.send(frame)
+            await websocket.wait_closed()
+
+        samples = []
+        async with websockets.serve(gateway, '127.0.0.1', 0) as server:
+            url = f'ws://127.0.0.1:{list(server.sockets)[0].getsockname()[1]}'
+            for _ in range(10):
+                done = threading.Event()
+                received = []
+
+                def on_tick(message):
+                    received.append(message)
+                    if len(received) == count:
+                        done.set()
+
+                cp = ClientPortalWebsocketsBase()
+                cp.url = url
+                cp.heartbeat_sec = 3600
+                cp.dispatcher.register('smd', on_tick)
+                started = time.perf_counter()
+                await asyncio.get_running_loop().run_in_executor(None, cp.start_background, False)
+                await asyncio.get_running_loop().run_in_executor(None, done.wait, 30)
+                samples.append((time.perf_counter() - started) / count)
+                cp.stop()
+                await asyncio.get_running_loop().run_in_executor(None, cp.join, 5)
+        return bench.summarize(samples, len(samples) * count)
+
+    results['ws.receive_dispatch_10000'] = asyncio.run(receive_bench())
+
+    with tempfile.TemporaryDirectory() as folder:
+        def record_all():
+            with StreamRecorder(folder, prefix='bench') as recorder:
+                for frame in frames:
+                    recorder.record(frame)
+
+        results['ws.record_10000'] = bench.measure(record_all, samples=10, inner=1)
+        # keep a single recording for the replay benchmark
+        for path in Path(folder).iterdir():
+            path.unlink()
+        record_all()
+
+        async def replay_bench():
+            dispatcher = MessageDispatcher()
+            dispatcher.register('smd', lambda message: None)
+            with StreamReader(folder, prefix='bench') as reader:
+                return await bench.measure_async(lambda: reader.replay(dispatcher), samples=10)
+
+        results['ws.replay_10000'] = asyncio.run(replay_bench())
+    return results
+
+
+def bench_config():
+    """ Configuration construction (plain and from snapshot) and get() """
+    results = {}
+    infile = str(CONFIG_PATH / 'config.ini')
+    configspec = str(CONFIG_PATH / 'config_spec.ini')
+    results['config.construct'] = bench.measure(lambda: Configuration(infile=infile, configspec=configspec),
+                                                samples=20)
+    with tempfile.TemporaryDirectory() as folder:
+        snapshot = Path(folder) / 'config.snapshot'
+        Configuration(infile=infile, configspec=configspec, snapshot_path=snapshot)
+        results['config.construct_snapshot'] = bench.measure(
+            lambda: Configuration(infile=infile, configspec=configspec, snapshot_path=snapshot), samples=20)
+
+    config = Configuration(infile=infile, configspec=configspec)
+    results['config.get'] = bench.measure(lambda: config.get('level1/level2/param1'), samples=30)
+    results['config.get_int'] = bench.measure(lambda: config.get_int('level1/param1'), samples=30)
+    return results
+
+
+def bench_certificate():
+    """ Certificate.get_certificate() cached and uncached """
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        path = Path(folder) / 'ca.pem'
+        shutil.copy(certifi.where(), path)
+        Certificate.clear_cache()
+        results['certificate.cached'] = bench.measure(lambda: Certificate.get_certificate(path), samples=30)
+        results['certificate.uncached'] = bench.measure(lambda: Certificate.get_certificate(path, cached=False),
+                                                        samples=20, inner=5)
+        Certificate.clear_cache()
+    return results
+
+
+BENCHMARKS = {
+    'http': bench_http,
+    'decode': bench_decode,
+    'websocket': bench_websocket,
+    'config': bench_config,
+    'certificate': bench_certificate,
+}
+
+
+def run_groups(groups, repeats, owners):
+    """ Run the groups repeats times. Returns the results of each run and records the group of every benchmark
+        in owners
+    """
+    runs = []
+    for repeat in range(repeats):
+        results = {}
+        for group in groups:
+            print(f'Running {group} ({repeat + 1}/{repeats})...', file=sys.stderr)
+            group_results = BENCHMARKS[group]()
+            owners.update(dict.fromkeys(group_results, group))
+            results.update(group_results)
+        runs.append(results)
+    return runs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks for the client stack')
+    parser.add_argument('--only', default='', help=f'comma separated groups: {",".join(BENCHMARKS)}')
+    parser.add_argument('--output', help='write results (JSON) to this file')
+    parser.add_argument('--baseline', default=str(BASELINE_PATH), help='baseline results to compare with')
+    parser.add_argument('--update-baseline', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed slowdown (fraction)')
+    parser.add_argument('--fast-tolerance', type=float, default=1.0,
+                        help='allowed slowdown of benchmarks under 10 us (fraction)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each group, the best one counts')
+    parser.add_argument('--confirm', type=int, default=2,
+                        help='extra runs of groups with regressions before reporting them')
+    parser.add_argument('--metric', default='min', choices=('min', 'p50', 'p99', 'mean'),
+                        help='statistic compared with the baseline. min is the least noisy')
+    args = parser.parse_args(argv)
+
+    # logging would dominate most timings
+    log_config.disable('ib')
+    log_config.disable('lib')
+
+    groups = [group for group in args.only.split(',') if group] or list(BENCHMARKS)
+    # benchmark name -> group, for re-running a group
+    owners = {}
+    runs = run_groups(groups, max(1, args.repeat), owners)
+    results = bench.best(runs, args.metric)
+
+    baseline_path = Path(args.baseline)
+    if args.update_baseline:
+        baseline = bench.load(baseline_path)['results'] if baseline_path.exists() else {}
+        baseline.update(results)
+        bench.save(baseline_path, bench.report(baseline))
+        print(f'Baseline updated: {baseline_path}', file=sys.stderr)
+        return 0
+
+    rows = {}
+    if baseline_path.exists():
+        baseline = bench.load(baseline_path)['results']
+
+        def compare():
+            return {row[0]: row for row in bench.compare(results, baseline, args.tolerance, args.metric,
+                                                         fast_tolerance=args.fast_tolerance)}
+
+        rows = compare()
+        for _ in range(args.confirm):
+            suspects = sorted({owners[row[0]] for row in rows.values() if row[4]})
+            if not suspects:
+                break
+            # a slowdown that does not repeat was load on the machine
+            print(f'Confirming regressions in {",".join(suspects)}...', file=sys.stderr)
+            runs += run_groups(suspects, 1, owners)
+            results = bench.best(runs, args.metric)
+            rows = compare()
+
+    if args.output:
+        bench.save(args.output, bench.report(results))
+
+    print(f'{"benchmark":40} {"p50 (us)":>12} {"p99 (us)":>12} {"ops/sec":>12} {"vs base":>8}')
+    regressed = False
+    for name, result in sorted(results.items()):
+        row = rows.get(name)
+        ratio = f'{row[3]:.2f}x' if row else '-'
+        if row and row[4]:
+            ratio += ' !'
+            regressed = True
+        print(f'{name:40} {result["p50"] * 1e6:12.1f} {result["p99"] * 1e6:12.1f} {result["ops_per_sec"]:12.0f} '
+              f'{ratio:>8}')
+
+    if regressed:
+        print(f'Regression: {args.metric} more than {args.tolerance:.0%} slower than baseline (marked !)',
+              file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,40 +1,46 @@
 # clientportal_http.py
 from overrides import overrides
-from loguru import logger
+from lib.log import Log
 
 from ib.endpoints import Endpoints
 from lib.httpendpoints import HttpEndpoints
+from lib.pacing import RequestPriority
 
+log = Log(__name__)
 
-class ClientPortalHttp(HttpEndpoints):
-    # TODO: Document ClientPortalHttp class
+
+class ClientPortalRequests:
     """
-    Interactive Brokers ClientPortal Interface (HTTP).
-    Refer to https://www.interactivebrokers.com/api/doc.html for API documentation
-    Swagger can be used to test client requests: https://interactivebrokers.github.io/cpwebapi/swagger-ui.html
-    Consult curl.trillworks.com for conversion of curl commands to Python requests
+    Interactive Brokers ClientPortal endpoint requests.
+    Shared by the blocking (ClientPortalHttp) and asyncio (ClientPortalHttpAsync) clients. Each method returns
+    whatever clientrequest_get/clientrequest_post return, so the asyncio client's versions are awaitable.
     """
-    def __init__(self):
-        super().__init__(autostart=True, timeout_sec=60, name='IB_HTTP')
-        self.name = 'HTTP'
-        # Base used by all endpoints
-        self.url_http = 'https://localhost:5000/v1/portal'
-        logger.log('DEBUG', f'Clientportal (HTTP) Started with gateway: {self.url_http}')
+    # Suggested ResponseCache TTLs for read-mostly endpoints: ResponseCache(ttl_sec=ClientPortalHttp.cache_ttl_sec)
+    cache_ttl_sec = {
+        Endpoints.Validate: 5,
+        Endpoints.BrokerageAccounts: 5,
+        Endpoints.Trades: 2,
+    }
+    # Gateway pacing limits (requests/sec): PacingScheduler(endpoint_rates=ClientPortalHttp.pacing_rates)
+    pacing_rates = {
+        Endpoints.Ping: 1,
+        Endpoints.Validate: 1 / 60,
+        Endpoints.Trades: 1 / 5,
+    }
 
-    @overrides
-    def watchdog_task(self):
-        # super().watchdog_task()
-        result = self.clientrequest_authentication_status()
-        logger.log('DEBUG', f'Watchdog(HTTP): Status: Code:{result.statusCode}, {result.error}')
+    @staticmethod
+    def metrics_endpoints():
+        """ Endpoint paths reported by a MetricsRegistry, even before their first request """
+        return [endpoint.value for endpoint in Endpoints if endpoint is not Endpoints.Blank]
 
     # TODO: Add logging wrappers
     def clientrequest_ping(self):
         """ Send session keep-alive."""
-        return self.clientrequest_post(Endpoints.Ping.value)
+        return self.clientrequest_post(Endpoints.Ping.value, priority=RequestPriority.Housekeeping)
 
     def clientrequest_authentication_status(self):
         """ Get current session status."""
-        return self.clientrequest_post(Endpoints.AuthenticationStatus.value)
+        return self.clientrequest_post(Endpoints.AuthenticationStatus.value, priority=RequestPriority.Housekeeping)
 
     def clientrequest_reauthenticate(self):
         """ Re-authenticate a session."""
@@ -53,5 +59,52 @@ class ClientPortalHttp(HttpEndpoints):
         return self.clientrequest_get(Endpoints.BrokerageAccounts.value)
 
 
+class ClientPortalHttp(ClientPortalRequests, HttpEndpoints):
+    # TODO: Document ClientPortalHttp class
+    """
+    Interactive Brokers ClientPortal Interface (HTTP).
+    Refer to https://www.interactivebrokers.com/api/doc.html for API documentation
+    Swagger can be used to test client requests: https://interactivebrokers.github.io/cpwebapi/swagger-ui.html
+    Consult curl.trillworks.com for conversion of curl commands to Python requests
+    With a session_keeper (SessionKeeper) the watchdog runs every session_keeper.check_sec and only probes the
+    session when no recent traffic proves it alive. Otherwise auth status is polled every 60 sec.
+    On a shared scheduler each watchdog period is shifted by up to +/- jitter_sec (1), so clients started together
+    do not probe the gateway at the same moment.
+    """
+    def __init__(self, pool_size=10, session_pool=None, response_cache=None, pacing=None, scheduler=None,
+                 session_keeper=None, metrics_registry=None, jitter_sec=1):
+        self.session_keeper = session_keeper
+        timeout_sec = session_keeper.check_sec if session_keeper is not None else 60
+        if metrics_registry is not None:
+            metrics_registry.register_endpoints(self.metrics_endpoints())
+        super().__init__(autostart=True, timeout_sec=timeout_sec, name='IB_HTTP', pool_size=pool_size,
+                         session_pool=session_pool, response_cache=response_cache, pacing=pacing, scheduler=scheduler,
+                         metrics_registry=metrics_registry, jitter_sec=jitter_sec)
+        self.name = 'HTTP'
+        # Base used by all endpoints
+        self.url_http = 'https://localhost:5000/v1/portal'
+        log.debug('Clientportal (HTTP) Started with gateway: {}', self.url_http)
+
+    def clientrequest_trades_stream(self):
+        """ Trades from the current and previous 6 days, decoded while downloading: iterate result.records."""
+        return self.clientrequest_get_stream(Endpoints.Trades.value)
+
+    @overrides
+    def on_result(self, method, endpoint, result):
+        if self.session_keeper is not None:
+            self.session_keeper.record_http(result)
+
+    @overrides
+    def watchdog_task(self):
+        # super().watchdog_task()
+        if self.session_keeper is not None:
+            state = self.session_keeper.check(self)
+            log.debug('Watchdog(HTTP): Session {}', state.name)
+            return
+
+        result = self.clientrequest_authentication_status()
+        log.debug('Watchdog(HTTP): Status: Code:{}, {}', result.statusCode, result.error)
+
+
 if __name__ == '__main__':
     print("=== IB Client Portal (HTTP) ===")
@@ -0,0 +1,41 @@
+# clientportal_http_async.py
+from overrides import overrides
+from lib.log import Log
+
+from ib.clientportal_http import ClientPortalRequests
+from lib.asynchttpendpoints import AsyncHttpEndpoints
+
+log = Log(__name__)
+
+
+class ClientPortalHttpAsync(ClientPortalRequests, AsyncHttpEndpoints):
+    """
+    Interactive Brokers ClientPortal Interface (HTTP, asyncio).
+    Same endpoints as ClientPortalHttp, but every clientrequest_* method is awaitable. Intended to share an event
+    loop with ClientPortalWebsocketsBase. Unlike ClientPortalHttp, no background watchdog thread is started.
+    With a session_keeper (SessionKeeper) every gateway response is reported to it, so HTTP traffic on this client
+    keeps the session from being probed. The probes themselves are not scheduled here: run
+    session_keeper.check_async(client) on an AsyncPeriodicScheduler.
+    Example:
+        async with ClientPortalHttpAsync() as client:
+            result = await client.clientrequest_authentication_status()
+    """
+    def __init__(self, pool_size=10, session_pool=None, response_cache=None, pacing=None, metrics_registry=None,
+                 session_keeper=None):
+        self.session_keeper = session_keeper
+        if metrics_registry is not None:
+            metrics_registry.register_endpoints(self.metrics_endpoints())
+        super().__init__(name='IB_HTTP_ASYNC', pool_size=pool_size, session_pool=session_pool,
+                         response_cache=response_cache, pacing=pacing, metrics_registry=metrics_registry)
+        # Base used by all endpoints
+        self.url_http = 'https://localhost:5000/v1/portal'
+        log.debug('Clientportal (HTTP async) Started with gateway: {}', self.url_http)
+
+    @overrides
+    def on_result(self, method, endpoint, result):
+        if self.session_keeper is not None:
+            self.session_keeper.record_http(result)
+
+
+if __name__ == '__main__':
+    print("=== IB Client Portal (HTTP async) ===")
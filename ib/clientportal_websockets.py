@@ -1,13 +1,21 @@
 # clientportal_websockets.py
 import asyncio
+import queue
+import random
+import threading
+import time
 import websockets
 from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from enum import Enum
 from pathlib import Path
 
-from loguru import logger
-
+from ib.dispatch import MessageDispatcher, OverflowPolicy
+from ib.subscriptions import SubscriptionManager
 from lib.certificate import Certificate, CertificateError
+from lib.log import Log
+
+log = Log(__name__)
 
 
 class ClientPortalWebsocketsError(Enum):
@@ -18,39 +26,196 @@ class ClientPortalWebsocketsError(Enum):
     Connection_Failed = 4
 
 
+@dataclass
+class ConnectionMetrics:
+    """ Connection history of a supervised websocket """
+    connects: int = 0
+    reconnects: int = 0
+    # total time without a connection between the first connect and now (seconds)
+    downtime_sec: float = 0.0
+    messages_received: int = 0
+    # messages estimated to have been missed while disconnected (message rate of the previous session * downtime)
+    messages_missed_estimate: float = 0.0
+    # time.monotonic() of the current connection (None while disconnected)
+    connected_since: float = None
+    # time.monotonic() of the last disconnect (None while connected)
+    disconnected_since: float = None
+
+
 # TODO: Document ClientPortalWebsocketsBase class
 class ClientPortalWebsocketsBase:
     """
     Interactive Brokers ClientPortal Interface (Websocket).
     Refer to https://interactivebrokers.github.io/cpwebapi/RealtimeSubscription.html for API documentation
     NOTE: Websocket usage also requires the UI to send the /tickle endpoint. See Websocket Ping Session docs.
+    Received frames are parsed once and queued for the dispatcher, which calls the handlers registered by topic
+    (dispatcher.register('smd', handler)) and on_message() for every message.
+    Subscriptions are requested through the subscription manager (subscriptions.subscribe_market_data(...)) and sent
+    whenever they change while connected, and in full on every new connection.
+    Parameters:
+        - queue_size (10000) = Messages buffered between receiving and handling.
+        - overflow_policy (DropOldest) = OverflowPolicy applied when handlers fall behind.
+    Supervised mode (loop(supervised=True)) reconnects after the connection drops, using exponential backoff with
+    jitter. The SSL context comes from the Certificate cache, so every attempt reuses one context. All subscriptions
+    are replayed after reconnecting.
+    Connection history is kept in metrics (ConnectionMetrics).
+    Background mode (start_background()) runs the event loop on its own thread. Synchronous code then uses the thread
+    safe methods: subscriptions.*, send_threadsafe(), get_message() (after enable_message_queue()) and
+    register_threaded_handler().
     """
-    def __init__(self):
+    def __init__(self, queue_size=10000, overflow_policy=OverflowPolicy.DropOldest):
         # Base used by all IB websocket endpoints
         self.url = 'wss://localhost:5000/v1/api/ws'
         self.connection = None
         # default websocket 'tic' heartbeat message is 60 sec
         self.heartbeat_sec = 60
-        logger.log('DEBUG', f'Clientportal (Websockets) Started with endpoint: {self.url}')
-
-    def loop(self):
-        """ Start websocket message handler and heartbeat """
+        # optional SessionKeeper. Received messages are reported to it and 'tic' is skipped while messages arrive
+        self.session_keeper = None
+        # optional MetricsRegistry, see enable_metrics()
+        self.metrics_registry = None
+        self.__tic_sent = None
+        # optional StreamRecorder (ib.streamlog). Every received frame is appended to it before dispatch
+        self.recorder = None
+        # ssl context for wss connections. Taken from the process wide Certificate cache on each connect
+        self.certificate_path = ''
+        self.ssl_context = None
+        # supervised mode reconnect delays: backoff_sec * 2^attempt, up to backoff_max_sec, +/- jitter fraction
+        self.reconnect_backoff_sec = 0.5
+        self.reconnect_backoff_max_sec = 30
+        self.reconnect_jitter = 0.2
+        self.metrics = ConnectionMetrics()
+        # log only every n-th received message (1 = all). Message payloads are truncated in the log
+        self.log_every_n_messages = 1
+        self.dispatcher = MessageDispatcher(maxsize=queue_size, policy=overflow_policy)
+        self.dispatcher.register('*', self.on_message)
+        self.subscriptions = SubscriptionManager(on_change=self.__subscriptions_changed)
+        # event loop and event used to wake the subscription sender. Only set while connected
+        self.__loop = None
+        self.__sync_event = None
+        self.__stop_event = None
+        self.__stopping = False
+        # messages received before, and message rate during, the latest session (for missed message estimates)
+        self.__session_messages = 0
+        self.__session_rate = 0.0
+        # background mode
+        self.__thread = None
+        self.__running = threading.Event()
+        self.__messages = None
+        self.__messages_maxsize = 0
+        self.__handler_executor = None
+        log.debug('Clientportal (Websockets) Started with endpoint: {}', self.url)
+
+    def loop(self, supervised=False):
+        """ Start websocket message handler and heartbeat.
+            supervised: reconnect whenever the connection is lost, until stop() is called
+        """
+        main = self.__async_supervisor() if supervised else self.__async_loop()
         try:
-            with ThreadPoolExecutor() as executor:
-                executor.submit(asyncio.get_event_loop().run_until_complete(self.__async_loop()))
+            asyncio.run(main)
 
         except Exception as e:
-            logger.log('DEBUG', f'Exception:{e}')
+            log.debug('Exception:{}', e)
 
         finally:
-            pass
+            self.__running.clear()
+
+    def start_background(self, supervised=True, timeout_sec=5):
+        """ Run loop() on a background (daemon) thread. Returns True once the event loop is running """
+        if self.__thread is not None and self.__thread.is_alive():
+            return True
+
+        self.__running.clear()
+        self.__thread = threading.Thread(target=self.loop, kwargs={'supervised': supervised}, daemon=True,
+                                         name='IB_WS')
+        self.__thread.start()
+        return self.__running.wait(timeout_sec)
+
+    def join(self, timeout_sec=None):
+        """ Wait for the background thread to finish (after stop() or, unsupervised, after disconnecting) """
+        if self.__thread is not None:
+            self.__thread.join(timeout_sec)
+            return not self.__thread.is_alive()
+        return True
+
+    def send_threadsafe(self, message):
+        """ Send a message from any thread. Returns a concurrent.futures.Future for the send """
+        loop, connection = self.__loop, self.connection
+        if loop is None or connection is None or loop.is_closed():
+            raise ConnectionError('Websocket is not connected')
+        return asyncio.run_coroutine_threadsafe(connection.send(message), loop)
+
+    def enable_message_queue(self, topics=('*',), maxsize=10000):
+        """ Copy messages of the given topics to a thread safe queue read with get_message().
+            When more than maxsize messages are waiting, the oldest are discarded.
+        """
+        if self.__messages is None:
+            self.__messages = queue.SimpleQueue()
+        self.__messages_maxsize = maxsize
+        for topic in topics:
+            self.dispatcher.register(topic, self.__queue_message)
+
+    def get_message(self, timeout_sec=None):
+        """ Next queued message (see enable_message_queue()), or None if none arrives within timeout_sec """
+        try:
+            return self.__messages.get(timeout=timeout_sec)
+        except queue.Empty:
+            return None
+
+    def register_threaded_handler(self, topic, handler):
+        """ Call handler(message) for topic on a worker thread instead of the event loop.
+            Handlers share one worker, so messages are handled in the order received.
+        """
+        if self.__handler_executor is None:
+            self.__handler_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='IB_WS_handler')
+        executor = self.__handler_executor
+        self.dispatcher.register(topic, lambda message: executor.submit(handler, message))
+
+    def __queue_message(self, message):
+        messages = self.__messages
+        messages.put(message)
+        if messages.qsize() > self.__messages_maxsize:
+            try:
+                messages.get_nowait()
+            except queue.Empty:
+                pass
+
+    def stop(self):
+        """ Close the connection and end supervision. May be called from any thread """
+        self.__stopping = True
+        loop, connection, stop_event = self.__loop, self.connection, self.__stop_event
+        if loop is not None and not loop.is_closed():
+            if stop_event is not None:
+                loop.call_soon_threadsafe(stop_event.set)
+            if connection is not None:
+                asyncio.run_coroutine_threadsafe(connection.close(), loop)
+
+    def reconnect_delay(self, attempt):
+        """ Seconds to wait before reconnect attempt number attempt (0 = first) """
+        delay = min(self.reconnect_backoff_max_sec, self.reconnect_backoff_sec * (2 ** attempt))
+        return max(0.0, delay * (1 + random.uniform(-self.reconnect_jitter, self.reconnect_jitter)))
 
     def on_connection(self, msg):
         """ Websocket connection opened """
         pass
 
+    def enable_metrics(self, registry):
+        """ Report message counts/rates per topic, receive-to-dispatch lag and 'tic' round-trips to registry
+            (MetricsRegistry)
+        """
+        if self.metrics_registry is None:
+            self.dispatcher.register('*', self.__record_metrics)
+        self.metrics_registry = registry
+
+    def __record_metrics(self, message):
+        now = time.monotonic()
+        self.metrics_registry.record_message(message.topic, now - message.received)
+        # the gateway answers each 'tic' with a 'tic' topic message
+        if message.topic == 'tic' and self.__tic_sent is not None:
+            self.metrics_registry.record_heartbeat_rtt(message.received - self.__tic_sent)
+            self.__tic_sent = None
+
     def on_message(self, msg):
-        """ Websocket message received """
+        """ Websocket message received. msg is the parsed ib.dispatch.Message """
         pass
 
     async def __open_connection(self, url='', url_validator=None):
@@ -59,36 +224,43 @@ class ClientPortalWebsocketsBase:
             if url_validator(url) is False:
                 return ClientPortalWebsocketsError.Invalid_URL
 
-        try:
-            logger.log('DEBUG', f'Certificate: Acquiring')
-            result = Certificate.get_certificate()
+        # the cached context is shared with other clients and only reloaded when the file changes.
+        # Plain ws:// needs no certificate
+        if self.url.startswith('wss:'):
+            try:
+                log.debug('Certificate: Acquiring')
+                result = Certificate.get_certificate(self.certificate_path)
 
-        except Exception as e:
-            logger.log('DEBUG', f'EXCEPTION: {e}')
-            return ClientPortalWebsocketsError.Unknown
+            except Exception as e:
+                log.debug('EXCEPTION: {}', e)
+                return ClientPortalWebsocketsError.Unknown
 
-        finally:
-            if result.error != CertificateError.Ok:
-                logger.log('DEBUG', f'Certificate: Problems obtaining certificate: {result.error}')
-                return ClientPortalWebsocketsError.Invalid_Certificate
+            finally:
+                if result.error != CertificateError.Ok:
+                    log.debug('Certificate: Problems obtaining certificate: {}', result.error)
+                    return ClientPortalWebsocketsError.Invalid_Certificate
+
+            self.ssl_context = result.ssl_context
 
         try:
-            logger.log('DEBUG', f'Connection: Opening "{self.url}"')
-            self.connection = await websockets.connect(self.url, ssl=result.ssl_context)
-            logger.log('DEBUG', f'Connection: Established "{self.url}"')
+            log.debug('Connection: Opening "{}"', self.url)
+            # ssl only applies to wss:// urls
+            ssl_context = self.ssl_context if self.url.startswith('wss:') else None
+            self.connection = await websockets.connect(self.url, ssl=ssl_context)
+            log.debug('Connection: Established "{}"', self.url)
             ret_code = ClientPortalWebsocketsError.Ok
 
             # Once connection is achieved, IB provides confirmation message with username
             connect_msg = await self.connection.recv()
-            logger.log('DEBUG', f'Connection: Confirmation {connect_msg}')
+            log.debug('Connection: Confirmation {}', connect_msg)
             self.on_connection(connect_msg)
 
         except websockets.WebSocketException as e:
-            logger.log('DEBUG', f'EXCEPTION: Websockets {e}')
+            log.debug('EXCEPTION: Websockets {}', e)
             ret_code = ClientPortalWebsocketsError.Connection_Failed
 
         except Exception as e:
-            logger.log('DEBUG', f'EXCEPTION: General exception: {e}')
+            log.debug('EXCEPTION: General exception: {}', e)
             ret_code = ClientPortalWebsocketsError.Unknown
 
         finally:
@@ -96,49 +268,166 @@ class ClientPortalWebsocketsBase:
 
     async def __websocket_msg_handler(self):
         if self.connection is not None:
-            logger.log('DEBUG', f'Websocket: Start message handler')
+            log.debug('Websocket: Start message handler')
             try:
                 while True:
                     msg = await self.connection.recv()
-                    logger.log('DEBUG', f'Websocket: Received {msg}')
+                    self.metrics.messages_received += 1
+                    if self.session_keeper is not None:
+                        self.session_keeper.record_websocket()
+                    if self.recorder is not None:
+                        self.recorder.record(msg)
+                    if log.sample('received', self.log_every_n_messages):
+                        log.debug('Websocket: Received {}', log.payload(msg))
+                    await self.dispatcher.feed(msg)
 
             except Exception as e:
-                logger.log('DEBUG', f'EXCEPTION: {e}')
+                log.debug('EXCEPTION: {}', e)
 
             finally:
-                logger.log('DEBUG', f'Websocket: Exited message handler')
+                # let the dispatcher finish the queued messages and exit
+                self.dispatcher.close()
+                log.debug('Websocket: Exited message handler')
 
         else:
-            logger.log('DEBUG', f'Websocket: Handler has no valid connection')
+            log.debug('Websocket: Handler has no valid connection')
 
     async def __websocket_heartbeat(self):
         if self.connection is not None:
-            logger.log('DEBUG', f'Websocket: Start heartbeat')
+            log.debug('Websocket: Start heartbeat')
 
             try:
                 while True:
-                    await self.connection.send('tic')
+                    if self.session_keeper is None or self.session_keeper.websocket_idle(self.heartbeat_sec):
+                        self.__tic_sent = time.monotonic()
+                        await self.connection.send('tic')
                     await asyncio.sleep(self.heartbeat_sec)
 
             except Exception as e:
-                logger.log('DEBUG', f'EXCEPTION: {e}')
+                log.debug('EXCEPTION: {}', e)
 
             finally:
-                logger.log('DEBUG', f'Exited websocket heartbeat')
+                log.debug('Exited websocket heartbeat')
+
+    async def __websocket_subscriptions(self):
+        log.debug('Websocket: Start subscription sender')
+        event = self.__sync_event
+        try:
+            while True:
+                await event.wait()
+                event.clear()
+                await self.subscriptions.sync(self.connection.send)
+
+        except Exception as e:
+            log.debug('EXCEPTION: {}', e)
+
+        finally:
+            log.debug('Websocket: Exited subscription sender')
+
+    def __subscriptions_changed(self):
+        """ Wake the subscription sender. May be called from any thread """
+        loop, event = self.__loop, self.__sync_event
+        if loop is not None and event is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(event.set)
+
+    async def __async_supervisor(self):
+        """ Run the connection, reconnecting with backoff until stop() """
+        self.__loop = asyncio.get_running_loop()
+        self.__stop_event = asyncio.Event()
+        self.__stopping = False
+        self.__running.set()
+        attempt = 0
+        try:
+            while not self.__stopping:
+                connected = await self.__async_loop()
+                if self.__stopping:
+                    break
+
+                attempt = 0 if connected else attempt + 1
+                delay = self.reconnect_delay(attempt)
+                log.debug('Websocket: Reconnecting in {:.2f}s (attempt {})', delay, attempt + 1)
+                try:
+                    await asyncio.wait_for(self.__stop_event.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+        finally:
+            self.__stop_event = None
+            log.debug('Websocket: Exited supervisor')
+
+    def __connected(self):
+        """ Update metrics for a new connection """
+        metrics = self.metrics
+        now = time.monotonic()
+        if metrics.disconnected_since is not None:
+            gap = now - metrics.disconnected_since
+            metrics.downtime_sec += gap
+            metrics.messages_missed_estimate += gap * self.__session_rate
+            metrics.reconnects += 1
+            log.debug('Websocket: Reconnected after {:.2f}s (reconnects={})', gap, metrics.reconnects)
+        metrics.connects += 1
+        metrics.connected_since = now
+        metrics.disconnected_since = None
+        self.__session_messages = metrics.messages_received
+
+    def __disconnected(self):
+        """ Update metrics after losing a connection """
+        metrics = self.metrics
+        now = time.monotonic()
+        duration = now - metrics.connected_since
+        messages = metrics.messages_received - self.__session_messages
+        self.__session_rate = messages / duration if duration > 0 else 0.0
+        metrics.connected_since = None
+        metrics.disconnected_since = now
+        if self.recorder is not None:
+            self.recorder.flush()
+        if self.session_keeper is not None and not self.__stopping:
+            self.session_keeper.websocket_lost()
 
     async def __async_loop(self):
+        """ Run one connection until it closes. Returns True if the connection was established """
+        connected = False
+        self.__loop = asyncio.get_running_loop()
+        self.__running.set()
         try:
             task_connection = asyncio.create_task(self.__open_connection())
             # msg_handler and heartbeat depend on opening a valid connection
             ret = await task_connection
             if ret == ClientPortalWebsocketsError.Ok:
-                status = await asyncio.gather(self.__websocket_msg_handler(), self.__websocket_heartbeat())
+                connected = True
+                self.__connected()
+                # stop() may have been called while the connection was opening
+                if self.__stopping:
+                    await self.connection.close()
+                self.dispatcher.open()
+                dispatcher = asyncio.create_task(self.dispatcher.run())
+
+                # new connection: every desired subscription has to be sent again
+                self.subscriptions.reset_active()
+                self.__sync_event = asyncio.Event()
+                self.__sync_event.set()
+
+                senders = [asyncio.create_task(self.__websocket_heartbeat()),
+                           asyncio.create_task(self.__websocket_subscriptions())]
+                await self.__websocket_msg_handler()
+
+                # receive loop ended (connection closed). Stop sending and let the dispatcher drain its queue
+                self.__sync_event = None
+                for task in senders:
+                    task.cancel()
+                await asyncio.gather(*senders, return_exceptions=True)
+                await dispatcher
 
         except Exception as e:
-            logger.log('DEBUG', f'EXCEPTION: {e}')
+            log.debug('EXCEPTION: {}', e)
 
         finally:
-            logger.log('DEBUG', f'Websocket: Exited loop')
+            if connected:
+                self.__disconnected()
+            self.connection = None
+            log.debug('Websocket: Exited loop')
+
+        return connected
 
 
 if __name__ == '__main__':
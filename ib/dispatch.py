@@ -0,0 +1,240 @@
+# dispatch.py
+# Websocket message dispatch: parse each frame once, queue it, and route it to handlers registered by topic.
+# Receiving and handling are decoupled by a bounded queue so slow handlers never stall the socket.
+import asyncio
+import inspect
+import time
+from collections import deque
+from enum import Enum
+
+from lib import jsoncodec
+from lib.log import Log
+
+log = Log(__name__)
+
+
+class OverflowPolicy(Enum):
+    DropOldest = 0      # discard the oldest queued message to make room
+    Block = 1           # receive loop waits for room (back-pressure onto the socket)
+    CoalesceLatest = 2  # always merge market data updates for a conid already queued; when full, drop oldest
+
+
+class Message:
+    """ Parsed websocket frame.
+        topic: topic type without arguments, e.g. 'smd' for 'smd+265598'. 'unknown' if the frame has no topic.
+        key: coalescing key for market data (conid), otherwise None.
+        data: decoded JSON (dict), or None if the frame was not JSON.
+        raw: frame as received.
+        received: time.monotonic() when the frame was received.
+    """
+    __slots__ = ('topic', 'key', 'data', 'raw', 'received')
+
+    def __init__(self, topic, key, data, raw, received):
+        self.topic = topic
+        self.key = key
+        self.data = data
+        self.raw = raw
+        self.received = received
+
+    def __repr__(self):
+        return f'Message(topic={self.topic}, key={self.key}, data={self.data})'
+
+    @staticmethod
+    def parse(raw, received=None):
+        """ Decode a frame and determine its topic """
+        received = time.monotonic() if received is None else received
+        try:
+            data = jsoncodec.decode(raw)
+        except ValueError:
+            return Message('unknown', None, None, raw, received)
+
+        if not isinstance(data, dict):
+            return Message('unknown', None, data, raw, received)
+
+        topic = data.get('topic')
+        if not isinstance(topic, str):
+            return Message('unknown', None, data, raw, received)
+        topic_type, _, topic_args = topic.partition('+')
+        key = None
+        if topic_type == 'smd':
+            key = data.get('conid', topic_args)
+        return Message(topic_type, key, data, raw, received)
+
+
+class MessageQueue:
+    """
+    MessageQueue
+    Bounded asyncio queue of Messages between the receive loop (single producer) and the dispatcher (single consumer)
+    DropOldest and Block only act when the queue is full. CoalesceLatest also merges every market data update into
+    a queued update for the same conid while the queue has room, so handlers always see the latest fields once.
+    Parameters:
+        - maxsize (10000) = Maximum number of queued messages.
+        - policy (DropOldest) = OverflowPolicy for a full queue (CoalesceLatest: see above).
+    """
+    def __init__(self, maxsize=10000, policy=OverflowPolicy.DropOldest):
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self.coalesced = 0
+        self.__queue = deque()
+        # messages still queued which later updates may be merged into, by key
+        self.__pending = {}
+        self.__not_empty = asyncio.Event()
+        self.__not_full = asyncio.Event()
+        self.__not_full.set()
+        self.__closed = False
+
+    def __len__(self):
+        return len(self.__queue)
+
+    @property
+    def closed(self):
+        return self.__closed
+
+    async def put(self, message: Message):
+        """ Queue a message, applying the overflow policy when full """
+        if self.policy == OverflowPolicy.CoalesceLatest and message.key is not None:
+            queued = self.__pending.get(message.key)
+            if queued is not None:
+                # market data frames carry only changed fields, so merging keeps the latest value of every field
+                queued.data.update(message.data)
+                queued.raw = message.raw
+                self.coalesced += 1
+                return
+
+        while len(self.__queue) >= self.maxsize:
+            if self.policy == OverflowPolicy.Block and not self.__closed:
+                self.__not_full.clear()
+                await self.__not_full.wait()
+            else:
+                self.__forget(self.__queue.popleft())
+                self.dropped += 1
+
+        self.__queue.append(message)
+        if self.policy == OverflowPolicy.CoalesceLatest and message.key is not None:
+            self.__pending[message.key] = message
+        self.__not_empty.set()
+
+    async def get(self):
+        """ Next message, or None once the queue is closed and empty """
+        while not self.__queue:
+            if self.__closed:
+                return None
+            self.__not_empty.clear()
+            await self.__not_empty.wait()
+
+        message = self.__queue.popleft()
+        self.__forget(message)
+        self.__not_full.set()
+        return message
+
+    def close(self):
+        """ Stop accepting waits. get() returns None after the remaining messages are consumed """
+        self.__closed = True
+        self.__not_empty.set()
+        self.__not_full.set()
+
+    def __forget(self, message):
+        if message.key is not None and self.__pending.get(message.key) is message:
+            del self.__pending[message.key]
+
+
+class MessageDispatcher:
+    """
+    MessageDispatcher
+    Routes parsed websocket messages to handlers registered by topic ('smd', 'sor', 'spl', 'str', 'system', 'tic',
+    ...). Handlers registered for '*' receive every message. Handlers are called with the Message and may be plain
+    functions or coroutine functions.
+    Plain functions run on the event loop thread and must not block: that would stall receiving and the heartbeat.
+    Register blocking handlers with register(..., blocking=True) to run them on the default executor.
+    run() yields to the event loop every yield_every messages, so a backlog does not starve the other tasks.
+    Parameters:
+        - maxsize (10000) = Size of the queue between receiving and handling.
+        - policy (DropOldest) = OverflowPolicy when handlers fall behind.
+        - yield_every (100) = Messages dispatched by run() between yields to the event loop.
+    """
+    def __init__(self, maxsize=10000, policy=OverflowPolicy.DropOldest, yield_every=100):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.yield_every = yield_every
+        self.handlers = {}
+        # wrappers of handlers registered with blocking=True, by (topic, handler)
+        self.__offloaded = {}
+        # handlers per topic including the '*' handlers, built on first use
+        self.__routes = {}
+        self.dispatched = 0
+        self.handler_errors = 0
+        self.queue = None
+
+    def register(self, topic, handler, blocking=False):
+        """ Call handler(message) for every message of topic ('*' for all topics).
+            blocking=True runs a plain function on the default executor. It is awaited, so messages are still handled
+            in order, but the event loop keeps receiving meanwhile.
+        """
+        if blocking:
+            handler = self.__offloaded.setdefault((topic, handler), self.__offload(handler))
+        self.handlers.setdefault(topic, []).append(handler)
+        self.__routes.clear()
+
+    def unregister(self, topic, handler):
+        handler = self.__offloaded.pop((topic, handler), handler)
+        handlers = self.handlers.get(topic, [])
+        if handler in handlers:
+            handlers.remove(handler)
+        self.__routes.clear()
+
+    def open(self):
+        """ Create a new queue. Called for every connection, since a queue belongs to one event loop """
+        self.queue = MessageQueue(self.maxsize, self.policy)
+        return self.queue
+
+    async def feed(self, raw, received=None):
+        """ Parse a received frame and queue it for dispatch """
+        await self.queue.put(Message.parse(raw, received))
+
+    async def run(self):
+        """ Dispatch queued messages until the queue is closed and drained """
+        queue = self.queue
+        count = 0
+        while True:
+            message = await queue.get()
+            if message is None:
+                break
+            await self.dispatch(message)
+            count += 1
+            # queue.get() does not suspend while messages are queued
+            if count % self.yield_every == 0:
+                await asyncio.sleep(0)
+
+    def close(self):
+        if self.queue is not None:
+            self.queue.close()
+
+    async def dispatch(self, message: Message):
+        """ Call the handlers for a message's topic, then the '*' handlers """
+        self.dispatched += 1
+        route = self.__routes.get(message.topic)
+        if route is None:
+            route = self.__routes[message.topic] = self.handlers.get(message.topic, []) + self.handlers.get('*', [])
+
+        for handler in route:
+            try:
+                result = handler(message)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                self.handler_errors += 1
+                log.debug('Dispatch: Handler {} failed for {}: {}', handler, message.topic, e)
+
+    @staticmethod
+    def __offload(handler):
+        async def offloaded(message):
+            await asyncio.get_running_loop().run_in_executor(None, handler, message)
+        return offloaded
+
+
+if __name__ == '__main__':
+    print("=== Websocket Dispatch ===")
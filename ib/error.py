@@ -9,6 +9,9 @@ class Error(Enum):
     No_Error = 1
     Invalid_URL = 2
     Connection_or_Timeout = 3
+    Invalid_Request = 4     # request could not be issued (e.g. unsupported method in a batch)
+    Unknown = 5             # unexpected exception while processing a request
+    Throttled = 6           # gateway rate limit (HTTP 429) or request not released by the pacing scheduler
 
 
 if __name__ == '__main__':
@@ -1,12 +1,53 @@
 # resultrequest.py
 # Response message from IB client requests
 from ib.error import Error
+from lib import jsoncodec
 
 
 class RequestResult:
-    # Decoded message for error
-    error = Error.No_Error
-    # Client portal Web Error Code
-    statusCode = 0
-    # Client Portal JSON string
-    json: str = None
+    """ Result of a client request. Slotted, since one is created for every gateway response.
+        The JSON payload may be supplied as raw bytes (lazy decoding); it is then decoded on first read of .json
+        Streamed requests (clientrequest_get_stream) leave .json empty and deliver the payload through .records
+    """
+    __slots__ = ('error', 'statusCode', 'records', '__json', '__raw')
+
+    def __init__(self, error=Error.No_Error, statusCode=0, json=None, raw=None, records=None):
+        # Decoded message for error
+        self.error = error
+        # Client portal Web Error Code
+        self.statusCode = statusCode
+        # Client Portal JSON (decoded)
+        self.__json = json
+        # Undecoded response body, decoded into __json on first access
+        self.__raw = raw
+        # Streamed responses: iterator over the decoded records, read while the body downloads
+        self.records = records
+
+    @property
+    def json(self):
+        if self.__raw is not None:
+            self.__json = jsoncodec.decode(self.__raw)
+            self.__raw = None
+        return self.__json
+
+    @json.setter
+    def json(self, value):
+        self.__json = value
+        self.__raw = None
+
+    @property
+    def raw(self):
+        """ Undecoded response body, or None if already decoded (or never supplied) """
+        return self.__raw
+
+    @raw.setter
+    def raw(self, value):
+        self.__raw = value
+
+    @property
+    def decoded(self):
+        """ False while the payload is still held as raw bytes """
+        return self.__raw is None
+
+    def __repr__(self):
+        return f'RequestResult(error={self.error}, statusCode={self.statusCode}, decoded={self.decoded})'
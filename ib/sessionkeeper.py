@@ -0,0 +1,162 @@
+# sessionkeeper.py
+# Traffic aware keep-alive for gateway sessions
+import threading
+import time
+from enum import Enum
+
+from ib.error import Error
+from lib.log import Log
+
+log = Log(__name__)
+
+
+class SessionState(Enum):
+    Unknown = 0     # not verified yet
+    Alive = 1       # authenticated, confirmed by recent traffic or a probe
+    Degraded = 2    # probe failed, re-authentication requested
+    Lost = 3        # max_failures probes in a row failed
+
+
+class SessionKeeper:
+    """
+    SessionKeeper
+    Keeps a gateway session alive with as few housekeeping requests as possible. Successful HTTP responses and
+    received websocket messages prove the session is alive, so /tickle, auth status and websocket 'tic' are only
+    sent after idle_sec without such traffic. A failed probe, or a request failing with a connection error, makes the
+    next check probe immediately and escalates to re-authentication.
+    Parameters:
+        - idle_sec (50) = Traffic older than this no longer proves the session is alive.
+        - check_sec (10) = Suggested interval for calling check(). Short, since checks are free while traffic flows.
+        - max_failures (3) = Failed probes in a row before the session is reported Lost.
+        - on_state_change (None) = Called with (old, new) SessionState on every transition.
+    Usage: ClientPortalHttp(session_keeper=keeper) and ClientPortalWebsocketsBase.session_keeper = keeper.
+    ClientPortalHttpAsync(session_keeper=keeper) only reports its traffic; run check_async() for it on an
+    AsyncPeriodicScheduler.
+    """
+    # request errors which suggest the session (rather than the request) failed
+    suspect_errors = (Error.Connection_or_Timeout, Error.Invalid_URL)
+
+    def __init__(self, idle_sec=50, check_sec=10, max_failures=3, on_state_change=None, clock=time.monotonic):
+        self.idle_sec = idle_sec
+        self.check_sec = check_sec
+        self.max_failures = max_failures
+        self.on_state_change = on_state_change
+        self.clock = clock
+        self.state = SessionState.Unknown
+        self.last_http = None
+        self.last_websocket = None
+        self.failures = 0
+        # counters
+        self.probes = 0
+        self.skipped = 0
+        self.reauthentications = 0
+        self.__suspect = False
+        self.__lock = threading.Lock()
+        self.__probing = False
+
+    def record_http(self, result):
+        """ Note a gateway HTTP response (RequestResult) """
+        if result.error == Error.No_Error:
+            self.last_http = self.clock()
+        elif result.error in self.suspect_errors:
+            self.__suspect = True
+
+    def record_websocket(self):
+        """ Note a received websocket message """
+        self.last_websocket = self.clock()
+
+    def websocket_lost(self):
+        """ Note a dropped websocket connection. The session is verified on the next check """
+        self.last_websocket = None
+        self.__suspect = True
+
+    def last_traffic(self):
+        """ clock() of the latest successful traffic on any channel (None if there was none) """
+        times = [t for t in (self.last_http, self.last_websocket) if t is not None]
+        return max(times) if times else None
+
+    def alive(self, now=None):
+        """ True if recent traffic proves the session is alive """
+        now = self.clock() if now is None else now
+        last = self.last_traffic()
+        return (self.state == SessionState.Alive and not self.__suspect
+                and last is not None and now - last < self.idle_sec)
+
+    def websocket_idle(self, window_sec):
+        """ True if the websocket received nothing for window_sec, i.e. a 'tic' heartbeat is needed """
+        last = self.last_websocket
+        return last is None or self.clock() - last >= window_sec
+
+    def check(self, client):
+        """ Probe the session through client (ClientPortalRequests) unless traffic proves it alive.
+            Returns the resulting SessionState.
+        """
+        with self.__lock:
+            if not self.__probe_needed():
+                return self.state
+            alive = self.authenticated(client.clientrequest_ping()) or \
+                self.authenticated(client.clientrequest_authentication_status())
+            if not self.__probed(alive):
+                client.clientrequest_reauthenticate()
+            return self.state
+
+    async def check_async(self, client):
+        """ check() for the asyncio client (ClientPortalHttpAsync), awaiting its requests. Schedule it on an
+            AsyncPeriodicScheduler: scheduler.schedule(functools.partial(keeper.check_async, client), keeper.check_sec)
+            A check arriving while another one is still probing returns the current state.
+        """
+        if self.__probing or not self.__probe_needed():
+            return self.state
+        self.__probing = True
+        try:
+            alive = self.authenticated(await client.clientrequest_ping()) or \
+                self.authenticated(await client.clientrequest_authentication_status())
+            if not self.__probed(alive):
+                await client.clientrequest_reauthenticate()
+        finally:
+            self.__probing = False
+        return self.state
+
+    def __probe_needed(self):
+        if self.alive():
+            self.skipped += 1
+            return False
+        self.probes += 1
+        self.__suspect = False
+        return True
+
+    def __probed(self, alive):
+        """ Apply a probe outcome. False if the session must be re-authenticated """
+        if alive:
+            self.failures = 0
+            self.__set_state(SessionState.Alive)
+            return True
+
+        self.failures += 1
+        self.__suspect = True
+        self.__set_state(SessionState.Lost if self.failures >= self.max_failures else SessionState.Degraded)
+        self.reauthentications += 1
+        log.debug('SessionKeeper: Probe failed ({}/{}), re-authenticating', self.failures, self.max_failures)
+        return False
+
+    @staticmethod
+    def authenticated(result):
+        """ True if a /tickle or auth status result reports an authenticated session """
+        if result.error != Error.No_Error or not isinstance(result.json, dict):
+            return False
+        status = result.json
+        # /tickle nests the brokerage session status under iserver.authStatus
+        if 'iserver' in status:
+            status = status['iserver'].get('authStatus', {}) if isinstance(status['iserver'], dict) else {}
+        return status.get('authenticated') is True
+
+    def __set_state(self, state):
+        old, self.state = self.state, state
+        if old != state:
+            log.debug('SessionKeeper: {} -> {}', old.name, state.name)
+            if self.on_state_change is not None:
+                self.on_state_change(old, state)
+
+
+if __name__ == '__main__':
+    print("=== Session Keeper ===")
@@ -0,0 +1,333 @@
+# simulator.py
+# Local stand-in for the Client Portal gateway, for offline testing and load measurements
+import asyncio
+import collections
+import json
+import random
+import ssl
+import threading
+import time
+
+from aiohttp import web, WSMsgType
+
+from ib.endpoints import Endpoints
+from lib.log import Log
+from lib.pacing import TokenBucket
+
+log = Log(__name__)
+
+
+class GatewaySimulator:
+    """
+    GatewaySimulator
+    Serves the endpoints in ib.endpoints (below /v1/portal and /v1/api) and the /v1/api/ws websocket.
+    HTTP requests can be delayed, failed and rate limited. Websocket market data subscriptions (smd+<conid>+{...})
+    are answered with a synthetic tick stream at smd_rate_per_sec per subscription.
+    Parameters:
+        - host ('127.0.0.1') / port (0) = Listening address. Port 0 picks a free port (see url_http / url_ws).
+        - certificate_path / key_path (None) = PEM certificate chain and key. When given, https:// and wss:// are used.
+        - latency_sec (0) = Delay added to every HTTP response, plus up to latency_jitter_sec (0) at random.
+        - error_rate (0) = Fraction of HTTP requests answered with error_status (500).
+        - rate_limit_per_sec (None) = Requests per second accepted over all endpoints. Excess requests get 429.
+        - endpoint_rates (None) = {Endpoints or path: requests per second} limits for single endpoints.
+        - smd_rate_per_sec (10) = Ticks per second sent for each market data subscription.
+        - seed (None) = Random seed, for reproducible latencies, errors and prices.
+    Usage (asyncio):
+        async with GatewaySimulator() as gateway:
+            client.url_http = gateway.url_http
+    Blocking clients use start_background() / stop_background(), which run the simulator on its own thread.
+    """
+    prefixes = ('/v1/portal', '/v1/api')
+    websocket_path = '/v1/api/ws'
+
+    def __init__(self, host='127.0.0.1', port=0, certificate_path=None, key_path=None, latency_sec=0.0,
+                 latency_jitter_sec=0.0, error_rate=0.0, error_status=500, rate_limit_per_sec=None,
+                 endpoint_rates=None, smd_rate_per_sec=10, seed=None):
+        self.host = host
+        self.port = port
+        self.certificate_path = certificate_path
+        self.key_path = key_path
+        self.latency_sec = latency_sec
+        self.latency_jitter_sec = latency_jitter_sec
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.smd_rate_per_sec = smd_rate_per_sec
+        self.random = random.Random(seed)
+        # session state reported by the session endpoints
+        self.authenticated = True
+        self.username = 'simuser'
+        self.accounts = ['DU0000001']
+        # trades returned by Endpoints.Trades (see add_trades)
+        self.trades = []
+        # counters
+        self.requests = collections.Counter()
+        self.errors = 0
+        self.throttled = 0
+        self.ticks_sent = 0
+        self.tics_received = 0
+        self.websocket_messages = []
+
+        self.__rate_limit = TokenBucket(rate_limit_per_sec, burst=max(1, int(rate_limit_per_sec))) \
+            if rate_limit_per_sec else None
+        self.__endpoint_limits = {}
+        for endpoint, rate in (endpoint_rates or {}).items():
+            self.set_endpoint_rate(endpoint, rate)
+        # endpoint path -> [status, ...] answered before normal processing
+        self.__injected = collections.defaultdict(collections.deque)
+        self.__runner = None
+        self.__websockets = set()
+        self.__loop = None
+        self.__thread = None
+        self.__trade_sequence = 0
+
+        self.responses = {
+            Endpoints.Ping.value: self.tickle_response,
+            Endpoints.AuthenticationStatus.value: self.auth_status_response,
+            Endpoints.Reauthenticate.value: self.reauthenticate_response,
+            Endpoints.Validate.value: self.validate_response,
+            Endpoints.Trades.value: self.trades_response,
+            Endpoints.BrokerageAccounts.value: self.accounts_response,
+        }
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    @property
+    def secure(self):
+        return self.certificate_path is not None and self.key_path is not None
+
+    @property
+    def url_http(self):
+        """ Base url for ClientPortalHttp.url_http """
+        return f'{"https" if self.secure else "http"}://{self.host}:{self.port}/v1/portal'
+
+    @property
+    def url_ws(self):
+        """ Url for ClientPortalWebsocketsBase.url """
+        return f'{"wss" if self.secure else "ws"}://{self.host}:{self.port}{self.websocket_path}'
+
+    def set_endpoint_rate(self, endpoint, rate_per_sec):
+        """ Limit one endpoint to rate_per_sec requests per second (None removes the limit) """
+        path = endpoint.value if isinstance(endpoint, Endpoints) else endpoint
+        if rate_per_sec is None:
+            self.__endpoint_limits.pop(path, None)
+        else:
+            self.__endpoint_limits[path] = TokenBucket(rate_per_sec, burst=max(1, int(rate_per_sec)))
+
+    def inject_error(self, endpoint, status=500, count=1):
+        """ Answer the next count requests for endpoint with status """
+        path = endpoint.value if isinstance(endpoint, Endpoints) else endpoint
+        self.__injected[path].extend([status] * count)
+
+    def add_trades(self, count, conids=(265598, 8314), start_ms=None):
+        """ Append count synthetic executions to the trades list. Returns the new trades """
+        start_ms = int(time.time() * 1000) if start_ms is None else start_ms
+        trades = []
+        for _ in range(count):
+            self.__trade_sequence += 1
+            conid = conids[self.__trade_sequence % len(conids)]
+            trades.append({
+                'execution_id': f'0000e0d5.{self.__trade_sequence:08x}.01.01',
+                'symbol': f'SIM{conid}',
+                'side': 'B' if self.random.random() < 0.5 else 'S',
+                'size': float(self.random.randint(1, 10) * 100),
+                'price': f'{self.random.uniform(10, 500):.2f}',
+                'order_ref': f'ref{self.__trade_sequence}',
+                'account': self.accounts[self.__trade_sequence % len(self.accounts)],
+                'conid': conid,
+                'trade_time_r': start_ms + self.__trade_sequence,
+                'sec_type': 'STK',
+                'exchange': 'ISLAND',
+            })
+        self.trades.extend(trades)
+        return trades
+
+    async def start(self):
+        """ Start serving on the running event loop """
+        app = web.Application()
+        app.router.add_get(self.websocket_path, self.__websocket)
+        for prefix in self.prefixes:
+            for path in self.responses:
+                app.router.add_route('*', prefix + path, self.__http)
+
+        ssl_context = None
+        if self.secure:
+            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            ssl_context.load_cert_chain(self.certificate_path, self.key_path)
+
+        self.__runner = web.AppRunner(app)
+        await self.__runner.setup()
+        site = web.TCPSite(self.__runner, self.host, self.port, ssl_context=ssl_context)
+        await site.start()
+        self.port = self.__runner.addresses[0][1]
+        log.debug('GatewaySimulator: Serving {} and {}', self.url_http, self.url_ws)
+
+    async def stop(self):
+        """ Close all websockets and stop serving """
+        await self.drop_websockets()
+        if self.__runner is not None:
+            await self.__runner.cleanup()
+            self.__runner = None
+        log.debug('GatewaySimulator: Stopped')
+
+    async def drop_websockets(self):
+        """ Close every open websocket (e.g. to exercise client reconnects) """
+        for ws in list(self.__websockets):
+            await ws.close()
+
+    def start_background(self, timeout_sec=5):
+        """ Run the simulator on its own thread and event loop. Returns once it is serving """
+        started = threading.Event()
+
+        def run():
+            self.__loop = asyncio.new_event_loop()
+            self.__loop.run_until_complete(self.start())
+            started.set()
+            self.__loop.run_forever()
+            self.__loop.run_until_complete(self.stop())
+            self.__loop.close()
+
+        self.__thread = threading.Thread(target=run, name='GatewaySimulator', daemon=True)
+        self.__thread.start()
+        return started.wait(timeout_sec)
+
+    def stop_background(self, timeout_sec=5):
+        """ Stop a simulator started with start_background() """
+        if self.__loop is not None and self.__thread is not None:
+            self.__loop.call_soon_threadsafe(self.__loop.stop)
+            self.__thread.join(timeout_sec)
+            self.__thread = None
+            self.__loop = None
+
+    # HTTP
+    def tickle_response(self, request):
+        return {'session': 'simulated', 'ssoExpires': 3600000, 'collission': False, 'userId': 1,
+                'iserver': {'authStatus': self.auth_status_response(request)}}
+
+    def auth_status_response(self, request):
+        return {'authenticated': self.authenticated, 'competing': False, 'connected': True, 'message': '',
+                'MAC': '00:00:00:00:00:00'}
+
+    def reauthenticate_response(self, request):
+        self.authenticated = True
+        return {'message': 'triggered'}
+
+    def validate_response(self, request):
+        return {'USER_ID': 1, 'USER_NAME': self.username, 'RESULT': True, 'AUTH_TIME': int(time.time() * 1000)}
+
+    def trades_response(self, request):
+        return self.trades
+
+    def accounts_response(self, request):
+        return {'accounts': self.accounts, 'selectedAccount': self.accounts[0]}
+
+    async def __http(self, request):
+        path = request.path
+        for prefix in self.prefixes:
+            if path.startswith(prefix):
+                path = path[len(prefix):]
+                break
+        self.requests[path] += 1
+
+        delay = self.latency_sec + (self.random.uniform(0, self.latency_jitter_sec) if self.latency_jitter_sec else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if self.__throttle(path):
+            self.throttled += 1
+            return web.json_response({'error': 'Too Many Requests'}, status=429)
+
+        injected = self.__injected.get(path)
+        if injected:
+            self.errors += 1
+            return web.json_response({'error': 'injected'}, status=injected.popleft())
+
+        if self.error_rate > 0 and self.random.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({'error': 'simulated'}, status=self.error_status)
+
+        return web.Response(body=json.dumps(self.responses[path](request)), content_type='application/json')
+
+    def __throttle(self, path):
+        for bucket in (self.__rate_limit, self.__endpoint_limits.get(path)):
+            if bucket is not None:
+                if bucket.wait_time() > 0:
+                    return True
+        for bucket in (self.__rate_limit, self.__endpoint_limits.get(path)):
+            if bucket is not None:
+                bucket.consume()
+        return False
+
+    # websocket
+    async def __websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.__websockets.add(ws)
+        streams = {}
+        log.debug('GatewaySimulator: Websocket connected')
+        try:
+            await ws.send_str(json.dumps({'topic': 'system', 'success': self.username, 'isFT': False, 'isPaper': True}))
+            await ws.send_str(json.dumps({'topic': 'sts', 'args': {'authenticated': self.authenticated}}))
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                self.websocket_messages.append(msg.data)
+                await self.__websocket_message(ws, msg.data, streams)
+        finally:
+            for task in streams.values():
+                task.cancel()
+            self.__websockets.discard(ws)
+            log.debug('GatewaySimulator: Websocket disconnected')
+        return ws
+
+    async def __websocket_message(self, ws, data, streams):
+        if data == 'tic':
+            self.tics_received += 1
+            await ws.send_str(json.dumps({'topic': 'tic', 'alive': True, 'id': 'simulated',
+                                          'lastAccessed': int(time.time() * 1000)}))
+            return
+
+        topic, _, rest = data.partition('+')
+        conid, _, args = rest.partition('+')
+        if topic == 'smd' and conid:
+            try:
+                fields = json.loads(args).get('fields', []) if args else []
+            except ValueError:
+                fields = []
+            if conid not in streams:
+                streams[conid] = asyncio.create_task(self.__market_data(ws, conid, fields))
+        elif topic == 'umd' and conid in streams:
+            streams.pop(conid).cancel()
+
+    async def __market_data(self, ws, conid, fields):
+        """ Send a random walk of ticks for one conid at smd_rate_per_sec """
+        price = self.random.uniform(10, 500)
+        rate = self.smd_rate_per_sec
+        # wake at most every millisecond and send all ticks due since the last wake
+        interval = max(1.0 / rate, 0.001)
+        started = time.monotonic()
+        sent = 0
+        while not ws.closed:
+            due = int((time.monotonic() - started) * rate) + 1
+            for _ in range(due - sent):
+                price = max(0.01, price + self.random.gauss(0, 0.05))
+                spread = 0.01
+                tick = {'topic': f'smd+{conid}', 'conid': int(conid) if conid.isdigit() else conid,
+                        '_updated': int(time.time() * 1000),
+                        '31': f'{price:.2f}', '84': f'{price - spread:.2f}', '86': f'{price + spread:.2f}',
+                        '88': str(self.random.randint(1, 50) * 100), '85': str(self.random.randint(1, 50) * 100),
+                        '7059': str(self.random.randint(1, 10) * 100)}
+                if fields:
+                    tick = {k: v for k, v in tick.items() if k in fields or not k.isdigit()}
+                await ws.send_str(json.dumps(tick))
+                self.ticks_sent += 1
+            sent = due
+            await asyncio.sleep(interval)
+
+
+if __name__ == '__main__':
+    print("=== Gateway Simulator ===")
@@ -0,0 +1,264 @@
+# streamlog.py
+# Record websocket frames to compact segmented binary files and replay them through a MessageDispatcher
+import asyncio
+import bisect
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+
+from ib.dispatch import Message
+from lib.log import Log
+
+log = Log(__name__)
+
+# segment file: header, then frames of (timestamp ns, payload length) + payload
+SEGMENT_HEADER = struct.Struct('<4sHH')
+SEGMENT_MAGIC = b'IBWS'
+SEGMENT_VERSION = 1
+FRAME_HEADER = struct.Struct('<qI')
+# index file next to each segment: (timestamp ns, frame offset) every index_every frames
+INDEX_ENTRY = struct.Struct('<qQ')
+SEGMENT_SUFFIX = '.ibws'
+INDEX_SUFFIX = '.idx'
+
+
+class StreamRecorder:
+    """
+    StreamRecorder
+    Appends timestamped websocket frames to segment files <prefix>-<n>.ibws in a directory. Frames are collected in
+    memory and written in blocks, so record() costs a struct pack and a buffer append. Single writer: call record()
+    from one thread (the websocket receive loop).
+    Parameters:
+        - directory = Folder for the segments. Created if missing. Recording continues after existing segments.
+        - prefix ('stream') = Segment file name prefix.
+        - segment_bytes (64 MB) = Start a new segment after this size.
+        - buffer_bytes (256 KB) = Write buffered frames once this much is pending.
+        - index_every (1024) = Add a time index entry every n frames.
+    Usage: ClientPortalWebsocketsBase.recorder = StreamRecorder('capture')
+    """
+    def __init__(self, directory, prefix='stream', segment_bytes=64 * 1024 * 1024, buffer_bytes=256 * 1024,
+                 index_every=1024):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.prefix = prefix
+        self.segment_bytes = segment_bytes
+        self.buffer_bytes = buffer_bytes
+        self.index_every = index_every
+        self.frames = 0
+        self.__buffer = bytearray()
+        self.__index = bytearray()
+        self.__file = None
+        self.__index_file = None
+        self.__segment = len(segment_paths(self.directory, prefix))
+        self.__size = 0
+        self.__segment_frames = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def record(self, frame, timestamp_ns=None):
+        """ Append a frame (str or bytes). timestamp_ns defaults to the current time """
+        if self.__file is None or self.__size >= self.segment_bytes:
+            self.__open_segment()
+
+        payload = frame.encode() if isinstance(frame, str) else frame
+        timestamp_ns = time.time_ns() if timestamp_ns is None else timestamp_ns
+        if self.__segment_frames % self.index_every == 0:
+            self.__index += INDEX_ENTRY.pack(timestamp_ns, self.__size)
+        self.__buffer += FRAME_HEADER.pack(timestamp_ns, len(payload))
+        self.__buffer += payload
+        self.__size += FRAME_HEADER.size + len(payload)
+        self.__segment_frames += 1
+        self.frames += 1
+
+        if len(self.__buffer) >= self.buffer_bytes:
+            self.flush()
+
+    def flush(self):
+        """ Write buffered frames to the current segment """
+        if self.__file is not None and self.__buffer:
+            self.__file.write(self.__buffer)
+            self.__file.flush()
+            self.__buffer.clear()
+        if self.__index_file is not None and self.__index:
+            self.__index_file.write(self.__index)
+            self.__index_file.flush()
+            self.__index.clear()
+
+    def close(self):
+        self.flush()
+        for file in (self.__file, self.__index_file):
+            if file is not None:
+                file.close()
+        self.__file = self.__index_file = None
+
+    def __open_segment(self):
+        self.close()
+        path = self.directory / f'{self.prefix}-{self.__segment:06d}{SEGMENT_SUFFIX}'
+        self.__segment += 1
+        self.__file = open(path, 'wb')
+        self.__index_file = open(path.with_suffix(INDEX_SUFFIX), 'wb')
+        # header goes to disk at once, so readers recognize the segment before the first flush
+        self.__file.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, 0))
+        self.__file.flush()
+        self.__size = SEGMENT_HEADER.size
+        self.__segment_frames = 0
+        log.debug('StreamRecorder: Recording to {}', path)
+
+
+def segment_paths(directory, prefix='stream'):
+    """ Segment files of a recording, in recording order """
+    return sorted(Path(directory).glob(f'{prefix}-*{SEGMENT_SUFFIX}'))
+
+
+class StreamSegment:
+    """ Memory-mapped segment file with its time index """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.__file = open(self.path, 'rb')
+        size = os.fstat(self.__file.fileno()).st_size
+        self.data = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        if size < SEGMENT_HEADER.size or SEGMENT_HEADER.unpack_from(self.data)[0] != SEGMENT_MAGIC:
+            self.close()
+            raise ValueError(f'Not a stream segment: {self.path}')
+        self.index_times, self.index_offsets = self.__load_index()
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.__file.close()
+
+    def first_timestamp(self):
+        return self.index_times[0] if self.index_times else None
+
+    def frames(self, start_ns=None, end_ns=None):
+        """ Yield (timestamp_ns, payload memoryview) for frames in [start_ns, end_ns) """
+        offset = SEGMENT_HEADER.size
+        if start_ns is not None and self.index_times:
+            position = bisect.bisect_right(self.index_times, start_ns) - 1
+            if position >= 0:
+                offset = self.index_offsets[position]
+
+        data = self.data
+        view = memoryview(data)
+        size = len(data)
+        header_size = FRAME_HEADER.size
+        unpack_from = FRAME_HEADER.unpack_from
+        try:
+            while offset + header_size <= size:
+                timestamp_ns, length = unpack_from(data, offset)
+                start = offset + header_size
+                offset = start + length
+                if offset > size:
+                    # frame cut short, e.g. recorder still writing
+                    break
+                if start_ns is not None and timestamp_ns < start_ns:
+                    continue
+                if end_ns is not None and timestamp_ns >= end_ns:
+                    break
+                yield timestamp_ns, view[start:offset]
+        finally:
+            view.release()
+
+    def __load_index(self):
+        times, offsets = [], []
+        try:
+            index = self.path.with_suffix(INDEX_SUFFIX).read_bytes()
+        except OSError:
+            index = b''
+
+        if index:
+            for timestamp_ns, offset in INDEX_ENTRY.iter_unpack(index[:len(index) - len(index) % INDEX_ENTRY.size]):
+                # while recording, the index may already cover frames written after the segment was mapped
+                if offset >= len(self.data):
+                    break
+                times.append(timestamp_ns)
+                offsets.append(offset)
+        elif len(self.data) >= SEGMENT_HEADER.size + FRAME_HEADER.size:
+            # no index file: the first frame still gives the segment's start time
+            times.append(FRAME_HEADER.unpack_from(self.data, SEGMENT_HEADER.size)[0])
+            offsets.append(SEGMENT_HEADER.size)
+        return times, offsets
+
+
+class StreamReader:
+    """
+    StreamReader
+    Reads a recording made by StreamRecorder. Segments are memory-mapped and located by time through their indexes.
+    A recording may be read while it is still being recorded: frames not yet flushed by the recorder are not seen,
+    and a last segment too short to hold its header is skipped.
+    Parameters:
+        - directory = Folder holding the segments.
+        - prefix ('stream') = Segment file name prefix.
+    """
+    def __init__(self, directory, prefix='stream'):
+        self.segments = []
+        paths = segment_paths(directory, prefix)
+        for position, path in enumerate(paths):
+            try:
+                self.segments.append(StreamSegment(path))
+            except ValueError:
+                # the recorder may have just created the last segment
+                if position < len(paths) - 1 or path.stat().st_size >= SEGMENT_HEADER.size:
+                    self.close()
+                    raise
+                log.debug('StreamReader: Skipping incomplete segment {}', path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
+
+    def frames(self, start_ns=None, end_ns=None):
+        """ Yield (timestamp_ns, payload memoryview) in recording order. Payloads are only valid until the reader
+            is closed; use bytes(payload) to keep one.
+        """
+        starts = [segment.first_timestamp() for segment in self.segments]
+        first = 0
+        if start_ns is not None:
+            # the last segment starting at or before start_ns holds the first wanted frame
+            for position, start in enumerate(starts):
+                if start is not None and start <= start_ns:
+                    first = position
+        for segment in self.segments[first:]:
+            if end_ns is not None and segment.first_timestamp() is not None and segment.first_timestamp() >= end_ns:
+                break
+            yield from segment.frames(start_ns, end_ns)
+
+    async def replay(self, dispatcher, speed=None, start_ns=None, end_ns=None):
+        """ Feed recorded frames to dispatcher.dispatch() (the handlers, including on_message, registered on e.g.
+            ClientPortalWebsocketsBase.dispatcher). speed = 1 for real time, N for N times faster, None for as fast
+            as possible. Returns the number of frames replayed.
+        """
+        loop = asyncio.get_running_loop()
+        replayed = 0
+        first_ns = None
+        started = loop.time()
+        for timestamp_ns, payload in self.frames(start_ns, end_ns):
+            if speed:
+                if first_ns is None:
+                    first_ns = timestamp_ns
+                delay = (timestamp_ns - first_ns) / 1e9 / speed - (loop.time() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await dispatcher.dispatch(Message.parse(bytes(payload)))
+            replayed += 1
+            if not speed and replayed % 1000 == 0:
+                # let other tasks run during long replays
+                await asyncio.sleep(0)
+        return replayed
+
+
+if __name__ == '__main__':
+    print("=== Stream Log ===")
@@ -0,0 +1,147 @@
+# subscriptions.py
+# Websocket topic subscriptions. Tracks the desired subscriptions, compares them with what has been sent to the
+# gateway and sends only the differences, in rate limited batches.
+# See https://interactivebrokers.github.io/cpwebapi/RealtimeSubscription.html
+import asyncio
+import json
+import threading
+
+from lib.log import Log
+
+log = Log(__name__)
+
+# subscribe topic -> unsubscribe topic
+UNSUBSCRIBE_TOPIC = {
+    'smd': 'umd',   # market data
+    'sor': 'uor',   # live orders
+    'spl': 'upl',   # profit & loss
+    'str': 'utr',   # trades
+}
+
+
+class SubscriptionManager:
+    """
+    SubscriptionManager
+    Desired subscriptions are keyed by topic: 'smd+<conid>' for market data, 'sor', 'spl' and 'str' for orders,
+    P&L and trades. Changing the desired set only records it; sync() sends the subscribe/unsubscribe messages needed to
+    make the gateway match. Repeated calls with the same arguments do nothing (idempotent). Thread safe.
+    Parameters:
+        - max_messages_per_sec (50) = Rate at which sync() sends messages.
+        - batch_size (10) = Messages sent back to back before pausing to honour the rate.
+        - on_change (None) = Called (with no arguments) whenever the desired set changes.
+    """
+    def __init__(self, max_messages_per_sec=50, batch_size=10, on_change=None):
+        self.max_messages_per_sec = max_messages_per_sec
+        self.batch_size = batch_size
+        self.on_change = on_change
+        self.messages_sent = 0
+        self.__desired = {}
+        self.__active = {}
+        self.__lock = threading.Lock()
+
+    def subscribe(self, topic, args=None):
+        """ Want topic with args (dict) to be subscribed """
+        self.__set_desired({topic: args or {}}, ())
+
+    def unsubscribe(self, topic):
+        """ Want topic to be unsubscribed """
+        self.__set_desired({}, (topic,))
+
+    def subscribe_market_data(self, conids, fields):
+        """ Want market data for one or more conids with the given field ids (e.g. ['31', '84', '86']) """
+        args = {'fields': [str(field) for field in fields]}
+        self.__set_desired({f'smd+{conid}': args for conid in self.__as_list(conids)}, ())
+
+    def unsubscribe_market_data(self, conids):
+        self.__set_desired({}, [f'smd+{conid}' for conid in self.__as_list(conids)])
+
+    def replace_market_data(self, conids, fields):
+        """ Make conids the complete set of market data subscriptions (universe rotation) """
+        args = {'fields': [str(field) for field in fields]}
+        wanted = {f'smd+{conid}': args for conid in self.__as_list(conids)}
+        with self.__lock:
+            removed = [topic for topic in self.__desired if topic.startswith('smd+') and topic not in wanted]
+        self.__set_desired(wanted, removed)
+
+    def table(self):
+        """ Current subscriptions: {topic: {'desired': args or None, 'active': args sent to the gateway or None}} """
+        with self.__lock:
+            topics = set(self.__desired) | set(self.__active)
+            return {topic: {'desired': self.__desired.get(topic), 'active': self.__active.get(topic)}
+                    for topic in sorted(topics)}
+
+    def pending(self):
+        """ Messages needed to bring the gateway in line with the desired subscriptions """
+        with self.__lock:
+            return [message for topic, args, message in self.__diff()]
+
+    def reset_active(self):
+        """ Forget what was sent (e.g. after reconnecting), so the next sync() subscribes everything again """
+        with self.__lock:
+            self.__active.clear()
+
+    async def sync(self, send):
+        """ Send pending subscribe/unsubscribe messages with the coroutine send(message). Returns number sent """
+        with self.__lock:
+            changes = self.__diff()
+
+        pause = self.batch_size / self.max_messages_per_sec if self.max_messages_per_sec > 0 else 0
+        sent = 0
+        for topic, args, message in changes:
+            if sent and sent % self.batch_size == 0:
+                await asyncio.sleep(pause)
+
+            await send(message)
+            sent += 1
+            with self.__lock:
+                if args is not None:
+                    self.__active[topic] = args
+                else:
+                    self.__active.pop(topic, None)
+
+        self.messages_sent += sent
+        if sent:
+            log.debug('Subscriptions: Sent {} message(s), {} active', sent, len(self.__active))
+        return sent
+
+    def __set_desired(self, wanted, removed):
+        changed = False
+        with self.__lock:
+            for topic, args in wanted.items():
+                if self.__desired.get(topic) != args:
+                    self.__desired[topic] = args
+                    changed = True
+            for topic in removed:
+                if self.__desired.pop(topic, None) is not None:
+                    changed = True
+
+        if changed and self.on_change is not None:
+            self.on_change()
+
+    def __diff(self):
+        """ (topic, args, message) to send, args is None for unsubscribes. Lock must be held.
+            Unsubscribes go first to stay within the gateway's subscription limits.
+        """
+        unsubscribes = [(topic, None, self.unsubscribe_message(topic)) for topic in self.__active
+                        if topic not in self.__desired]
+        subscribes = [(topic, args, self.subscribe_message(topic, args)) for topic, args in self.__desired.items()
+                      if self.__active.get(topic) != args]
+        return unsubscribes + subscribes
+
+    @staticmethod
+    def subscribe_message(topic, args):
+        return f'{topic}+{json.dumps(args, separators=(",", ":"))}'
+
+    @staticmethod
+    def unsubscribe_message(topic):
+        topic_type, _, topic_args = topic.partition('+')
+        unsubscribe = UNSUBSCRIBE_TOPIC.get(topic_type, topic_type)
+        return f'{unsubscribe}+{topic_args}+{{}}' if topic_args else f'{unsubscribe}+{{}}'
+
+    @staticmethod
+    def __as_list(values):
+        return list(values) if isinstance(values, (list, tuple, set)) else [values]
+
+
+if __name__ == '__main__':
+    print("=== Websocket Subscriptions ===")
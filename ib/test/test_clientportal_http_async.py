@@ -0,0 +1,106 @@
+import pytest
+from aiohttp import web
+
+from ib.clientportal_http_async import ClientPortalHttpAsync
+from ib.endpoints import Endpoints
+from ib.error import Error
+from ib.sessionkeeper import SessionKeeper
+from lib.asynchttpendpoints import AsyncHttpSessionPool
+
+
+async def start_gateway(routes):
+    """ Serve the given routes on a local port, returning the runner and the client portal base url """
+    app = web.Application()
+    app.add_routes(routes)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f'http://127.0.0.1:{port}/v1/portal'
+
+
+class TestClientPortalHttpAsync:
+    @pytest.mark.asyncio
+    async def test_post_ok(self):
+        async def auth_status(request):
+            return web.json_response({'authenticated': True})
+
+        runner, url = await start_gateway([web.post('/v1/portal' + Endpoints.AuthenticationStatus.value, auth_status)])
+        try:
+            async with ClientPortalHttpAsync() as client:
+                client.url_http = url
+                result = await client.clientrequest_authentication_status()
+        finally:
+            await runner.cleanup()
+
+        assert result.error == Error.No_Error
+        assert result.statusCode == 200
+        assert result.json == {'authenticated': True}
+
+    @pytest.mark.asyncio
+    async def test_get_invalid_url(self):
+        runner, url = await start_gateway([])
+        try:
+            async with ClientPortalHttpAsync() as client:
+                client.url_http = url
+                result = await client.clientrequest_trades()
+        finally:
+            await runner.cleanup()
+
+        assert result.error == Error.Invalid_URL
+
+    @pytest.mark.asyncio
+    async def test_connection_failed(self):
+        async with ClientPortalHttpAsync() as client:
+            client.url_http = 'http://127.0.0.1:1/v1/portal'
+            result = await client.clientrequest_validate()
+
+        assert result.error == Error.Connection_or_Timeout
+
+    @pytest.mark.asyncio
+    async def test_shared_pool(self):
+        pool = AsyncHttpSessionPool(pool_size=2)
+        client_a = ClientPortalHttpAsync(session_pool=pool)
+        client_b = ClientPortalHttpAsync(session_pool=pool)
+        assert client_a.session_pool.session is client_b.session_pool.session
+        await pool.close()
+
+    @pytest.mark.asyncio
+    async def test_batch(self):
+        async def echo(request):
+            return web.json_response({'path': request.path, 'method': request.method})
+
+        runner, url = await start_gateway([web.get('/v1/portal/{name}', echo), web.post('/v1/portal/{name}', echo)])
+        try:
+            async with ClientPortalHttpAsync() as client:
+                client.url_http = url
+                results = await client.clientrequest_batch([('GET', '/a'), ('POST', '/b', {'x': 1}), ('PUT', '/c')],
+                                                           max_concurrency=2)
+        finally:
+            await runner.cleanup()
+
+        assert results[0].json == {'path': '/v1/portal/a', 'method': 'GET'}
+        assert results[1].json == {'path': '/v1/portal/b', 'method': 'POST'}
+        assert results[2].error == Error.Invalid_Request
+
+    @pytest.mark.asyncio
+    async def test_on_result(self):
+        async def auth_status(request):
+            return web.json_response({'authenticated': True})
+
+        keeper = SessionKeeper()
+        runner, url = await start_gateway([web.post('/v1/portal' + Endpoints.AuthenticationStatus.value, auth_status)])
+        try:
+            async with ClientPortalHttpAsync(session_keeper=keeper) as client:
+                client.url_http = url
+                seen = []
+                client.on_result = lambda method, endpoint, result: seen.append((method, endpoint, result.error))
+                await client.clientrequest_trades()
+                del client.on_result
+                await client.clientrequest_authentication_status()
+        finally:
+            await runner.cleanup()
+
+        assert seen == [('GET', Endpoints.Trades.value, Error.Invalid_URL)]
+        assert keeper.last_http is not None
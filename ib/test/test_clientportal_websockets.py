@@ -1,4 +1,6 @@
+import asyncio
 import pytest
+import websockets
 from unittest.mock import patch
 from lib.certificate import CertificateError
 from lib.certificate import CertificateReturn
@@ -37,3 +39,101 @@ class TestClientPortalWebsockets:
         cp = ClientPortalWebsocketsBase()
         result = await cp.__open_connection()
         assert result == ClientPortalWebsocketsError.Invalid_Certificate
+
+
+class TestClientPortalWebsocketsSupervised:
+    @pytest.mark.asyncio
+    async def test_reconnect_replays_subscriptions(self):
+        """ Connection is re-established after the server drops it and subscriptions are sent again """
+        connections = []
+
+        async def gateway(websocket):
+            connections.append([])
+            await websocket.send('{"topic": "system", "success": "user"}')
+            await websocket.send('{"topic": "smd+1", "conid": 1, "31": "100"}')
+            if len(connections) == 1:
+                # first connection: wait for the subscription, then drop it
+                connections[-1].append(await websocket.recv())
+                connections[-1].append(await websocket.recv())
+                return
+            async for message in websocket:
+                connections[-1].append(message)
+                if message.startswith('smd'):
+                    cp.stop()
+
+        cp = ClientPortalWebsocketsBase()
+        cp.reconnect_backoff_sec = 0.01
+        cp.heartbeat_sec = 3600
+        cp.subscriptions.subscribe_market_data(1, ['31'])
+
+        async with websockets.serve(gateway, '127.0.0.1', 0) as server:
+            cp.url = f'ws://127.0.0.1:{list(server.sockets)[0].getsockname()[1]}'
+            await asyncio.wait_for(cp._ClientPortalWebsocketsBase__async_supervisor(), 5)
+
+        assert len(connections) == 2
+        assert 'smd+1+{"fields":["31"]}' in connections[1]
+        assert cp.metrics.connects == 2
+        assert cp.metrics.reconnects == 1
+        assert cp.metrics.messages_received == 2
+        assert cp.metrics.downtime_sec > 0
+
+    @pytest.mark.asyncio
+    async def test_reconnect_reuses_ssl_context(self):
+        """ Every wss:// attempt uses the same cached context """
+        contexts = []
+
+        async def connect(url, ssl=None):
+            contexts.append(ssl)
+            raise websockets.InvalidHandshake('refused')
+
+        cp = ClientPortalWebsocketsBase()
+        with patch('ib.clientportal_websockets.websockets.connect', connect):
+            for _ in range(2):
+                assert await cp._ClientPortalWebsocketsBase__open_connection() == \
+                    ClientPortalWebsocketsError.Connection_Failed
+
+        assert len(contexts) == 2
+        assert contexts[0] is not None
+        assert contexts[1] is contexts[0] is cp.ssl_context
+
+    def test_reconnect_delay_backoff(self):
+        cp = ClientPortalWebsocketsBase()
+        cp.reconnect_jitter = 0
+        cp.reconnect_backoff_sec = 0.5
+        cp.reconnect_backoff_max_sec = 4
+        assert [cp.reconnect_delay(attempt) for attempt in range(5)] == [0.5, 1, 2, 4, 4]
+
+
+class TestClientPortalWebsocketsBackground:
+    @pytest.mark.asyncio
+    async def test_background_bridge(self):
+        """ Background loop delivers messages to synchronous consumers and accepts sends from other threads """
+        received = []
+        handled = []
+
+        async def gateway(websocket):
+            await websocket.send('{"topic": "system", "success": "user"}')
+            await websocket.send('{"topic": "sor", "args": []}')
+            await websocket.send('{"topic": "smd+1", "conid": 1, "31": "100"}')
+            async for message in websocket:
+                received.append(message)
+
+        cp = ClientPortalWebsocketsBase()
+        cp.heartbeat_sec = 3600
+        cp.enable_message_queue(topics=('smd',))
+        cp.register_threaded_handler('sor', handled.append)
+
+        async with websockets.serve(gateway, '127.0.0.1', 0) as server:
+            cp.url = f'ws://127.0.0.1:{list(server.sockets)[0].getsockname()[1]}'
+            assert cp.start_background()
+
+            message = await asyncio.get_running_loop().run_in_executor(None, cp.get_message, 2)
+            assert message.topic == 'smd'
+            await asyncio.wrap_future(cp.send_threadsafe('ech+hello'))
+
+            cp.stop()
+            assert await asyncio.get_running_loop().run_in_executor(None, cp.join, 2)
+
+        assert 'ech+hello' in received
+        assert [m.topic for m in handled] == ['sor']
+        assert cp.get_message(timeout_sec=0) is None
@@ -0,0 +1,184 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from ib.dispatch import Message, MessageDispatcher, MessageQueue, OverflowPolicy
+
+
+def smd(conid, **fields):
+    return json.dumps(dict(topic=f'smd+{conid}', conid=conid, **fields))
+
+
+class TestMessage:
+    def test_parse_market_data(self):
+        message = Message.parse(smd(265598, **{'31': '150.25'}))
+        assert message.topic == 'smd'
+        assert message.key == 265598
+        assert message.data['31'] == '150.25'
+
+    def test_parse_system(self):
+        message = Message.parse(b'{"topic": "system", "success": "user1"}')
+        assert message.topic == 'system'
+        assert message.key is None
+
+    def test_parse_not_json(self):
+        message = Message.parse('not json')
+        assert message.topic == 'unknown'
+        assert message.data is None
+
+    def test_parse_topic_not_string(self):
+        for frame in ('{"topic": 5}', '{"topic": null}', '{"topic": ["smd"]}', '{"args": []}'):
+            message = Message.parse(frame)
+            assert message.topic == 'unknown'
+            assert message.key is None
+
+
+class TestMessageQueue:
+    @pytest.mark.asyncio
+    async def test_drop_oldest(self):
+        queue = MessageQueue(maxsize=2, policy=OverflowPolicy.DropOldest)
+        for i in range(3):
+            await queue.put(Message.parse(json.dumps({'topic': 'sor', 'n': i})))
+
+        assert queue.dropped == 1
+        assert (await queue.get()).data['n'] == 1
+
+    @pytest.mark.asyncio
+    async def test_coalesce_latest(self):
+        queue = MessageQueue(maxsize=10, policy=OverflowPolicy.CoalesceLatest)
+        await queue.put(Message.parse(smd(1, **{'31': '10', '84': '9'})))
+        await queue.put(Message.parse(smd(2, **{'31': '20'})))
+        await queue.put(Message.parse(smd(1, **{'31': '11'})))
+
+        assert len(queue) == 2
+        assert queue.coalesced == 1
+        first = await queue.get()
+        assert first.key == 1
+        assert first.data['31'] == '11'
+        assert first.data['84'] == '9'
+
+        # once consumed, a new update for the same conid is queued again
+        await queue.put(Message.parse(smd(1, **{'31': '12'})))
+        assert len(queue) == 2
+
+    @pytest.mark.asyncio
+    async def test_coalesce_latest_with_room_and_full(self):
+        queue = MessageQueue(maxsize=2, policy=OverflowPolicy.CoalesceLatest)
+        # merged although the queue has room
+        await queue.put(Message.parse(smd(1, **{'31': '10'})))
+        await queue.put(Message.parse(smd(1, **{'31': '11'})))
+        assert len(queue) == 1 and queue.coalesced == 1 and queue.dropped == 0
+
+        # other messages fill the queue, then the oldest is dropped
+        await queue.put(Message.parse('{"topic": "sor", "n": 1}'))
+        await queue.put(Message.parse('{"topic": "sor", "n": 2}'))
+        assert len(queue) == 2 and queue.dropped == 1
+        assert (await queue.get()).data['n'] == 1
+
+    @pytest.mark.asyncio
+    async def test_block(self):
+        queue = MessageQueue(maxsize=1, policy=OverflowPolicy.Block)
+        await queue.put(Message.parse('{"topic": "sor"}'))
+        put = asyncio.create_task(queue.put(Message.parse('{"topic": "spl"}')))
+        await asyncio.sleep(0.01)
+        assert not put.done()
+
+        assert (await queue.get()).topic == 'sor'
+        await asyncio.wait_for(put, 1)
+        assert (await queue.get()).topic == 'spl'
+        assert queue.dropped == 0
+
+    @pytest.mark.asyncio
+    async def test_close(self):
+        queue = MessageQueue()
+        await queue.put(Message.parse('{"topic": "sor"}'))
+        queue.close()
+        assert (await queue.get()).topic == 'sor'
+        assert await queue.get() is None
+
+
+class TestMessageDispatcher:
+    @pytest.mark.asyncio
+    async def test_routing(self):
+        dispatcher = MessageDispatcher()
+        market_data, everything = [], []
+
+        async def async_handler(message):
+            everything.append(message.topic)
+
+        dispatcher.register('smd', market_data.append)
+        dispatcher.register('*', async_handler)
+        dispatcher.open()
+
+        await dispatcher.feed(smd(1, **{'31': '1'}))
+        await dispatcher.feed('{"topic": "sor", "args": []}')
+        dispatcher.close()
+        await dispatcher.run()
+
+        assert [m.key for m in market_data] == [1]
+        assert everything == ['smd', 'sor']
+
+    @pytest.mark.asyncio
+    async def test_handler_error_isolated(self):
+        dispatcher = MessageDispatcher()
+        received = []
+
+        def failing(message):
+            raise RuntimeError('handler bug')
+
+        dispatcher.register('sor', failing)
+        dispatcher.register('sor', received.append)
+        await dispatcher.dispatch(Message.parse('{"topic": "sor"}'))
+
+        assert dispatcher.handler_errors == 1
+        assert len(received) == 1
+
+    @pytest.mark.asyncio
+    async def test_run_yields_during_backlog(self):
+        dispatcher = MessageDispatcher(yield_every=10)
+        dispatcher.open()
+        for i in range(100):
+            await dispatcher.feed(json.dumps({'topic': 'sor', 'n': i}))
+        dispatcher.close()
+        ticks = []
+
+        async def other_task():
+            while True:
+                ticks.append(dispatcher.dispatched)
+                await asyncio.sleep(0)
+
+        task = asyncio.create_task(other_task())
+        await dispatcher.run()
+        task.cancel()
+
+        # the other task ran while the backlog was being drained, not only before or after it
+        assert any(0 < dispatched < 100 for dispatched in ticks)
+
+    @pytest.mark.asyncio
+    async def test_blocking_handler_offloaded(self):
+        dispatcher = MessageDispatcher()
+        received = []
+
+        def slow(message):
+            time.sleep(0.05)
+            received.append(message.data['n'])
+
+        dispatcher.register('sor', slow, blocking=True)
+        dispatcher.open()
+        for i in range(3):
+            await dispatcher.feed(json.dumps({'topic': 'sor', 'n': i}))
+        dispatcher.close()
+        runner = asyncio.create_task(dispatcher.run())
+
+        # the event loop stays responsive while the handler sleeps
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await asyncio.sleep(0.01)
+        assert loop.time() - started < 0.04
+        await runner
+
+        assert received == [0, 1, 2]
+        dispatcher.unregister('sor', slow)
+        assert dispatcher.handlers['sor'] == []
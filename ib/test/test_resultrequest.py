@@ -0,0 +1,64 @@
+import copy
+from unittest.mock import MagicMock
+
+import pytest
+
+from ib.error import Error
+from ib.resultrequest import RequestResult
+from lib import jsoncodec
+from lib.httpendpoints import HttpEndpoints
+
+
+class TestRequestResult:
+    def test_defaults(self):
+        result = RequestResult()
+        assert result.error == Error.No_Error
+        assert result.statusCode == 0
+        assert result.json is None
+
+    def test_slotted(self):
+        """ No per-instance __dict__ """
+        with pytest.raises(AttributeError):
+            RequestResult().unknown_attribute = 1
+
+    def test_lazy_decode(self):
+        result = RequestResult(raw=b'[{"execution_id": "1"}]')
+        assert result.decoded is False
+        assert result.json == [{'execution_id': '1'}]
+        assert result.decoded is True
+        assert result.raw is None
+
+    def test_copy(self):
+        result = RequestResult(statusCode=200, raw=b'{"a": 1}')
+        duplicate = copy.copy(result)
+        assert duplicate.statusCode == 200
+        assert duplicate.json == {'a': 1}
+
+    def test_check_response_lazy(self):
+        resp = MagicMock(ok=True, status_code=200, content=b'{"authenticated": true}')
+        result = HttpEndpoints.check_response('https://gateway/iserver/auth/status', resp, None, lazy_json=True)
+        assert result.decoded is False
+        assert result.json == {'authenticated': True}
+
+
+class TestJsonCodec:
+    def test_stdlib_backend(self):
+        previous = jsoncodec.backend
+        try:
+            jsoncodec.set_backend('json')
+            assert jsoncodec.decode(b'{"a": [1, 2.5, null]}') == {'a': [1, 2.5, None]}
+        finally:
+            jsoncodec.set_backend(previous)
+
+    def test_custom_backend(self):
+        previous = jsoncodec.backend
+        try:
+            jsoncodec.set_backend('constant', decoder=lambda data: 42)
+            assert jsoncodec.decode(b'{}') == 42
+            assert 'constant' in jsoncodec.available_backends()
+        finally:
+            jsoncodec.set_backend(previous)
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            jsoncodec.set_backend('not_installed')
@@ -0,0 +1,134 @@
+# test_sessionkeeper.py
+import asyncio
+import functools
+
+import pytest
+
+from ib.error import Error
+from ib.resultrequest import RequestResult
+from ib.sessionkeeper import SessionKeeper, SessionState
+from lib.scheduler import AsyncPeriodicScheduler
+from lib.test.fakeclock import FakeClock
+
+
+class FakeClient:
+    """ Answers session requests with a fixed authentication state """
+    def __init__(self, authenticated=True):
+        self.authenticated = authenticated
+        self.calls = []
+
+    def clientrequest_ping(self):
+        self.calls.append('tickle')
+        return RequestResult(json={'session': 'x', 'iserver': {'authStatus': {'authenticated': self.authenticated}}})
+
+    def clientrequest_authentication_status(self):
+        self.calls.append('status')
+        return RequestResult(json={'authenticated': self.authenticated})
+
+    def clientrequest_reauthenticate(self):
+        self.calls.append('reauthenticate')
+        return RequestResult(json={'message': 'triggered'})
+
+
+class FakeAsyncClient(FakeClient):
+    """ FakeClient with awaitable requests, like ClientPortalHttpAsync """
+    async def clientrequest_ping(self):
+        await asyncio.sleep(0)
+        return super().clientrequest_ping()
+
+    async def clientrequest_authentication_status(self):
+        return super().clientrequest_authentication_status()
+
+    async def clientrequest_reauthenticate(self):
+        return super().clientrequest_reauthenticate()
+
+
+def test_probe_skipped_while_traffic_flows():
+    clock = FakeClock()
+    keeper = SessionKeeper(idle_sec=50, clock=clock)
+    client = FakeClient()
+
+    assert keeper.check(client) == SessionState.Alive
+    assert client.calls == ['tickle']
+
+    for now in range(10, 200, 10):
+        clock.now = now
+        keeper.record_websocket() if now % 20 else keeper.record_http(RequestResult())
+        keeper.check(client)
+    assert client.calls == ['tickle']
+    assert keeper.skipped == 19
+
+    # traffic stops
+    clock.now = 250
+    keeper.check(client)
+    assert client.calls == ['tickle', 'tickle']
+
+
+def test_failure_escalates_to_reauthenticate():
+    clock = FakeClock()
+    states = []
+    keeper = SessionKeeper(max_failures=2, clock=clock, on_state_change=lambda old, new: states.append(new))
+    client = FakeClient()
+    keeper.check(client)
+
+    # a connection error makes the next check probe despite recent traffic
+    keeper.record_http(RequestResult())
+    keeper.record_http(RequestResult(error=Error.Connection_or_Timeout))
+    client.authenticated = False
+    assert keeper.check(client) == SessionState.Degraded
+    assert client.calls[-3:] == ['tickle', 'status', 'reauthenticate']
+    assert keeper.check(client) == SessionState.Lost
+    assert keeper.reauthentications == 2
+
+    client.authenticated = True
+    assert keeper.check(client) == SessionState.Alive
+    assert keeper.failures == 0
+    assert states == [SessionState.Alive, SessionState.Degraded, SessionState.Lost, SessionState.Alive]
+
+
+def test_websocket_heartbeat_needed_only_when_idle():
+    clock = FakeClock()
+    keeper = SessionKeeper(clock=clock)
+    assert keeper.websocket_idle(60)
+    keeper.record_websocket()
+    clock.now = 30
+    assert not keeper.websocket_idle(60)
+    keeper.websocket_lost()
+    assert keeper.websocket_idle(60)
+
+
+@pytest.mark.asyncio
+async def test_check_async_on_scheduler():
+    clock = FakeClock()
+    keeper = SessionKeeper(max_failures=2, clock=clock)
+    client = FakeAsyncClient(authenticated=False)
+    scheduler = AsyncPeriodicScheduler(clock=clock)
+    scheduler.schedule(functools.partial(keeper.check_async, client), keeper.check_sec)
+
+    await scheduler.run_pending_async()
+    assert keeper.state == SessionState.Degraded
+    assert client.calls == ['tickle', 'status', 'reauthenticate']
+
+    client.authenticated = True
+    clock.now = keeper.check_sec
+    await scheduler.run_pending_async()
+    assert keeper.state == SessionState.Alive
+
+    # recent traffic: no probe
+    keeper.record_http(RequestResult())
+    clock.now = 2 * keeper.check_sec
+    await scheduler.run_pending_async()
+    assert client.calls == ['tickle', 'status', 'reauthenticate', 'tickle']
+    assert keeper.skipped == 1
+
+
+@pytest.mark.asyncio
+async def test_check_async_single_probe():
+    """ Overlapping checks share the probe in flight """
+    keeper = SessionKeeper(clock=FakeClock())
+    client = FakeAsyncClient()
+
+    states = await asyncio.gather(keeper.check_async(client), keeper.check_async(client))
+    assert client.calls == ['tickle']
+    assert keeper.state == SessionState.Alive
+    assert states[1] == SessionState.Unknown
@@ -0,0 +1,143 @@
+# test_simulator.py
+import asyncio
+
+import pytest
+
+from ib.clientportal_http import ClientPortalHttp
+from ib.clientportal_http_async import ClientPortalHttpAsync
+from ib.clientportal_websockets import ClientPortalWebsocketsBase
+from ib.endpoints import Endpoints
+from ib.error import Error
+from ib.simulator import GatewaySimulator
+from lib.metrics import MetricsRegistry
+from lib.scheduler import PeriodicScheduler
+
+
+class TestGatewaySimulator:
+    @pytest.mark.asyncio
+    async def test_session_endpoints(self):
+        async with GatewaySimulator() as gateway, ClientPortalHttpAsync() as client:
+            client.url_http = gateway.url_http
+            gateway.add_trades(3)
+
+            status = await client.clientrequest_authentication_status()
+            trades = await client.clientrequest_trades()
+            accounts = await client.clientrequest_brokerage_accounts()
+
+        assert status.json['authenticated'] is True
+        assert len(trades.json) == 3
+        assert accounts.json['accounts'] == gateway.accounts
+        assert gateway.requests[Endpoints.Trades.value] == 1
+
+    @pytest.mark.asyncio
+    async def test_errors_and_rate_limit(self):
+        async with GatewaySimulator(endpoint_rates={Endpoints.Validate: 1}) as gateway, \
+                ClientPortalHttpAsync() as client:
+            client.url_http = gateway.url_http
+            gateway.inject_error(Endpoints.BrokerageAccounts, status=503)
+
+            failed = await client.clientrequest_brokerage_accounts()
+            recovered = await client.clientrequest_brokerage_accounts()
+            first = await client.clientrequest_validate()
+            second = await client.clientrequest_validate()
+
+        assert failed.error == Error.Invalid_URL
+        assert recovered.error == Error.No_Error
+        assert first.error == Error.No_Error
+        assert second.error == Error.Throttled
+        assert gateway.throttled == 1
+
+    @pytest.mark.asyncio
+    async def test_latency(self):
+        async with GatewaySimulator(latency_sec=0.05) as gateway, ClientPortalHttpAsync() as client:
+            client.url_http = gateway.url_http
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            await client.clientrequest_ping()
+            assert loop.time() - started >= 0.05
+
+    def test_blocking_client(self):
+        gateway = GatewaySimulator()
+        assert gateway.start_background()
+        try:
+            client = ClientPortalHttp(scheduler=PeriodicScheduler(autostart=False))
+            client.url_http = gateway.url_http
+            result = client.clientrequest_ping()
+            client.session_pool.close()
+        finally:
+            gateway.stop_background()
+
+        assert result.error == Error.No_Error
+        assert result.json['iserver']['authStatus']['authenticated'] is True
+
+    def test_streamed_trades(self):
+        gateway = GatewaySimulator(seed=1)
+        trades = gateway.add_trades(2000)
+        assert gateway.start_background()
+        try:
+            client = ClientPortalHttp(scheduler=PeriodicScheduler(autostart=False))
+            client.url_http = gateway.url_http
+            result = client.clientrequest_trades_stream()
+            records = list(result.records)
+            client.session_pool.close()
+        finally:
+            gateway.stop_background()
+
+        assert result.error == Error.No_Error
+        assert records == trades
+
+    @pytest.mark.asyncio
+    async def test_market_data_stream(self):
+        ticks = []
+        async with GatewaySimulator(smd_rate_per_sec=200, seed=1) as gateway:
+            cp = ClientPortalWebsocketsBase()
+            cp.url = gateway.url_ws
+            cp.dispatcher.register('smd', ticks.append)
+            cp.subscriptions.subscribe_market_data([265598], ['31', '84', '86'])
+            assert await asyncio.get_running_loop().run_in_executor(None, cp.start_background)
+
+            for _ in range(100):
+                if len(ticks) >= 20:
+                    break
+                await asyncio.sleep(0.02)
+            cp.stop()
+            assert await asyncio.get_running_loop().run_in_executor(None, cp.join, 2)
+
+        assert len(ticks) >= 20
+        assert ticks[0].key == 265598
+        assert set(ticks[0].data) == {'topic', 'conid', '_updated', '31', '84', '86'}
+        assert gateway.tics_received == 1
+
+    @pytest.mark.asyncio
+    async def test_metrics(self):
+        registry = MetricsRegistry()
+        ticks = []
+        async with GatewaySimulator(smd_rate_per_sec=100) as gateway, \
+                ClientPortalHttpAsync(metrics_registry=registry) as client:
+            client.url_http = gateway.url_http
+            gateway.inject_error(Endpoints.Validate, status=500)
+            await client.clientrequest_validate()
+            await client.clientrequest_validate()
+
+            cp = ClientPortalWebsocketsBase()
+            cp.url = gateway.url_ws
+            cp.enable_metrics(registry)
+            cp.dispatcher.register('smd', ticks.append)
+            cp.subscriptions.subscribe_market_data([1], ['31'])
+            assert await asyncio.get_running_loop().run_in_executor(None, cp.start_background)
+            for _ in range(100):
+                if len(ticks) >= 5:
+                    break
+                await asyncio.sleep(0.02)
+            cp.stop()
+            assert await asyncio.get_running_loop().run_in_executor(None, cp.join, 2)
+
+        snapshot = registry.snapshot()
+        validate = snapshot['requests'][Endpoints.Validate.value]
+        assert validate['count'] == 2
+        assert validate['errors'] == 1
+        assert validate['latency']['p99'] > 0
+        assert snapshot['requests'][Endpoints.Trades.value]['count'] == 0
+        assert snapshot['topics']['smd']['count'] >= 5
+        assert snapshot['heartbeat_rtt']['count'] == 1
+        assert snapshot['dispatch_lag']['count'] >= 5
@@ -0,0 +1,135 @@
+# test_streamlog.py
+import asyncio
+import json
+import time
+
+import pytest
+
+from ib.clientportal_websockets import ClientPortalWebsocketsBase
+from ib.dispatch import MessageDispatcher
+from ib.streamlog import StreamReader, StreamRecorder, segment_paths
+
+SECOND_NS = 1_000_000_000
+
+
+def tick(i):
+    return json.dumps({'topic': f'smd+{1000 + i % 3}', 'conid': 1000 + i % 3, '31': f'{100 + i}'})
+
+
+def record(folder, count, step_ns=SECOND_NS, **kwargs):
+    with StreamRecorder(folder, **kwargs) as recorder:
+        for i in range(count):
+            recorder.record(tick(i), timestamp_ns=i * step_ns)
+
+
+class TestStreamLog:
+    def test_round_trip(self, tmp_path):
+        record(tmp_path, 100)
+
+        with StreamReader(tmp_path) as reader:
+            frames = [(timestamp_ns, bytes(payload).decode()) for timestamp_ns, payload in reader.frames()]
+
+        assert frames == [(i * SECOND_NS, tick(i)) for i in range(100)]
+
+    def test_segments_and_seek(self, tmp_path):
+        record(tmp_path, 1000, segment_bytes=4096, buffer_bytes=512, index_every=16)
+        assert len(segment_paths(tmp_path)) > 5
+
+        with StreamReader(tmp_path) as reader:
+            assert len(list(reader.frames())) == 1000
+            frames = reader.frames(500 * SECOND_NS, 510 * SECOND_NS)
+            window = [timestamp_ns // SECOND_NS for timestamp_ns, _ in frames]
+            tail = [timestamp_ns // SECOND_NS for timestamp_ns, _ in reader.frames(start_ns=995 * SECOND_NS)]
+
+        assert window == list(range(500, 510))
+        assert tail == list(range(995, 1000))
+
+    def test_continues_and_ignores_partial_frame(self, tmp_path):
+        record(tmp_path, 10)
+        record(tmp_path, 10)
+        paths = segment_paths(tmp_path)
+        # recorder killed mid-write
+        with open(paths[-1], 'ab') as file:
+            file.write(b'\x00' * 5)
+
+        with StreamReader(tmp_path) as reader:
+            assert len(list(reader.frames())) == 20
+
+    def test_read_while_recording(self, tmp_path):
+        with StreamRecorder(tmp_path, segment_bytes=4096, buffer_bytes=1024) as recorder:
+            # nothing flushed yet
+            recorder.record(tick(0), timestamp_ns=0)
+            with StreamReader(tmp_path) as reader:
+                assert list(reader.frames()) == []
+
+            for i in range(1, 200):
+                recorder.record(tick(i), timestamp_ns=i * SECOND_NS)
+            with StreamReader(tmp_path) as reader:
+                timestamps = [timestamp_ns // SECOND_NS for timestamp_ns, _ in reader.frames()]
+            assert 0 < len(timestamps) <= 200
+            assert timestamps == list(range(len(timestamps)))
+
+        # a segment file created but not yet written to
+        (tmp_path / 'stream-999999.ibws').touch()
+        with StreamReader(tmp_path) as reader:
+            assert len(list(reader.frames())) == 200
+
+    @pytest.mark.asyncio
+    async def test_replay(self, tmp_path):
+        record(tmp_path, 20000, step_ns=1000)
+        cp = ClientPortalWebsocketsBase()
+        received = []
+        cp.on_message = received.append
+        dispatcher = MessageDispatcher()
+        dispatcher.register('*', cp.on_message)
+        conids = []
+        dispatcher.register('smd', lambda message: conids.append(message.key))
+
+        with StreamReader(tmp_path) as reader:
+            started = time.perf_counter()
+            count = await reader.replay(dispatcher)
+            elapsed = time.perf_counter() - started
+
+        assert count == len(received) == len(conids) == 20000
+        assert received[5].data['31'] == '105'
+        assert conids[:3] == [1000, 1001, 1002]
+        assert elapsed < 10
+
+    @pytest.mark.asyncio
+    async def test_replay_speed(self, tmp_path):
+        # 0.5 sec of recorded traffic at 10x takes about 0.05 sec
+        record(tmp_path, 6, step_ns=SECOND_NS // 10)
+        dispatcher = MessageDispatcher()
+        received = []
+        dispatcher.register('*', received.append)
+
+        with StreamReader(tmp_path) as reader:
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            count = await reader.replay(dispatcher, speed=10)
+            elapsed = loop.time() - started
+
+        assert count == 6
+        assert 0.04 <= elapsed < 1
+
+    @pytest.mark.asyncio
+    async def test_websocket_records(self, tmp_path):
+        cp = ClientPortalWebsocketsBase()
+        cp.recorder = StreamRecorder(tmp_path)
+
+        class Connection:
+            def __init__(self):
+                self.frames = [tick(0), tick(1)]
+
+            async def recv(self):
+                if not self.frames:
+                    raise ConnectionError('closed')
+                return self.frames.pop(0)
+
+        cp.connection = Connection()
+        cp.dispatcher.open()
+        await cp._ClientPortalWebsocketsBase__websocket_msg_handler()
+        cp.recorder.close()
+
+        with StreamReader(tmp_path) as reader:
+            assert [bytes(payload).decode() for _, payload in reader.frames()] == [tick(0), tick(1)]
@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+from ib.subscriptions import SubscriptionManager
+
+
+class Socket:
+    """ Records sent messages """
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(message)
+
+
+class TestSubscriptionManager:
+    @pytest.mark.asyncio
+    async def test_subscribe_market_data(self):
+        manager = SubscriptionManager()
+        socket = Socket()
+        manager.subscribe_market_data([265598, 8314], ['31', '84'])
+
+        assert await manager.sync(socket.send) == 2
+        assert socket.sent == ['smd+265598+{"fields":["31","84"]}', 'smd+8314+{"fields":["31","84"]}']
+
+    @pytest.mark.asyncio
+    async def test_idempotent(self):
+        manager = SubscriptionManager()
+        socket = Socket()
+        manager.subscribe_market_data(265598, ['31'])
+        await manager.sync(socket.send)
+
+        manager.subscribe_market_data(265598, ['31'])
+        assert manager.pending() == []
+        assert await manager.sync(socket.send) == 0
+
+    @pytest.mark.asyncio
+    async def test_unsubscribe(self):
+        manager = SubscriptionManager()
+        socket = Socket()
+        manager.subscribe_market_data(265598, ['31'])
+        manager.subscribe('sor')
+        await manager.sync(socket.send)
+
+        manager.unsubscribe_market_data(265598)
+        manager.unsubscribe('sor')
+        await manager.sync(socket.send)
+
+        assert socket.sent[2:] == ['umd+265598+{}', 'uor+{}']
+        assert manager.table() == {}
+
+    @pytest.mark.asyncio
+    async def test_replace_market_data(self):
+        manager = SubscriptionManager()
+        socket = Socket()
+        manager.subscribe_market_data([1, 2], ['31'])
+        await manager.sync(socket.send)
+
+        manager.replace_market_data([2, 3], ['31'])
+        assert manager.pending() == ['umd+1+{}', 'smd+3+{"fields":["31"]}']
+
+    @pytest.mark.asyncio
+    async def test_reset_active_resends(self):
+        manager = SubscriptionManager()
+        socket = Socket()
+        manager.subscribe('spl')
+        await manager.sync(socket.send)
+
+        manager.reset_active()
+        assert manager.pending() == ['spl+{}']
+
+    @pytest.mark.asyncio
+    async def test_rate_limited_batches(self):
+        manager = SubscriptionManager(max_messages_per_sec=200, batch_size=5)
+        socket = Socket()
+        manager.subscribe_market_data(list(range(15)), ['31'])
+
+        start = time.monotonic()
+        await manager.sync(socket.send)
+
+        # three batches of five with two pauses of 5/200 sec between them
+        assert time.monotonic() - start >= 0.045
+        assert len(socket.sent) == 15
+
+    def test_on_change_only_when_changed(self):
+        changes = []
+        manager = SubscriptionManager(on_change=lambda: changes.append(1))
+        manager.subscribe_market_data(1, ['31'])
+        manager.subscribe_market_data(1, ['31'])
+        manager.unsubscribe_market_data(2)
+        assert len(changes) == 1
+
+    def test_table(self):
+        manager = SubscriptionManager()
+        manager.subscribe_market_data(1, ['31'])
+        assert manager.table() == {'smd+1': {'desired': {'fields': ['31']}, 'active': None}}
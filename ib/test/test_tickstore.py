@@ -0,0 +1,90 @@
+import json
+import math
+
+import numpy as np
+import pytest
+
+from ib.dispatch import Message
+from ib.tickstore import TickBuffer, TickStore
+
+
+class TestTickBuffer:
+    def test_last_before_wrap(self):
+        buffer = TickBuffer(capacity=4)
+        for i in range(3):
+            buffer.append(float(i), last=100.0 + i)
+
+        window = buffer.last(2)
+        assert list(window.last) == [101.0, 102.0]
+        assert len(buffer) == 3
+
+    def test_last_after_wrap_is_view(self):
+        buffer = TickBuffer(capacity=4)
+        for i in range(10):
+            buffer.append(float(i), last=float(i))
+
+        window = buffer.last()
+        assert list(window.timestamp) == [6.0, 7.0, 8.0, 9.0]
+        # zero-copy and read-only
+        assert window.last.base is not None
+        with pytest.raises(ValueError):
+            window.last[0] = 0
+
+    def test_time_range(self):
+        buffer = TickBuffer(capacity=8)
+        for i in range(12):
+            buffer.append(float(i), bid=float(i))
+
+        window = buffer.time_range(5.5, 9.0)
+        assert list(window.bid) == [6.0, 7.0, 8.0, 9.0]
+        assert len(buffer.time_range(100, 200)) == 0
+
+    def test_timestamps_never_decrease(self):
+        buffer = TickBuffer(capacity=4)
+        buffer.append(5.0)
+        buffer.append(4.0)
+        assert list(buffer.last().timestamp) == [5.0, 5.0]
+
+    def test_copy_survives_wrap(self):
+        buffer = TickBuffer(capacity=2)
+        buffer.append(1.0, last=1.0)
+        kept = buffer.last().copy()
+        buffer.append(2.0, last=2.0)
+        buffer.append(3.0, last=3.0)
+        assert list(kept.last) == [1.0]
+
+
+class TestTickStore:
+    @staticmethod
+    def smd(conid, updated, **fields):
+        return Message.parse(json.dumps(dict(topic=f'smd+{conid}', conid=conid, _updated=updated, **fields)))
+
+    def test_fields_carry_forward(self):
+        store = TickStore(capacity=16)
+        store.on_message(self.smd(265598, 1000, **{'31': '150.25', '84': '150.20', '86': '150.30'}))
+        store.on_message(self.smd(265598, 2000, **{'31': '150.27', '88': '1.2K'}))
+
+        window = store.last(265598)
+        assert list(window.timestamp) == [1.0, 2.0]
+        assert list(window.last) == [150.25, 150.27]
+        assert list(window.bid) == [150.20, 150.20]
+        assert window.bid_size[1] == pytest.approx(1200)
+        assert np.isnan(window.bid_size[0])
+
+    def test_ignores_messages_without_prices(self):
+        store = TickStore()
+        store.on_message(self.smd(1, 1000, **{'55': 'AAPL'}))
+        assert 1 not in store
+
+    def test_read_unknown_conid(self):
+        store = TickStore()
+        assert len(store.last(42)) == 0
+        assert len(store.time_range(42, 0, 10)) == 0
+        assert store.last(42).last.dtype == np.float64
+        assert 42 not in store and len(store) == 0
+
+    def test_parse_value(self):
+        assert TickStore.parse_value('C150.5') == 150.5
+        assert TickStore.parse_value('1,200') == 1200.0
+        assert TickStore.parse_value('2.5M') == 2.5e6
+        assert math.isnan(TickStore.parse_value('N/A'))
@@ -0,0 +1,117 @@
+# test_tradesync.py
+import asyncio
+
+import pytest
+
+from ib.clientportal_http import ClientPortalHttp
+from ib.clientportal_http_async import ClientPortalHttpAsync
+from ib.endpoints import Endpoints
+from ib.simulator import GatewaySimulator
+from ib.tradesync import TradeStore, TradeSync
+from lib.scheduler import PeriodicScheduler
+
+
+def trade(n, account='U1', conid=1, time_ms=None):
+    return {'execution_id': f'e{n}', 'account': account, 'conid': conid,
+            'trade_time_r': n * 1000 if time_ms is None else time_ms}
+
+
+class TestTradeStore:
+    def test_dedup_and_delta(self):
+        store = TradeStore()
+        assert store.add([trade(1), trade(2)]) == [trade(1), trade(2)]
+        assert store.add([trade(1), trade(2), trade(3)]) == [trade(3)]
+        assert len(store) == 3
+
+        trades, sequence = store.since(0)
+        assert [t['execution_id'] for t in trades] == ['e1', 'e2', 'e3']
+        store.add([trade(4)])
+        trades, sequence = store.since(sequence)
+        assert [t['execution_id'] for t in trades] == ['e4']
+        assert sequence == store.sequence == 4
+
+    def test_queries(self):
+        store = TradeStore()
+        # out of time order
+        store.add([trade(5, 'U1', 10), trade(1, 'U2', 10), trade(3, 'U1', 20), trade(2, 'U1', 10)])
+
+        assert [t['execution_id'] for t in store.between()] == ['e1', 'e2', 'e3', 'e5']
+        assert [t['execution_id'] for t in store.between(2000, 5000)] == ['e2', 'e3']
+        assert [t['execution_id'] for t in store.by_account('U1')] == ['e5', 'e3', 'e2']
+        assert [t['execution_id'] for t in store.by_conid(10, start_ms=2000)] == ['e5', 'e2']
+        assert store.by_account('U9') == []
+        assert store.get('e3')['conid'] == 20
+
+    def test_prune(self):
+        store = TradeStore()
+        store.add([trade(n) for n in range(1, 6)])
+        assert store.prune(3000) == 2
+
+        assert 'e1' not in store and 'e3' in store
+        assert [t['execution_id'] for t in store.by_account('U1')] == ['e3', 'e4', 'e5']
+        assert store.since(0)[1] == 5
+
+
+class TestTradeSync:
+    def test_blocking_client(self):
+        gateway = GatewaySimulator(seed=1)
+        gateway.add_trades(20)
+        assert gateway.start_background()
+        try:
+            client = ClientPortalHttp(scheduler=PeriodicScheduler(autostart=False))
+            client.url_http = gateway.url_http
+            client.lazy_json = True
+            received = []
+            sync = TradeSync(client, on_trades=received.append)
+
+            first = sync.poll()
+            unchanged = sync.poll()
+            new = gateway.add_trades(3)
+            second = sync.poll()
+            client.session_pool.close()
+        finally:
+            gateway.stop_background()
+
+        assert len(first) == 20 and unchanged == [] and second == new
+        assert [len(trades) for trades in received] == [20, 3]
+        assert sync.unchanged == 1
+        assert len(sync.store.by_account(new[0]['account'])) > 0
+        trades, sequence = sync.delta(20)
+        assert trades == new and sequence == 23
+
+    @pytest.mark.asyncio
+    async def test_async_client(self):
+        async with GatewaySimulator(seed=1) as gateway, ClientPortalHttpAsync() as client:
+            client.url_http = gateway.url_http
+            gateway.add_trades(5)
+            sync = TradeSync(client)
+
+            assert len(await sync.poll()) == 5
+            gateway.add_trades(2)
+            assert len(await sync.poll()) == 2
+            gateway.inject_error(Endpoints.Trades, status=500)
+            assert await sync.poll() == []
+
+        assert len(sync.store) == 7
+        assert sync.errors == 1
+
+    @pytest.mark.asyncio
+    async def test_async_client_scheduled(self):
+        async with GatewaySimulator(seed=1) as gateway, ClientPortalHttpAsync() as client:
+            client.url_http = gateway.url_http
+            gateway.add_trades(5)
+            sync = TradeSync(client)
+
+            with pytest.raises(ValueError):
+                sync.start(scheduler=PeriodicScheduler(autostart=False))
+
+            # private AsyncPeriodicScheduler on the running loop; the first poll is due at once
+            sync.start(interval_sec=60)
+            for _ in range(100):
+                if len(sync.store) == 5:
+                    break
+                await asyncio.sleep(0.01)
+            sync.stop()
+
+        assert len(sync.store) == 5
+        assert sync.polls == 1
@@ -0,0 +1,201 @@
+# tickstore.py
+# In-memory store of streamed market data ('smd' websocket messages), one fixed size ring buffer per conid.
+import math
+
+import numpy as np
+
+
+class TickWindow:
+    """ Read-only column views over a range of ticks, oldest first.
+        Views share memory with the TickBuffer: they are valid until the buffer wraps over them (capacity - len(window)
+        further appends). Use copy() to keep a window longer.
+    """
+    __slots__ = ('timestamp', 'last', 'bid', 'ask', 'last_size', 'bid_size', 'ask_size')
+
+    def __init__(self, columns):
+        for name, column in columns.items():
+            setattr(self, name, column)
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def copy(self):
+        return TickWindow({name: getattr(self, name).copy() for name in TickWindow.__slots__})
+
+
+class TickBuffer:
+    """
+    TickBuffer
+    Fixed size columnar ring buffer of ticks. Every column is stored twice (positions i and i + capacity) so that any
+    window of the latest ticks is one contiguous slice and can be returned without copying.
+    Memory per buffer is fixed: 2 * capacity * (4 * 8 + 3 * 4) bytes.
+    Timestamps must not go backwards (older timestamps are clamped to the latest one).
+    """
+    columns = {
+        'timestamp': np.float64,    # seconds since epoch
+        'last': np.float64,
+        'bid': np.float64,
+        'ask': np.float64,
+        'last_size': np.float32,
+        'bid_size': np.float32,
+        'ask_size': np.float32,
+    }
+
+    def __init__(self, capacity=1024):
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+
+        self.capacity = capacity
+        self.count = 0
+        self.__columns = {name: np.full(2 * capacity, np.nan, dtype=dtype) for name, dtype in self.columns.items()}
+        # row order used by append()
+        self.__arrays = [self.__columns[name] for name in self.columns]
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp, last=math.nan, bid=math.nan, ask=math.nan,
+               last_size=math.nan, bid_size=math.nan, ask_size=math.nan):
+        """ Add a tick, overwriting the oldest once the buffer is full """
+        if self.count and timestamp < self.latest_timestamp:
+            timestamp = self.latest_timestamp
+
+        i = self.count % self.capacity
+        j = i + self.capacity
+        for array, value in zip(self.__arrays, (timestamp, last, bid, ask, last_size, bid_size, ask_size)):
+            array[i] = value
+            array[j] = value
+        self.count += 1
+
+    @property
+    def latest_timestamp(self):
+        return self.__columns['timestamp'][(self.count - 1) % self.capacity] if self.count else math.nan
+
+    def last(self, n=None):
+        """ The latest n ticks (all stored ticks if n is None) """
+        size = len(self)
+        n = size if n is None else max(0, min(n, size))
+        end = self.count % self.capacity + self.capacity
+        return self.__window(end - n, end)
+
+    def time_range(self, start, end):
+        """ Ticks with start <= timestamp <= end """
+        size = len(self)
+        stop = self.count % self.capacity + self.capacity
+        first = stop - size
+        timestamps = self.__columns['timestamp'][first:stop]
+        lo = first + int(np.searchsorted(timestamps, start, side='left'))
+        hi = first + int(np.searchsorted(timestamps, end, side='right'))
+        return self.__window(lo, hi)
+
+    def __window(self, start, stop):
+        columns = {}
+        for name, array in self.__columns.items():
+            view = array[start:stop]
+            view.flags.writeable = False
+            columns[name] = view
+        return TickWindow(columns)
+
+
+class TickStore:
+    """
+    TickStore
+    Market data ticks per conid. Register on_message as the websocket 'smd' handler:
+        store = TickStore()
+        client_ws.dispatcher.register('smd', store.on_message)
+    Fields missing from an update carry their previous value forward (IB only sends changed fields).
+    Parameters:
+        - capacity (1024) = Ticks kept per conid.
+    """
+    # IB market data field ids -> TickBuffer column
+    fields = {
+        '31': 'last',
+        '84': 'bid',
+        '86': 'ask',
+        '7059': 'last_size',
+        '88': 'bid_size',
+        '85': 'ask_size',
+    }
+    # multipliers for abbreviated sizes such as '1.2K'
+    size_suffix = {'K': 1e3, 'M': 1e6, 'B': 1e9}
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.__buffers = {}
+        # latest value of every field per conid, in TickBuffer column order (excluding timestamp)
+        self.__latest = {}
+
+    def __contains__(self, conid):
+        return conid in self.__buffers
+
+    def __len__(self):
+        return len(self.__buffers)
+
+    def conids(self):
+        return list(self.__buffers)
+
+    def buffer(self, conid) -> TickBuffer:
+        """ Buffer for conid, created on first use """
+        buffer = self.__buffers.get(conid)
+        if buffer is None:
+            buffer = self.__buffers[conid] = TickBuffer(self.capacity)
+            self.__latest[conid] = dict.fromkeys(self.fields.values(), math.nan)
+        return buffer
+
+    def last(self, conid, n=None) -> TickWindow:
+        """ Latest n ticks of conid. Empty for unknown conids, which are not added to the store """
+        buffer = self.__buffers.get(conid)
+        return buffer.last(n) if buffer is not None else self.__empty_window()
+
+    def time_range(self, conid, start, end) -> TickWindow:
+        """ Ticks of conid with start <= timestamp <= end. Empty for unknown conids """
+        buffer = self.__buffers.get(conid)
+        return buffer.time_range(start, end) if buffer is not None else self.__empty_window()
+
+    @staticmethod
+    def __empty_window():
+        return TickWindow({name: np.empty(0, dtype=dtype) for name, dtype in TickBuffer.columns.items()})
+
+    def on_message(self, message):
+        """ Store an 'smd' ib.dispatch.Message """
+        data = message.data
+        if not data or message.key is None:
+            return
+
+        updates = {column: self.parse_value(data[field]) for field, column in self.fields.items() if field in data}
+        if not updates:
+            return
+
+        self.update(message.key, data.get('_updated'), **updates)
+
+    def update(self, conid, updated_ms=None, **values):
+        """ Add a tick for conid from the changed values. updated_ms: IB '_updated' (ms since epoch) """
+        buffer = self.buffer(conid)
+        latest = self.__latest[conid]
+        latest.update(values)
+        timestamp = updated_ms / 1000.0 if updated_ms is not None else buffer.latest_timestamp
+        if math.isnan(timestamp):
+            timestamp = 0.0
+        buffer.append(timestamp, **latest)
+
+    @staticmethod
+    def parse_value(value):
+        """ Convert an IB market data value ('150.25', 'C150.25', '1,200', '1.2K') to float. NaN if not numeric """
+        if isinstance(value, (int, float)):
+            return float(value)
+
+        text = str(value).replace(',', '').strip()
+        # 'C' = prior close, 'H' = halted
+        text = text.lstrip('CH')
+        multiplier = 1.0
+        if text and text[-1] in TickStore.size_suffix:
+            multiplier = TickStore.size_suffix[text[-1]]
+            text = text[:-1]
+        try:
+            return float(text) * multiplier
+        except ValueError:
+            return math.nan
+
+
+if __name__ == '__main__':
+    print("=== Tick Store ===")
@@ -0,0 +1,239 @@
+# tradesync.py
+# Incremental synchronization of executions (Endpoints.Trades) into a local deduplicated, indexed store
+import bisect
+import inspect
+import threading
+
+from ib.error import Error
+from lib.log import Log
+from lib.scheduler import AsyncPeriodicScheduler, PeriodicScheduler
+
+log = Log(__name__)
+
+
+class TradeStore:
+    """
+    TradeStore
+    Executions keyed by execution_id, indexed by account, conid and trade time (trade_time_r, ms since epoch).
+    Every new execution also gets a sequence number, so consumers can ask for what arrived since their last read.
+    Adding is O(new executions); known executions cost one dict lookup. Thread safe.
+    """
+    def __init__(self):
+        self.__trades = {}
+        # arrival order. Sequence number n is __log[n - 1]
+        self.__log = []
+        self.__by_account = {}
+        self.__by_conid = {}
+        # sorted (trade_time_r, execution_id) keys with the executions in the same order
+        self.__time_keys = []
+        self.__time_trades = []
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__trades)
+
+    def __contains__(self, execution_id):
+        return execution_id in self.__trades
+
+    @property
+    def sequence(self):
+        """ Sequence number of the latest execution (0 when empty) """
+        return len(self.__log)
+
+    def add(self, trades):
+        """ Add executions not seen before. Returns the new ones, in the given order """
+        added = []
+        with self.__lock:
+            known = self.__trades
+            for trade in trades:
+                execution_id = trade.get('execution_id')
+                if execution_id is None or execution_id in known:
+                    continue
+                known[execution_id] = trade
+                self.__log.append(trade)
+                self.__by_account.setdefault(trade.get('account'), []).append(trade)
+                self.__by_conid.setdefault(trade.get('conid'), []).append(trade)
+                key = (trade.get('trade_time_r') or 0, execution_id)
+                # executions mostly arrive in time order: appending is the common case
+                if not self.__time_keys or key > self.__time_keys[-1]:
+                    self.__time_keys.append(key)
+                    self.__time_trades.append(trade)
+                else:
+                    position = bisect.bisect(self.__time_keys, key)
+                    self.__time_keys.insert(position, key)
+                    self.__time_trades.insert(position, trade)
+                added.append(trade)
+        return added
+
+    def get(self, execution_id, default=None):
+        return self.__trades.get(execution_id, default)
+
+    def since(self, sequence):
+        """ Executions added after sequence number sequence, with the new sequence number """
+        with self.__lock:
+            return self.__log[sequence:], len(self.__log)
+
+    def by_account(self, account, start_ms=None, end_ms=None):
+        """ Executions of an account, optionally limited to trade times in [start_ms, end_ms) """
+        with self.__lock:
+            return self.__filter_time(self.__by_account.get(account, ()), start_ms, end_ms)
+
+    def by_conid(self, conid, start_ms=None, end_ms=None):
+        """ Executions of a contract, optionally limited to trade times in [start_ms, end_ms) """
+        with self.__lock:
+            return self.__filter_time(self.__by_conid.get(conid, ()), start_ms, end_ms)
+
+    def between(self, start_ms=None, end_ms=None):
+        """ Executions with trade times in [start_ms, end_ms), oldest first """
+        with self.__lock:
+            first = 0 if start_ms is None else bisect.bisect_left(self.__time_keys, (start_ms,))
+            last = len(self.__time_keys) if end_ms is None else bisect.bisect_left(self.__time_keys, (end_ms,))
+            return self.__time_trades[first:last]
+
+    def prune(self, before_ms):
+        """ Drop executions with trade times before before_ms from the indexes. Sequence numbers are kept, so
+            since() keeps working. Returns the number dropped.
+            Use a before_ms older than the gateway's 7 day window, or the next poll adds the executions again.
+        """
+        with self.__lock:
+            count = bisect.bisect_left(self.__time_keys, (before_ms,))
+            if count == 0:
+                return 0
+            dropped = self.__time_trades[:count]
+            del self.__time_keys[:count]
+            del self.__time_trades[:count]
+            dropped_ids = set()
+            for trade in dropped:
+                execution_id = trade['execution_id']
+                dropped_ids.add(execution_id)
+                del self.__trades[execution_id]
+            for index in (self.__by_account, self.__by_conid):
+                for key in list(index):
+                    kept = [trade for trade in index[key] if trade['execution_id'] not in dropped_ids]
+                    if kept:
+                        index[key] = kept
+                    else:
+                        del index[key]
+            # keep sequence numbers: dropped log entries become None
+            for position, trade in enumerate(self.__log):
+                if trade is not None and trade['execution_id'] in dropped_ids:
+                    self.__log[position] = None
+            return count
+
+    @staticmethod
+    def __filter_time(trades, start_ms, end_ms):
+        if start_ms is None and end_ms is None:
+            return list(trades)
+        return [trade for trade in trades
+                if (start_ms is None or (trade.get('trade_time_r') or 0) >= start_ms) and
+                (end_ms is None or (trade.get('trade_time_r') or 0) < end_ms)]
+
+
+class TradeSync:
+    """
+    TradeSync
+    Polls Endpoints.Trades once for all consumers and merges the response into a TradeStore. Consumers get only new
+    executions, from delta() or from callbacks, and query the store instead of requesting the trade list themselves.
+    The gateway has no 'since' parameter, so every poll still transfers the full current plus 6 days list. With
+    client.lazy_json = True an unchanged response body is detected before decoding and costs no decoding or merging.
+    Works with ClientPortalHttp (poll() returns the new executions) and ClientPortalHttpAsync (poll() returns an
+    awaitable), and with PeriodicScheduler and AsyncPeriodicScheduler.
+    Parameters:
+        - client = ClientPortalHttp or ClientPortalHttpAsync.
+        - store (TradeStore()) = Store receiving the executions.
+        - on_trades (None) = Callback on_trades(new_trades) after a poll found new executions.
+    """
+    def __init__(self, client, store=None, on_trades=None):
+        self.client = client
+        self.store = store if store is not None else TradeStore()
+        self.polls = 0
+        self.unchanged = 0
+        self.errors = 0
+        self.__callbacks = []
+        if on_trades is not None:
+            self.__callbacks.append(on_trades)
+        self.__last_raw = None
+        self.__task = None
+        self.__scheduler = None
+
+    def add_callback(self, callback):
+        """ callback(new_trades) is called after a poll found new executions """
+        self.__callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self.__callbacks.remove(callback)
+
+    def delta(self, sequence=0):
+        """ Executions received after sequence (0 = all), and the sequence to pass next time """
+        trades, sequence = self.store.since(sequence)
+        return [trade for trade in trades if trade is not None], sequence
+
+    def poll(self):
+        """ Request the trade list and merge it. Returns the new executions (an awaitable for asyncio clients) """
+        result = self.client.clientrequest_trades()
+        if inspect.isawaitable(result):
+            return self.__poll_async(result)
+        return self.__merge(result)
+
+    def start(self, interval_sec=5, scheduler=None):
+        """ poll() every interval_sec on scheduler, or on a private scheduler: a PeriodicScheduler thread, or for
+            asyncio clients an AsyncPeriodicScheduler on the running event loop (call start() from within it).
+            asyncio clients need an AsyncPeriodicScheduler, which awaits the polls.
+            The gateway paces Endpoints.Trades at one request per 5 sec.
+        """
+        asyncio_client = inspect.iscoroutinefunction(self.client.clientrequest_get)
+        if asyncio_client and scheduler is not None and not isinstance(scheduler, AsyncPeriodicScheduler):
+            raise ValueError('TradeSync: asyncio clients must be polled on an AsyncPeriodicScheduler')
+
+        self.stop()
+        if scheduler is None and asyncio_client:
+            scheduler = self.__scheduler = AsyncPeriodicScheduler(name='TradeSync')
+            scheduler.start()
+        elif scheduler is None:
+            scheduler = self.__scheduler = PeriodicScheduler(name='TradeSync')
+        self.__task = scheduler.schedule(self.poll, interval_sec, name='TradeSync')
+        return self.__task
+
+    def stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+        if self.__scheduler is not None:
+            self.__scheduler.stop()
+            self.__scheduler = None
+
+    async def __poll_async(self, awaitable):
+        return self.__merge(await awaitable)
+
+    def __merge(self, result):
+        self.polls += 1
+        if result.error != Error.No_Error:
+            self.errors += 1
+            log.debug('TradeSync: Poll failed: Code:{}, {}', result.statusCode, result.error)
+            return []
+
+        raw = result.raw
+        if raw is not None:
+            if raw == self.__last_raw:
+                self.unchanged += 1
+                return []
+            self.__last_raw = raw
+
+        trades = result.json
+        if not isinstance(trades, list):
+            log.debug('TradeSync: Unexpected trades response: {}', log.payload(trades))
+            return []
+
+        added = self.store.add(trades)
+        if added:
+            log.debug('TradeSync: {} new executions ({} stored)', len(added), len(self.store))
+            for callback in list(self.__callbacks):
+                try:
+                    callback(added)
+                except Exception as e:
+                    log.debug('EXCEPTION: Trade callback failed: {}', e)
+        return added
+
+
+if __name__ == '__main__':
+    print("=== Trade Sync ===")
@@ -0,0 +1,248 @@
+# asynchttpendpoints.py
+import asyncio
+import copy
+import time
+
+import aiohttp
+from lib.log import Log
+
+from ib.error import Error
+from lib import jsoncodec
+from lib.certificate import Certificate, CertificateError
+from lib.httpendpoints import HttpEndpoints
+from lib.pacing import RequestPriority, RequestThrottled
+from lib.singleflight import AsyncSingleFlight
+
+log = Log(__name__)
+
+
+class AsyncResponse:
+    """ Fully read aiohttp response, presented with the requests.Response attributes used by result checking """
+    def __init__(self, status_code: int, content: bytes):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        return jsoncodec.decode(self.content)
+
+
+class AsyncHttpSessionPool:
+    """
+    AsyncHttpSessionPool
+    Keep-alive connection pool for asyncio HTTP(S) requests. May be shared by several AsyncHttpEndpoints clients
+    running on the same event loop.
+    Parameters:
+        - pool_size (10) = Maximum number of simultaneous connections.
+        - certificate_path (None) = PEM file for the ssl_context of https connections, taken from the shared
+                                    Certificate cache. The pool is rebuilt when the file changes. None disables
+                                    certificate checks.
+    """
+    def __init__(self, pool_size=10, certificate_path=None):
+        if pool_size < 1:
+            raise ValueError('pool_size must be at least 1')
+
+        self.pool_size = pool_size
+        self.certificate_path = certificate_path
+        self.ssl_context = None
+        self.__session = None
+        # sessions replaced after a certificate change, closing in the background
+        self.__closing = set()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """ Pooled session, created on first use. Must be accessed from within the running event loop. """
+        session = self.__session
+        if session is not None and not session.closed and self.certificate_path \
+                and self.__certificate_context() is not self.ssl_context:
+            log.debug('AsyncHttpSessionPool: Certificate changed, reopening connections')
+            task = asyncio.get_running_loop().create_task(session.close())
+            self.__closing.add(task)
+            task.add_done_callback(self.__closing.discard)
+            self.__session = None
+
+        if self.__session is None or self.__session.closed:
+            self.ssl_context = self.__certificate_context() if self.certificate_path else None
+            # ssl=False matches verify=False used by the blocking client (gateway uses a self-signed certificate)
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ssl=self.ssl_context or False)
+            self.__session = aiohttp.ClientSession(connector=connector)
+            log.debug('AsyncHttpSessionPool: Created (pool_size={})', self.pool_size)
+        return self.__session
+
+    async def request(self, method, url, timeout_sec, **kwargs) -> AsyncResponse:
+        """ Send a request and read the complete body """
+        timeout = aiohttp.ClientTimeout(total=timeout_sec)
+        async with self.session.request(method, url, timeout=timeout, **kwargs) as resp:
+            content = await resp.read()
+            return AsyncResponse(resp.status, content)
+
+    async def close(self):
+        """ Close all pooled connections """
+        if self.__session is not None and not self.__session.closed:
+            await self.__session.close()
+            log.debug('AsyncHttpSessionPool: Closed (pool_size={})', self.pool_size)
+        self.__session = None
+        if self.__closing:
+            await asyncio.gather(*self.__closing)
+
+    def __certificate_context(self):
+        result = Certificate.get_certificate(self.certificate_path)
+        if result.error != CertificateError.Ok:
+            log.debug('AsyncHttpSessionPool: Problems obtaining certificate: {}', result.error)
+        return result.ssl_context
+
+
+class AsyncHttpEndpoints:
+    """
+    AsyncHttpEndpoints
+    asyncio counterpart of HttpEndpoints. Provide awaitable Get/Post operations for a base URL with endpoints.
+    Results are returned as the same RequestResult objects as the blocking client.
+    Parameters:
+        - pool_size (10) = Maximum number of simultaneous gateway connections when no session_pool is given.
+        - session_pool (None) = AsyncHttpSessionPool to share between several clients.
+        - batch_concurrency (pool_size) = Default number of requests clientrequest_batch() runs at once.
+        - response_cache (None) = ResponseCache for GET requests. None disables caching.
+        - coalesce_methods (('GET',)) = Methods for which concurrent identical requests share one gateway call.
+        - pacing (None) = PacingScheduler which paces requests under the gateway rate limits. None sends immediately.
+        - lazy_json (False) = Keep response bodies undecoded until RequestResult.json is first read.
+        - metrics_registry (None) = MetricsRegistry receiving count, errors and latency of every gateway request.
+    """
+    # used for JSON GET/POST requests
+    headers = HttpEndpoints.headers
+
+    def __init__(self, name='Unknown', pool_size=10, session_pool=None, batch_concurrency=None, response_cache=None,
+                 coalesce_methods=('GET',), pacing=None, lazy_json=False, metrics_registry=None):
+        self.name = name
+        self.session_pool = session_pool if session_pool is not None else AsyncHttpSessionPool(pool_size=pool_size)
+
+        # gateway base URL for submitting all client portal API. All commands append to this string
+        self.url_http = ''
+        self.request_timeout_sec = 10
+        self.batch_concurrency = batch_concurrency if batch_concurrency is not None else self.session_pool.pool_size
+        self.response_cache = response_cache
+        self.coalesce_methods = coalesce_methods
+        self.single_flight = AsyncSingleFlight(share=copy.copy)
+        self.pacing = pacing
+        self.lazy_json = lazy_json
+        self.metrics_registry = metrics_registry
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def clientrequest_get(self, endpoint='', priority=RequestPriority.Normal):
+        """ Gateway Get message request using desired endpoint. Served from response_cache when possible.
+            priority orders the request against others waiting for pacing.
+        """
+        if self.response_cache is not None:
+            result = self.response_cache.get('GET', endpoint)
+            if result is not None:
+                return result
+
+        return await self.__coalesce('GET', endpoint, '', lambda: self.__get_result(endpoint, priority))
+
+    async def clientrequest_post(self, endpoint='', data='', priority=RequestPriority.Normal):
+        """ Gateway Post message request using desired endpoint. data is sent as the JSON body.
+            priority orders the request against others waiting for pacing.
+        """
+        return await self.__coalesce('POST', endpoint, data, lambda: self.__post_result(endpoint, data, priority))
+
+    async def clientrequest_batch(self, items, max_concurrency=None):
+        """ Issue several gateway requests concurrently. See HttpEndpoints.clientrequest_batch(). """
+        semaphore = asyncio.Semaphore(max(1, max_concurrency or self.batch_concurrency))
+
+        async def bounded(item):
+            async with semaphore:
+                return await self.__batch_request(item)
+
+        return list(await asyncio.gather(*[bounded(item) for item in items]))
+
+    def on_result(self, method, endpoint, result):
+        """ Called with every RequestResult obtained from the gateway (not for cached results) """
+        pass
+
+    async def close(self):
+        """ Release pooled connections """
+        await self.session_pool.close()
+
+    async def __coalesce(self, method, endpoint, data, request):
+        """ Share one gateway call between concurrent identical requests (see coalesce_methods) """
+        if method not in self.coalesce_methods:
+            return await request()
+        return await self.single_flight.do((method, endpoint, repr(data)), request)
+
+    async def __get_result(self, endpoint, priority):
+        cpurl, resp, exception, elapsed = await self.__request('GET', endpoint, priority)
+        result = HttpEndpoints.check_response(cpurl, resp, exception, self.lazy_json)
+        self.__record(endpoint, elapsed, result)
+        if self.response_cache is not None:
+            self.response_cache.put('GET', endpoint, result)
+        self.on_result('GET', endpoint, result)
+        log.debug('GET({}), status={}, error={}, msg={}', endpoint, result.statusCode, result.error,
+                  log.payload(result.json) if result.decoded else '<not decoded>')
+        return result
+
+    async def __post_result(self, endpoint, data, priority):
+        cpurl, resp, exception, elapsed = await self.__request('POST', endpoint, priority, json=data)
+        result = HttpEndpoints.check_response(cpurl, resp, exception, self.lazy_json)
+        self.__record(endpoint, elapsed, result)
+        self.on_result('POST', endpoint, result)
+        log.debug('POST({}), status={}, error={}, msg={}', endpoint, result.statusCode, result.error,
+                  log.payload(result.json) if result.decoded else '<not decoded>')
+        return result
+
+    def __record(self, endpoint, elapsed, result):
+        if self.metrics_registry is not None:
+            self.metrics_registry.record_request(endpoint, elapsed, result.error != Error.No_Error)
+
+    async def __batch_request(self, item):
+        try:
+            method, endpoint, payload = HttpEndpoints.parse_batch_item(item)
+        except (TypeError, ValueError) as e:
+            return HttpEndpoints.batch_error(item, Error.Invalid_Request, e)
+
+        try:
+            if method == 'GET':
+                return await self.clientrequest_get(endpoint)
+            return await self.clientrequest_post(endpoint, payload)
+
+        except asyncio.CancelledError:
+            raise
+
+        except Exception as e:
+            return HttpEndpoints.batch_error(item, Error.Unknown, e)
+
+    async def __request(self, method, endpoint: str = '', priority=RequestPriority.Normal, **kwargs):
+        cpurl = self.url_http + endpoint
+        resp = None
+        resp_exception = None
+        elapsed = None
+
+        try:
+            if self.pacing is not None and not await self.pacing.acquire_async(endpoint, priority):
+                raise RequestThrottled(endpoint, self.pacing.max_wait_sec)
+            started = time.perf_counter()
+            try:
+                resp = await self.session_pool.request(method, cpurl, self.request_timeout_sec,
+                                                       headers=AsyncHttpEndpoints.headers, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+
+        # cancellation must propagate so the caller's task can be stopped
+        except asyncio.CancelledError:
+            raise
+
+        # grab any exceptions and return. They will be passed off to check_response for handling
+        except Exception as e:
+            resp_exception = e
+
+        return cpurl, resp, resp_exception, elapsed
+
+
+if __name__ == '__main__':
+    print("=== Async HTTP Endpoint ===")
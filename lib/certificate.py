@@ -1,5 +1,8 @@
 # ssl_context.py
+import os
 import ssl
+import threading
+import time
 from enum import Enum
 from pathlib import Path
 from dataclasses import dataclass
@@ -24,10 +27,67 @@ class Certificate:
     Perform the following in the same directory as this .py module
     1) openssl req -x509 -newkey rsa:4096 -keyout {keyname}.pem -out {publickey_name}.pem -nodes
     2) openssl x509 -outform der -in {publickey_name}.pem -out {publickey_name}.crt
+    Contexts are cached process wide by path, so HTTP and websocket clients share one context (and its TLS session
+    cache). A cached context is replaced when the file's mtime or size changes. The file is checked at most once
+    every revalidate_sec, so reconnect storms cause no file I/O.
     """
+    revalidate_sec = 1.0
+    clock = time.monotonic
+    # path -> [(mtime_ns, size), ssl_context, checked (clock)]
+    __cache = {}
+    __lock = threading.Lock()
+
+    @staticmethod
+    def get_certificate(certificate_path='', cached=True) -> CertificateReturn:
+        """ Obtain a ssl_context for use in SSL operations. cached=False always loads a new context.
+            An empty path (the default) gives a default context, as load_certificate() does. It is cached under ''
+            and never revalidated, as there is no file to watch.
+        """
+        if not cached:
+            return Certificate.load_certificate(certificate_path)
+
+        key = os.fspath(certificate_path)
+        now = Certificate.clock()
+        with Certificate.__lock:
+            entry = Certificate.__cache.get(key)
+            if not key:
+                if entry is None:
+                    result = Certificate.load_certificate(certificate_path)
+                    if result.error != CertificateError.Ok:
+                        return result
+                    entry = Certificate.__cache[key] = [None, result.ssl_context, now]
+                return CertificateReturn(entry[1], CertificateError.Ok)
+
+            if entry is not None and now - entry[2] < Certificate.revalidate_sec:
+                return CertificateReturn(entry[1], CertificateError.Ok)
+
+            try:
+                stat = os.stat(key)
+                signature = (stat.st_mtime_ns, stat.st_size)
+            except (OSError, ValueError):
+                Certificate.__cache.pop(key, None)
+                return CertificateReturn(None, CertificateError.Invalid_Path)
+
+            if entry is not None and entry[0] == signature:
+                entry[2] = now
+                return CertificateReturn(entry[1], CertificateError.Ok)
+
+            result = Certificate.load_certificate(certificate_path)
+            if result.error == CertificateError.Ok:
+                Certificate.__cache[key] = [signature, result.ssl_context, now]
+            else:
+                Certificate.__cache.pop(key, None)
+            return result
+
+    @staticmethod
+    def clear_cache():
+        """ Forget all cached contexts """
+        with Certificate.__lock:
+            Certificate.__cache.clear()
+
     @staticmethod
-    def get_certificate(certificate_path='') -> CertificateReturn:
-        """ Obtain a ssl_context for use in SSL operations."""
+    def load_certificate(certificate_path='') -> CertificateReturn:
+        """ Load a new ssl_context from certificate_path (uncached) """
 
         result = CertificateReturn(None, CertificateError.Ok)
 
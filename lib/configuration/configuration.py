@@ -1,10 +1,15 @@
+import threading
 from enum import Enum
 from pathlib import Path, WindowsPath
 
 import validate
 from configobj import ConfigObj, Section
 from validate import Validator, ValidateError
-from loguru import logger
+from lib.configuration.snapshot import ConfigurationSnapshot
+from lib.log import Log
+from lib.scheduler import PeriodicScheduler
+
+log = Log(__name__)
 
 
 class ConfigurationErrorReason(Enum):
@@ -13,6 +18,7 @@ class ConfigurationErrorReason(Enum):
     InvalidFileNameType = 2,    # File wasn't string or Path type
     SearchFailed = 3,           # File couldn't be found at local or higher level (within search limits)
     InvalidParameter = 4,       # Couldn't find parameter in the configuration file and it had no default
+    InvalidParameterType = 5,   # Parameter exists but its validated value is not of the requested type
 
 
 class ConfigurationError(Exception):
@@ -22,19 +28,95 @@ class ConfigurationError(Exception):
         self.details = details
 
 
-class Configuration(ConfigObj):
-    """ Wrapper for ConfigObj which allows key indexing without multi-square brackets """
-    def __init__(self, infile='config.ini', configspec='config_spec.ini', search_levels=0, delimeter='/'):
+class IndexInvalidation:
+    """ Section mix-in which invalidates the main Configuration's index whenever the section is modified.
+        Sub-sections are switched to IndexedSection as they are added, so changes at any depth are noticed.
+    """
+    def __setitem__(self, key, value, unrepr=False):
+        super().__setitem__(key, value, unrepr)
+        value = dict.get(self, key)
+        if isinstance(value, Section) and not isinstance(value, IndexInvalidation):
+            IndexedSection.adopt(value)
+        self.invalidate_index()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.invalidate_index()
+
+    def clear(self):
+        super().clear()
+        self.invalidate_index()
+
+    def rename(self, oldkey, newkey):
+        super().rename(oldkey, newkey)
+        self.invalidate_index()
+
+    def restore_default(self, key):
+        default = super().restore_default(key)
+        self.invalidate_index()
+        return default
+
+    def invalidate_index(self):
+        if self.main is not self:
+            self.main.invalidate_index()
+
+
+class IndexedSection(IndexInvalidation, Section):
+    """ configobj Section which keeps the Configuration index consistent """
+    @staticmethod
+    def adopt(section):
+        """ Switch a plain Section (and its sub-sections) to IndexedSection """
+        section.__class__ = IndexedSection
+        for name in section.sections:
+            child = dict.get(section, name)
+            if not isinstance(child, IndexInvalidation):
+                IndexedSection.adopt(child)
+
+
+class Configuration(IndexInvalidation, ConfigObj):
+    """ Wrapper for ConfigObj which allows key indexing without multi-square brackets
+        Validated parameters are kept in a flat index ('level1/level2/param' -> value), so get() is a single dict
+        lookup. The index is rebuilt on the next get() after any change made through the ConfigObj/Section API.
+        snapshot_path keeps a ConfigurationSnapshot of the validated result. Later instances load it instead of
+        searching, parsing and validating while the files are unchanged (snapshot_loaded is then True).
+        watch() polls the files for changes. A changed file is re-parsed, only the changed sections are revalidated,
+        and the new values replace the index in one step, so get() returns either all old or all new values.
+        Callbacks added with add_watch_callback() then receive the changed key paths ('level1/param1').
+    """
+    # serialises reloads of all instances
+    reload_lock = threading.Lock()
+
+    def __init__(self, infile='config.ini', configspec='config_spec.ini', search_levels=0, delimeter='/',
+                 snapshot_path=None):
+        self.__index = None
+        self.__swapping = False
+        self.__watch_callbacks = []
+        self.__watch_task = None
+        self.__watch_scheduler = None
+        self.snapshot_loaded = False
         if type(delimeter) is str:
             self.param_delimeter = delimeter
         else:
-            self.__logger_config(f'Configuration: Non-string delimeter ({delimeter})')
+            log.debug('Configuration: Non-string delimeter ({})', delimeter)
             raise TypeError
 
         path_config = Path(infile).absolute()
         path_spec = Path(configspec).absolute()
         config_files_found = True
         file_exception = None
+        # locations tried without success, recorded for the snapshot
+        missing = []
+
+        snapshot = None
+        if snapshot_path is not None:
+            snapshot = ConfigurationSnapshot(snapshot_path)
+            snapshot_key = (str(path_config), str(path_spec), search_levels, delimeter)
+            state = snapshot.load(snapshot_key)
+            if state is not None:
+                self.__restore(state)
+                self.snapshot_loaded = True
+                log.debug('Configuration: {}, Spec: {} (snapshot)', infile, configspec)
+                return
 
         # If we pass -1 to search levels, we are going to search all the way up to the path anchor to find the files
         if search_levels < 0:
@@ -44,7 +126,9 @@ class Configuration(ConfigObj):
             search_levels -= 1
             try:
                 super().__init__(str(path_config), configspec=str(path_spec), file_error=True)
+                break
             except IOError as e:
+                missing.append((path_config, path_spec))
                 try:
                     path_config = self.__walk_dir_up__(path_config)
                     path_spec = self.__walk_dir_up__(path_spec)
@@ -63,18 +147,38 @@ class Configuration(ConfigObj):
                 err.reason = ConfigurationErrorReason.SpecificationNotFound
             raise err
 
-        self.__logger_config(f'Configuration: {infile}, Spec: {configspec}')
+        log.debug('Configuration: {}, Spec: {}', infile, configspec)
+        # resolved files and their unvalidated content, for detecting and diffing changes in watch mode
+        self.config_path = path_config
+        self.spec_path = path_spec
+        self.__signatures = self.__file_signatures()
+        self.__raw = self.dict()
         validator = Validator()
         results = self.validate(validator)
 
         if results is not True:
-            self.__logger_config(f'{infile} validation failure, {results}')
+            log.debug('Configuration:{} validation failure, {}', infile, results)
             raise ValidateError
 
-    @staticmethod
-    def __logger_config(msg, level='DEBUG'):
-        """ Consistent message format for logging"""
-        logger.log(level, f'Configuration:{msg}')
+        self.__build_index()
+
+        if snapshot is not None:
+            snapshot.save(snapshot_key, (path_config, path_spec), missing, self)
+
+    def __restore(self, state):
+        """ Take over the sections and attributes of a Configuration loaded from a snapshot """
+        dict.update(self, state)
+        self.__dict__.update(state.__dict__)
+        self.parent = self.main = self
+        sections = [self]
+        while sections:
+            section = sections.pop()
+            for name in section.sections:
+                child = dict.get(section, name)
+                child.main = self
+                if child.parent is state:
+                    child.parent = self
+                sections.append(child)
 
     @staticmethod
     def __walk_dir_up__(dir_path: Path):
@@ -110,42 +214,257 @@ class Configuration(ConfigObj):
                                      details='Filename must be of type string or Path')
             raise err
         except Exception as e:
-            Configuration.__logger_config(f'Unknown exception: {e}')
+            log.debug('Configuration:Unknown exception: {}', e)
 
         path_obj = path_obj.absolute()
         return path_obj
 
+    def invalidate_index(self):
+        """ Discard the parameter index. It is rebuilt by the next get() """
+        # while reloading, get() keeps using the old index until the new one is complete
+        if not self.__swapping:
+            self.__index = None
+
+    def index(self):
+        """ Flat {key path: value} view of all parameters """
+        index = self.__index
+        return dict(index if index is not None else self.__build_index())
+
+    def __build_index(self):
+        index = self.__flatten()
+        self.__index = index
+        return index
+
+    def __flatten(self):
+        index = {}
+        delimeter = self.param_delimeter
+        sections = [('', self)]
+        while sections:
+            prefix, section = sections.pop()
+            for name in section.scalars:
+                # item access applies string interpolation
+                value = section[name]
+                if value is not None:
+                    index[prefix + name] = value
+            for name in section.sections:
+                sections.append((prefix + name + delimeter, dict.get(section, name)))
+
+        return index
+
     def get(self, key):
         """ return parameter using multi level indexing similar to file paths:
             Example: level1/level2/level3/parameter_name
         """
+        index = self.__index
+        if index is None:
+            index = self.__build_index()
+
+        try:
+            return index[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # unhashable key
+            pass
+
         if type(key) is not str:
-            self.__logger_config(f'Configuration: Non-String ({key}) passed as parameter name')
+            log.debug('Configuration: Non-String ({}) passed as parameter name', key)
             raise TypeError
 
-        levels = key.split(self.param_delimeter)
-        parse_obj = self
-        param_val = None
+        log.debug('Configuration:Parameter ({}) not found and has no default value', key)
+        raise ConfigurationError(reason=ConfigurationErrorReason.InvalidParameter,
+                                 details=f'Parameter ({key}) not found and has no default value')
+
+    def get_typed(self, key, value_type):
+        """ get() which also checks the validated value is of value_type (type or tuple of types) """
+        value = self.get(key)
+        if not isinstance(value, value_type) or (isinstance(value, bool) and bool not in self.__types(value_type)):
+            raise ConfigurationError(reason=ConfigurationErrorReason.InvalidParameterType,
+                                     details=f'Parameter ({key}) is {type(value).__name__}, not {value_type}')
+        return value
+
+    def get_int(self, key) -> int:
+        return self.get_typed(key, int)
+
+    def get_float(self, key) -> float:
+        """ float parameter. Integers are accepted and converted """
+        return float(self.get_typed(key, (float, int)))
+
+    def get_bool(self, key) -> bool:
+        return self.get_typed(key, bool)
+
+    def get_str(self, key) -> str:
+        return self.get_typed(key, str)
 
-        # Walk the levels until only a string is found. This is the actual parameter
-        for level in levels:
+    def get_list(self, key) -> list:
+        return self.get_typed(key, (list, tuple))
+
+    @staticmethod
+    def __types(value_type):
+        return value_type if isinstance(value_type, tuple) else (value_type,)
+
+    def add_watch_callback(self, callback):
+        """ callback(changed) is called after a reload with the list of changed key paths """
+        self.__watch_callbacks.append(callback)
+
+    def remove_watch_callback(self, callback):
+        self.__watch_callbacks.remove(callback)
+
+    def watch(self, interval_sec=1.0, scheduler=None):
+        """ Check the files for changes every interval_sec, on scheduler (PeriodicScheduler) or a private one """
+        self.unwatch()
+        if scheduler is None:
+            scheduler = self.__watch_scheduler = PeriodicScheduler(name='ConfigurationWatch')
+        self.__watch_task = scheduler.schedule(self.check_changes, interval_sec, first_delay_sec=interval_sec,
+                                               name=f'Configuration({self.config_path.name})')
+
+    def unwatch(self):
+        """ Stop watching the files """
+        if self.__watch_task is not None:
+            self.__watch_task.cancel()
+            self.__watch_task = None
+        if self.__watch_scheduler is not None:
+            self.__watch_scheduler.stop()
+            self.__watch_scheduler = None
+
+    def check_changes(self):
+        """ Reload the files if their mtime or size changed. Returns the changed key paths.
+            An invalid file is logged and ignored; the current values stay until the file changes again.
+        """
+        signatures = self.__file_signatures()
+        if signatures == self.__signatures:
+            return []
+
+        with Configuration.reload_lock:
             try:
-                val = parse_obj[level]
-                if type(val) is Section:
-                    parse_obj = val
-                else:
-                    param_val = val
+                changed = self.__reload(signatures)
             except Exception as e:
-                self.__logger_config(f'Unknown exception: {e}')
+                log.debug('Configuration: Reload of {} failed: {}', self.config_path, e)
+                changed = []
+            finally:
+                self.__signatures = signatures
+
+        if changed:
+            log.debug('Configuration: Reloaded {}, changed {}', self.config_path, changed)
+            for callback in list(self.__watch_callbacks):
+                try:
+                    callback(changed)
+                except Exception as e:
+                    log.debug('Configuration: Watch callback failed: {}', e)
+        return changed
+
+    def __file_signatures(self):
+        return ConfigurationSnapshot.signature(self.config_path), ConfigurationSnapshot.signature(self.spec_path)
+
+    def __reload(self, signatures):
+        """ Parse the changed files, revalidate the changed sections and swap in the result """
+        spec_changed = signatures[1] != self.__signatures[1]
+        configspec = str(self.spec_path) if spec_changed else self.configspec
+        fresh = ConfigObj(str(self.config_path), configspec=configspec, file_error=True)
+        raw = fresh.dict()
+        validator = Validator()
 
-        if param_val is None:
-            self.__logger_config(f'Parameter ({key}) not found and has no default value')
-            bad_param_exception = ConfigurationError(reason=ConfigurationErrorReason.InvalidParameter,
-                                                     details=f'Parameter ({key}) not found and has no default value')
-            raise bad_param_exception
+        if spec_changed:
+            # any parameter may be affected: validate everything and replace all top level entries
+            if fresh.validate(validator) is not True:
+                raise ValidateError('validation failed')
+            paths = [(name,) for name in set(self.sections) | set(fresh.sections)]
+            scalars = {name: fresh[name] for name in fresh.scalars}
+            removed = [name for name in self.scalars if name not in fresh]
         else:
-            self.__logger_config(f'{key}={param_val} ({type(param_val)})')
-            return param_val
+            paths = []
+            self.__diff(self.__raw, raw, (), paths)
+            for path in paths:
+                self.__validate_section(fresh, path, validator)
+            scalars, removed = self.__validate_root_scalars(fresh, self.__raw, raw, validator)
+
+        old_index = self.__index if self.__index is not None else self.__flatten()
+        self.__swapping = True
+        try:
+            self.__merge(fresh, paths, scalars, removed)
+            index = self.__flatten()
+            self.__index = index
+        finally:
+            self.__swapping = False
+
+        self.__raw = raw
+        if spec_changed:
+            self.configspec = fresh.configspec
+
+        return sorted(key for key in set(old_index) | set(index)
+                      if key not in old_index or key not in index or old_index[key] != index[key])
+
+    @staticmethod
+    def __diff(old, new, path, changed):
+        """ Collect the paths of sections whose scalars (or set of sub-sections) differ. Root scalars excluded """
+        if path:
+            old_scalars = {k: v for k, v in old.items() if not isinstance(v, dict)}
+            new_scalars = {k: v for k, v in new.items() if not isinstance(v, dict)}
+            if old_scalars != new_scalars:
+                # revalidating the section covers its sub-sections
+                changed.append(path)
+                return
+
+        names = {k for k, v in old.items() if isinstance(v, dict)} | {k for k, v in new.items() if isinstance(v, dict)}
+        for name in sorted(names):
+            old_child, new_child = old.get(name), new.get(name)
+            if not isinstance(old_child, dict) or not isinstance(new_child, dict):
+                changed.append(path + (name,))
+            else:
+                Configuration.__diff(old_child, new_child, path + (name,), changed)
+
+    @staticmethod
+    def __validate_section(fresh, path, validator):
+        """ Validate one section (and its sub-sections) of a newly parsed ConfigObj """
+        section = fresh
+        for name in path:
+            if section.configspec is None:
+                # not described by the spec: values stay unvalidated strings
+                return
+            # assigns the spec to the sub-sections (and creates spec sections missing from the file)
+            fresh._set_configspec(section, False)
+            section = section.get(name)
+            if not isinstance(section, Section):
+                return
+
+        if section.configspec is not None and fresh.validate(validator, section=section) is not True:
+            raise ValidateError(f'validation of {"/".join(path)} failed')
+
+    @staticmethod
+    def __validate_root_scalars(fresh, old, new, validator):
+        """ Check the changed top level parameters. Returns ({name: value}, [removed names]) """
+        specs = fresh.configspec
+        scalars = {}
+        removed = []
+        for name in {k for k, v in old.items() if not isinstance(v, dict)} | set(fresh.scalars):
+            if old.get(name) == new.get(name):
+                continue
+            if specs is not None and name in specs.scalars:
+                # a missing parameter takes the spec default (or fails when there is none)
+                scalars[name] = validator.check(specs[name], new.get(name), missing=name not in new)
+            elif name in new:
+                scalars[name] = new[name]
+            else:
+                removed.append(name)
+        return scalars, removed
+
+    def __merge(self, fresh, paths, scalars, removed):
+        """ Copy the revalidated sections and top level parameters from fresh into this configuration """
+        for path in paths:
+            parent, source = self, fresh
+            for name in path[:-1]:
+                parent, source = dict.get(parent, name), source.get(name)
+            value = source.get(path[-1]) if isinstance(source, Section) else None
+            if isinstance(value, Section):
+                parent[path[-1]] = value.dict()
+            elif path[-1] in parent:
+                del parent[path[-1]]
+
+        for name, value in scalars.items():
+            self[name] = value
+        for name in removed:
+            if name in self:
+                del self[name]
 
 
 if __name__ == '__main__':
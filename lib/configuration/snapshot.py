@@ -0,0 +1,87 @@
+# snapshot.py
+import os
+import pickle
+from pathlib import Path
+
+from lib.log import Log
+
+log = Log(__name__)
+
+
+class ConfigurationSnapshot:
+    """
+    ConfigurationSnapshot
+    On-disk copy of a validated Configuration, so that short-lived processes can skip searching, parsing and
+    validating the configuration files when nothing changed.
+    A snapshot is used only if it was made for the same request (file names, search levels, delimeter), both files
+    still have the recorded mtime and size, and every location probed without success during the search still fails.
+    Snapshots are pickles: only point snapshot_path at a file written by this process' user.
+    Parameters:
+        - path = Snapshot file.
+    """
+    version = 1
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    @staticmethod
+    def signature(path):
+        """ (mtime_ns, size) of a file, None if it does not exist """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self, key):
+        """ Return the snapshot's configuration state if still valid for key, else None """
+        try:
+            with open(self.path, 'rb') as file:
+                snapshot = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.debug('ConfigurationSnapshot: Unreadable {}: {}', self.path, e)
+            return None
+
+        if not isinstance(snapshot, dict) or snapshot.get('version') != self.version or snapshot.get('key') != key:
+            return None
+
+        for path, signature in snapshot['files']:
+            if self.signature(path) != signature:
+                log.debug('ConfigurationSnapshot: {} changed', path)
+                return None
+
+        # a failed search location becomes valid once both files exist there
+        for paths in snapshot['missing']:
+            if all(os.path.isfile(path) for path in paths):
+                log.debug('ConfigurationSnapshot: {} now exists', paths)
+                return None
+
+        return snapshot['config']
+
+    def save(self, key, files, missing, config):
+        """ Write a snapshot. files = resolved file paths, missing = path tuples probed without success """
+        snapshot = {
+            'version': self.version,
+            'key': key,
+            'files': [(str(path), self.signature(path)) for path in files],
+            'missing': [tuple(str(path) for path in paths) for paths in missing],
+            'config': config,
+        }
+        temp_path = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+        try:
+            with open(temp_path, 'wb') as file:
+                pickle.dump(snapshot, file, protocol=pickle.HIGHEST_PROTOCOL)
+            # readers see either the old or the new snapshot, never a partial one
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            log.debug('ConfigurationSnapshot: Failed writing {}: {}', self.path, e)
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+
+if __name__ == '__main__':
+    print("=== Configuration Snapshot ===")
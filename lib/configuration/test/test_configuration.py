@@ -169,14 +169,91 @@ class TestConfiguration:
         val = c.get('level1/level2/param1')
         assert val == 'ABCD'
 
-
-
-
-
-
-
-
-
-
-
-
+    def test_get_index_follows_changes(self, monkeypatch):
+        """ Changes made through the ConfigObj API are visible to get() """
+        monkeypatch.chdir(Path(__file__).parent)
+        c = Configuration()
+        c['level1']['level2']['param1'] = 'WXYZ'
+        assert c.get('level1/level2/param1') == 'WXYZ'
+        c['level1']['new_section'] = {'param1': '1'}
+        assert c.get('level1/new_section/param1') == '1'
+        c['level1']['new_section']['param1'] = '2'
+        assert c.get('level1/new_section/param1') == '2'
+        del c['level1']['param2']
+        with pytest.raises(ConfigurationError):
+            c.get('level1/param2')
+
+    def test_get_typed(self, monkeypatch):
+        """ Typed accessors return validated values and reject other types """
+        monkeypatch.chdir(Path(__file__).parent)
+        c = Configuration()
+        assert c.get_int('level1/param1') == 5678
+        assert c.get_float('level1/param1') == 5678.0
+        assert c.get_str('level1/param3') == 'teststring'
+        with pytest.raises(ConfigurationError) as e:
+            c.get_int('level1/param3')
+        assert e.value.reason == ConfigurationErrorReason.InvalidParameterType
+
+    def test_snapshot(self, tmp_path):
+        """ A snapshot replaces searching, parsing and validating until one of the files changes """
+        local = Path(__file__).parent
+        (tmp_path / 'config.ini').write_text((local / 'config.ini').read_text())
+        (tmp_path / 'config_spec.ini').write_text((local / 'config_spec.ini').read_text())
+        start = tmp_path / 'sub'
+        start.mkdir()
+        kwargs = dict(infile=str(start / 'config.ini'), configspec=str(start / 'config_spec.ini'), search_levels=1,
+                      snapshot_path=tmp_path / 'config.snapshot')
+
+        c = Configuration(**kwargs)
+        assert not c.snapshot_loaded
+        c = Configuration(**kwargs)
+        assert c.snapshot_loaded
+        assert c.get('level1/level2/param1') == 'ABCD'
+        assert c['level1']['level2'].main is c
+        c['level1']['param1'] = 1
+        assert c.get('level1/param1') == 1
+
+        (tmp_path / 'config.ini').write_text((local / 'config.ini').read_text().replace('5678', '8765'))
+        c = Configuration(**kwargs)
+        assert not c.snapshot_loaded
+        assert c.get('level1/param1') == 8765
+
+        # files appearing at a location searched earlier take precedence again
+        (start / 'config.ini').write_text('level0_param1 = 1')
+        (start / 'config_spec.ini').write_text('level0_param1 = integer')
+        c = Configuration(**kwargs)
+        assert not c.snapshot_loaded
+        assert c.get('level0_param1') == 1
+
+    def test_watch_reload(self, tmp_path):
+        """ Changed files are reloaded, revalidated and reported as changed key paths """
+        import os
+        local = Path(__file__).parent
+        text = (local / 'config.ini').read_text()
+        (tmp_path / 'config.ini').write_text(text)
+        (tmp_path / 'config_spec.ini').write_text((local / 'config_spec.ini').read_text())
+        c = Configuration(infile=str(tmp_path / 'config.ini'), configspec=str(tmp_path / 'config_spec.ini'))
+        changes = []
+        c.add_watch_callback(changes.append)
+
+        def rewrite(new_text):
+            path = tmp_path / 'config.ini'
+            path.write_text(new_text)
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+        assert c.check_changes() == []
+        rewrite(text.replace('5678', '1111').replace('1234', '42'))
+        assert c.check_changes() == ['level0_param1', 'level1/param1']
+        assert c.get_int('level1/param1') == 1111
+        assert c.get_int('level0_param1') == 42
+
+        # invalid values are rejected and the previous values stay
+        rewrite(text.replace('5678', 'not_an_integer'))
+        assert c.check_changes() == []
+        assert c.get('level1/param1') == 1111
+
+        rewrite(text + '\n[added]\nparam1 = 1\n')
+        assert c.check_changes() == ['added/param1', 'level0_param1', 'level1/param1']
+        assert c.get('added/param1') == '1'
+        assert changes == [['level0_param1', 'level1/param1'], ['added/param1', 'level0_param1', 'level1/param1']]
@@ -1,11 +1,20 @@
 # httpendpoints.py
+import copy
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 import urllib3
 from ib.error import Error
 from ib.resultrequest import RequestResult
+from lib import jsoncodec, jsonstream
+from lib.httpsession import HttpSessionPool
+from lib.pacing import RequestPriority, RequestThrottled
+from lib.singleflight import SingleFlight
 from lib.watchdog import Watchdog
-from loguru import logger
+from lib.log import Log
+
+log = Log(__name__)
 
 
 class HttpEndpoints(Watchdog):
@@ -13,102 +22,287 @@ class HttpEndpoints(Watchdog):
     """
     HttpEndpoints
     Provide Get/Post operations for a base URL with endpoints.
+    Requests are sent over a keep-alive connection pool (see HttpSessionPool).
+    Parameters:
+        - pool_size (10) = Maximum number of pooled gateway connections when no session_pool is given.
+        - session_pool (None) = HttpSessionPool to share between several clients.
+        - batch_concurrency (pool_size) = Default number of requests clientrequest_batch() runs at once.
+        - response_cache (None) = ResponseCache for GET requests. None disables caching.
+        - coalesce_methods (('GET',)) = Methods for which concurrent identical requests share one gateway call.
+        - pacing (None) = PacingScheduler which paces requests under the gateway rate limits. None sends immediately.
+        - lazy_json (False) = Keep response bodies undecoded until RequestResult.json is first read.
+        - scheduler (None) = PeriodicScheduler running the watchdog task. None gives the watchdog its own thread.
+        - jitter_sec (0) = Random shift of each watchdog period on the scheduler (see Watchdog).
+        - metrics_registry (None) = MetricsRegistry receiving count, errors and latency of every gateway request.
     """
     # used for JSON GET/POST requests
     headers = {'accept': 'application/json'}
+    # methods accepted by clientrequest_batch
+    batch_methods = ('GET', 'POST')
+
+    def __init__(self, name='Unknown', timeout_sec=5, autostart=True, disable_request_warnings=True,
+                 pool_size=10, session_pool=None, batch_concurrency=None, response_cache=None,
+                 coalesce_methods=('GET',), pacing=None, lazy_json=False, scheduler=None,
+                 metrics_registry=None, jitter_sec=0):
+        # pool must exist before the watchdog starts, since watchdog tasks typically issue requests
+        self.session_pool = session_pool if session_pool is not None else HttpSessionPool(pool_size=pool_size)
+        self.response_cache = response_cache
+        self.coalesce_methods = coalesce_methods
+        self.single_flight = SingleFlight(share=copy.copy)
+        self.pacing = pacing
+        self.lazy_json = lazy_json
+        self.metrics_registry = metrics_registry
 
-    def __init__(self, name='Unknown', timeout_sec=5, autostart=True, disable_request_warnings=True):
         # kick off the watchdog
-        super().__init__(name=name, timeout_sec=timeout_sec, autostart=autostart)
+        super().__init__(name=name, timeout_sec=timeout_sec, autostart=autostart, scheduler=scheduler,
+                         jitter_sec=jitter_sec)
 
         # gateway base URL for submitting all client portal API. All commands append to this string
         self.url_http = ''
         self.request_timeout_sec = 10
+        self.batch_concurrency = batch_concurrency if batch_concurrency is not None else self.session_pool.pool_size
 
         if disable_request_warnings:
             urllib3.disable_warnings()
 
-    def clientrequest_get(self, endpoint=''):
-        """ Gateway Get message request using desired endpoint. """
-        cpurl, resp, exception = self.__get(endpoint)
-        result = self.__error_check(cpurl, resp, exception)
-        logger.log('DEBUG', f'GET({endpoint}), status={result.statusCode}, error={result.error}, msg={result.json} ')
+    def clientrequest_get(self, endpoint='', priority=RequestPriority.Normal):
+        """ Gateway Get message request using desired endpoint. Served from response_cache when possible.
+            priority orders the request against others waiting for pacing.
+        """
+        if self.response_cache is not None:
+            result = self.response_cache.get('GET', endpoint)
+            if result is not None:
+                return result
+
+        return self.__coalesce('GET', endpoint, '', lambda: self.__get_result(endpoint, priority))
+
+    def clientrequest_get_stream(self, endpoint='', priority=RequestPriority.Normal, chunk_size=64 * 1024):
+        """ Gateway Get request decoded while the body downloads, for large responses. Returns a RequestResult whose
+            records iterator yields the elements of a top-level JSON array one by one (other JSON: the whole value),
+            holding only one chunk_size block and one record in memory.
+            Status and errors are reported as for clientrequest_get(); failed requests get an empty records iterator.
+            A connection lost while reading ends records and sets result.error. Malformed JSON raises ValueError from
+            records. The pooled connection is held until records is exhausted or closed.
+            Streamed requests are neither cached nor coalesced.
+        """
+        cpurl, resp, exception, elapsed = self.__get(endpoint, priority, stream=True)
+        result = self.check_response(cpurl, resp, exception, stream_chunk_size=chunk_size)
+        self.__record(endpoint, elapsed, result)
+        self.on_result('GET', endpoint, result)
+        log.debug('GET({}), status={}, error={}, streamed', endpoint, result.statusCode, result.error)
+        return result
+
+    def clientrequest_post(self, endpoint='', data='', priority=RequestPriority.Normal):
+        """ Gateway Post message request using desired endpoint. data is sent as the JSON body.
+            priority orders the request against others waiting for pacing.
+        """
+        return self.__coalesce('POST', endpoint, data, lambda: self.__post_result(endpoint, data, priority))
+
+    def clientrequest_batch(self, items, max_concurrency=None):
+        """ Issue several gateway requests concurrently.
+            items: sequence of (method, endpoint) or (method, endpoint, payload) where method is 'GET' or 'POST'.
+            max_concurrency: number of requests in flight at once (defaults to batch_concurrency).
+            Returns a list of RequestResult in the same order as items. A failing item only affects its own result.
+        """
+        items = list(items)
+        if len(items) == 0:
+            return []
+
+        workers = max(1, min(max_concurrency or self.batch_concurrency, len(items)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'{self.watchdog_name}_batch') as executor:
+            return list(executor.map(self.__batch_request, items))
+
+    def on_result(self, method, endpoint, result):
+        """ Called with every RequestResult obtained from the gateway (not for cached results) """
+        pass
+
+    @staticmethod
+    def parse_batch_item(item):
+        """ Split a batch item into (method, endpoint, payload). Raises ValueError for malformed items. """
+        if len(item) == 2:
+            method, endpoint = item
+            payload = ''
+        elif len(item) == 3:
+            method, endpoint, payload = item
+        else:
+            raise ValueError(f'Batch item must be (method, endpoint[, payload]): {item}')
+
+        method = str(method).upper()
+        if method not in HttpEndpoints.batch_methods:
+            raise ValueError(f'Unsupported batch method: {method}')
+
+        return method, endpoint, payload
+
+    @staticmethod
+    def batch_error(item, error, exception):
+        """ RequestResult reported for a batch item that failed without a gateway response """
+        result = RequestResult()
+        result.error = error
+        log.debug('Batch({}): Error={}, {}', item, error, exception)
+        return result
+
+    def __batch_request(self, item):
+        try:
+            method, endpoint, payload = self.parse_batch_item(item)
+        except (TypeError, ValueError) as e:
+            return self.batch_error(item, Error.Invalid_Request, e)
+
+        try:
+            if method == 'GET':
+                return self.clientrequest_get(endpoint)
+            return self.clientrequest_post(endpoint, payload)
+
+        except Exception as e:
+            return self.batch_error(item, Error.Unknown, e)
+
+    def __coalesce(self, method, endpoint, data, request):
+        """ Share one gateway call between concurrent identical requests (see coalesce_methods) """
+        if method not in self.coalesce_methods:
+            return request()
+        return self.single_flight.do((method, endpoint, repr(data)), request)
+
+    def __get_result(self, endpoint, priority):
+        cpurl, resp, exception, elapsed = self.__get(endpoint, priority)
+        result = self.check_response(cpurl, resp, exception, self.lazy_json)
+        self.__record(endpoint, elapsed, result)
+        if self.response_cache is not None:
+            self.response_cache.put('GET', endpoint, result)
+        self.on_result('GET', endpoint, result)
+        log.debug('GET({}), status={}, error={}, msg={}', endpoint, result.statusCode, result.error,
+                  log.payload(result.json) if result.decoded else '<not decoded>')
         return result
 
-    def clientrequest_post(self, endpoint=''):
-        """ Gateway Post message request using desired endpoint."""
-        cpurl, resp, exception = self.__post(endpoint)
-        result = self.__error_check(cpurl, resp, exception)
-        logger.log('DEBUG', f'POST({endpoint}), status={result.statusCode}, error={result.error}, msg={result.json} ')
+    def __post_result(self, endpoint, data, priority):
+        cpurl, resp, exception, elapsed = self.__post(endpoint, data, priority)
+        result = self.check_response(cpurl, resp, exception, self.lazy_json)
+        self.__record(endpoint, elapsed, result)
+        self.on_result('POST', endpoint, result)
+        log.debug('POST({}), status={}, error={}, msg={}', endpoint, result.statusCode, result.error,
+                  log.payload(result.json) if result.decoded else '<not decoded>')
         return result
 
+    def __record(self, endpoint, elapsed, result):
+        if self.metrics_registry is not None:
+            self.metrics_registry.record_request(endpoint, elapsed, result.error != Error.No_Error)
+
     def __build_endpoint_url(self, endpoint: str = ''):
         url = self.url_http + endpoint
         return url
 
-    def __get(self, endpoint: str = ''):
+    def __pace(self, endpoint, priority):
+        """ Wait for the pacing scheduler to release the request. Raises RequestThrottled on timeout. """
+        if self.pacing is not None and not self.pacing.acquire(endpoint, priority):
+            raise RequestThrottled(endpoint, self.pacing.max_wait_sec)
+
+    def __get(self, endpoint: str = '', priority=RequestPriority.Normal, stream=False):
         cpurl = self.__build_endpoint_url(endpoint)
         resp = None
         resp_exception = None
+        elapsed = None
         # Without verify=False, we get issues with untrusted SSL certificates
         # This should be ok for demo accounts, but need to follow up on this for live accounts
         # See https://stackoverflow.com/questions/10667960/python-requests-throwing-sslerror
         # resp is the web response. Use resp.json() to get the client request specific response
         # resp = requests.post(cpurl, headers=self.headers, json=data, verify=False)
         try:
-            resp = requests.get(cpurl, headers=HttpEndpoints.headers, verify=False, timeout=self.request_timeout_sec)
+            self.__pace(endpoint, priority)
+            started = time.perf_counter()
+            try:
+                resp = self.session_pool.get(cpurl, headers=HttpEndpoints.headers, verify=False,
+                                             timeout=self.request_timeout_sec, stream=stream)
+            finally:
+                elapsed = time.perf_counter() - started
 
-        # grab any exceptions and return. They will be passed off to __error_check for handling
+        # grab any exceptions and return. They will be passed off to check_response for handling
         except Exception as e:
             resp_exception = e
             pass
 
         # TODO: Refactor to use dataclass
-        return cpurl, resp, resp_exception
+        return cpurl, resp, resp_exception, elapsed
 
-    def __post(self, endpoint: str = '', data: str = ''):
+    def __post(self, endpoint: str = '', data: str = '', priority=RequestPriority.Normal):
         cpurl = self.__build_endpoint_url(endpoint)
         resp = None
         resp_exception = None
+        elapsed = None
 
         # Without verify=False, we get issues with untrusted SSL certificates
         # This should be ok for demo accounts, but need to follow up on this for live accounts
         # See https://stackoverflow.com/questions/10667960/python-requests-throwing-sslerror
         # resp is the web response. Use resp.json() to get the client request specific response
         try:
-            resp = requests.post(cpurl, headers=HttpEndpoints.headers,
-                                 json=data, verify=False, timeout=self.request_timeout_sec)
+            self.__pace(endpoint, priority)
+            started = time.perf_counter()
+            try:
+                resp = self.session_pool.post(cpurl, headers=HttpEndpoints.headers,
+                                              json=data, verify=False, timeout=self.request_timeout_sec)
+            finally:
+                elapsed = time.perf_counter() - started
 
-        # grab any exceptions and return. They will be passed off to __error_check for handling
+        # grab any exceptions and return. They will be passed off to check_response for handling
         except Exception as e:
             resp_exception = e
             pass
 
         # TODO: Refactor to use dataclass
-        return cpurl, resp, resp_exception
+        return cpurl, resp, resp_exception, elapsed
 
     @staticmethod
-    def __error_check(cpurl, resp, exception):
+    def check_response(cpurl, resp, exception, lazy_json=False, stream_chunk_size=None):
+        """ Convert a gateway response (or the exception raised while requesting it) into a RequestResult.
+            With lazy_json the body is kept as bytes and decoded on first access of RequestResult.json
+            With stream_chunk_size (a response requested with stream=True) the body is decoded into
+            RequestResult.records while it is read.
+        """
         result = RequestResult()
 
         # resp will be None if we had an exception
         if resp is not None:
+            # 429 = gateway rate limit exceeded
+            if resp.status_code == 429:
+                result.error = Error.Throttled
+                result.statusCode = resp.status_code
             # If Ok = False, there was a problem submitting the request, typically an invalid URL
-            if not resp.ok:
+            elif not resp.ok:
                 result.error = Error.Invalid_URL
             else:
                 # conversion to give the request specific json results
-                result.json = resp.json()
+                if stream_chunk_size is not None:
+                    result.records = HttpEndpoints.stream_records(result, resp, stream_chunk_size)
+                elif lazy_json:
+                    result.raw = resp.content
+                else:
+                    result.json = jsoncodec.decode(resp.content)
                 result.statusCode = resp.status_code
+        elif isinstance(exception, RequestThrottled):
+            result.error = Error.Throttled
+            log.debug('{}', exception)
         else:
             result.error = Error.Connection_or_Timeout
-            logger.log('DEBUG', f'{exception}')
+            log.debug('{}', exception)
 
         if result.error != Error.No_Error:
-            logger.log('DEBUG', f'{cpurl}: Error={result.error}, Status={result.statusCode}')
+            log.debug('{}: Error={}, Status={}', cpurl, result.error, result.statusCode)
+
+        if stream_chunk_size is not None and result.records is None:
+            result.records = iter(())
+            if resp is not None:
+                resp.close()
 
         return result
 
+    @staticmethod
+    def stream_records(result, resp, chunk_size):
+        """ Decoded records of a streamed response. Closes the response when done """
+        try:
+            yield from jsonstream.iter_json(resp.iter_content(chunk_size))
+        except requests.RequestException as e:
+            result.error = Error.Connection_or_Timeout
+            log.debug('Stream interrupted: {}', e)
+        finally:
+            resp.close()
+
 
 if __name__ == '__main__':
     print("=== HTTP Endpoint ===")
@@ -0,0 +1,105 @@
+# httpsession.py
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from lib.certificate import Certificate, CertificateError
+from lib.log import Log
+
+log = Log(__name__)
+
+
+class SSLContextAdapter(HTTPAdapter):
+    """ HTTPAdapter whose connections use the given ssl_context (e.g. a context shared with websocket clients) """
+    def __init__(self, ssl_context=None, **kwargs):
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.ssl_context is not None:
+            kwargs['ssl_context'] = self.ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, *args, **kwargs):
+        if self.ssl_context is not None:
+            kwargs['ssl_context'] = self.ssl_context
+        return super().proxy_manager_for(*args, **kwargs)
+
+
+class HttpSessionPool:
+    """
+    HttpSessionPool
+    Keep-alive connection pool for HTTP(S) requests. Connections (and their TLS sessions) are reused between
+    requests instead of performing a new TCP/TLS handshake on every call.
+    A single pool may be shared by several clients and used from multiple threads.
+    Parameters:
+        - pool_size (10) = Maximum number of connections kept alive per host.
+        - pool_block (True) = Wait for a free pooled connection instead of opening a throw-away connection.
+        - certificate_path (None) = PEM file for the ssl_context of https connections, taken from the shared
+                                    Certificate cache. The pool is rebuilt when the file changes.
+    """
+    def __init__(self, pool_size=10, pool_block=True, certificate_path=None):
+        if pool_size < 1:
+            raise ValueError('pool_size must be at least 1')
+
+        self.pool_size = pool_size
+        self.pool_block = pool_block
+        self.certificate_path = certificate_path
+        self.ssl_context = None
+        self.__session = None
+        self.__lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        """ Pooled session, created on first use """
+        session = self.__session
+        if session is None or (self.certificate_path and self.__certificate_context() is not self.ssl_context):
+            with self.__lock:
+                if self.__session is not None and self.certificate_path:
+                    ssl_context = self.__certificate_context()
+                    if ssl_context is not self.ssl_context:
+                        log.debug('HttpSessionPool: Certificate changed, reopening connections')
+                        self.__session.close()
+                        self.__session = None
+                if self.__session is None:
+                    self.__session = self.__create_session()
+                session = self.__session
+        return session
+
+    def get(self, url, **kwargs):
+        """ GET using a pooled connection. Accepts the same arguments as requests.get() """
+        return self.session.get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """ POST using a pooled connection. Accepts the same arguments as requests.post() """
+        return self.session.post(url, **kwargs)
+
+    def close(self):
+        """ Close all pooled connections. The pool re-opens connections if used again. """
+        with self.__lock:
+            session = self.__session
+            self.__session = None
+
+        if session is not None:
+            session.close()
+            log.debug('HttpSessionPool: Closed (pool_size={})', self.pool_size)
+
+    def __certificate_context(self):
+        result = Certificate.get_certificate(self.certificate_path)
+        if result.error != CertificateError.Ok:
+            log.debug('HttpSessionPool: Problems obtaining certificate: {}', result.error)
+        return result.ssl_context
+
+    def __create_session(self):
+        session = requests.Session()
+        self.ssl_context = self.__certificate_context() if self.certificate_path else None
+        adapter = SSLContextAdapter(ssl_context=self.ssl_context, pool_connections=1, pool_maxsize=self.pool_size,
+                                    pool_block=self.pool_block)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        log.debug('HttpSessionPool: Created (pool_size={}, block={})', self.pool_size, self.pool_block)
+        return session
+
+
+if __name__ == '__main__':
+    print("=== HTTP Session Pool ===")
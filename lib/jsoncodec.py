@@ -0,0 +1,64 @@
+# jsoncodec.py
+# JSON decoding with the fastest available backend. Falls back to the standard library when no fast decoder is
+# installed. Backends: orjson, ujson, json (stdlib)
+import json
+
+from lib.log import Log
+
+log = Log(__name__)
+
+_backends = {'json': json.loads}
+
+try:
+    import orjson
+    _backends['orjson'] = orjson.loads
+except ImportError:
+    pass
+
+try:
+    import ujson
+    _backends['ujson'] = ujson.loads
+except ImportError:
+    pass
+
+# order of preference when selecting automatically
+preferred_backends = ('orjson', 'ujson', 'json')
+
+backend = next(name for name in preferred_backends if name in _backends)
+loads = _backends[backend]
+
+
+def available_backends():
+    """ Names of the installed (and registered) JSON backends, in order of preference """
+    return [name for name in preferred_backends if name in _backends] + \
+        [name for name in _backends if name not in preferred_backends]
+
+
+def set_backend(name=None, decoder=None):
+    """ Select the JSON backend used by loads().
+        name: one of available_backends(), or None to select the fastest installed backend.
+        decoder: custom callable accepting str or bytes. Registered under name.
+    """
+    global backend, loads
+
+    if decoder is not None:
+        if name is None:
+            raise ValueError('A name is required when registering a custom decoder')
+        _backends[name] = decoder
+    elif name is None:
+        name = next(name for name in preferred_backends if name in _backends)
+    elif name not in _backends:
+        raise ValueError(f'JSON backend not installed: {name}')
+
+    backend = name
+    loads = _backends[name]
+    log.debug('jsoncodec: Using {}', name)
+
+
+def decode(data):
+    """ Decode str or bytes with the selected backend """
+    return loads(data)
+
+
+if __name__ == '__main__':
+    print(f"=== JSON codec ({backend}) ===")
@@ -0,0 +1,122 @@
+# jsonstream.py
+# Incremental decoding of a JSON document delivered in chunks (e.g. a streamed HTTP response body)
+import codecs
+import json
+import re
+
+from lib.log import Log
+
+log = Log(__name__)
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+_number_chars = frozenset('0123456789.eE+-')
+
+
+class _ChunkBuffer:
+    """ Undecoded text of a chunked document. Holds the unconsumed tail only: consumed text is dropped when the
+        next chunk is appended.
+    """
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    def more(self):
+        """ Append the next chunk. False at the end of the input """
+        while not self.eof:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.eof = True
+                text = self.utf8.decode(b'', final=True)
+            elif isinstance(chunk, str):
+                text = chunk
+            else:
+                text = self.utf8.decode(chunk)
+            if text:
+                self.text = self.text[self.pos:] + text
+                self.pos = 0
+                return True
+        return False
+
+    def grow(self):
+        """ Read until the unconsumed text has doubled, so a value larger than a chunk is not re-decoded for every
+            chunk. False if nothing could be read.
+        """
+        pending = len(self.text) - self.pos
+        target = max(2 * pending, pending + 1)
+        grown = False
+        while len(self.text) - self.pos < target and self.more():
+            grown = True
+        return grown
+
+    def peek(self):
+        """ Next non-whitespace character (None at the end of the input) """
+        while True:
+            self.pos = _whitespace.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.more():
+                return None
+
+    def value(self):
+        """ Decode the value at the current position """
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if self.grow():
+                    continue
+                raise
+            # a number may continue in the next chunk ('1' of '1.5', or '1.' of '1.5')
+            if isinstance(value, (int, float)) and (end == len(self.text) or self.text[end] in _number_chars) \
+                    and self.more():
+                continue
+            self.pos = end
+            return value
+
+    def error(self, expected):
+        return ValueError(f'Expected {expected} in JSON stream, found {self.text[self.pos:self.pos + 20]!r}')
+
+
+def iter_json(chunks):
+    """ Decode a JSON document arriving as chunks (bytes or str). The elements of a top-level array are yielded one
+        by one as soon as each is complete; any other top-level value is yielded once, after it has been read.
+        Memory holds one element and one chunk, not the document.
+        Raises ValueError (json.JSONDecodeError for invalid values) for malformed input.
+    """
+    buffer = _ChunkBuffer(chunks)
+    first = buffer.peek()
+    if first is None:
+        raise ValueError('Empty JSON stream')
+
+    if first != '[':
+        value = buffer.value()
+        if buffer.peek() is not None:
+            raise buffer.error('end of document')
+        yield value
+        return
+
+    buffer.pos += 1
+    if buffer.peek() == ']':
+        buffer.pos += 1
+    else:
+        while True:
+            yield buffer.value()
+            delimiter = buffer.peek()
+            buffer.pos += 1
+            if delimiter == ']':
+                break
+            if delimiter != ',':
+                buffer.pos -= 1
+                raise buffer.error("',' or ']'")
+
+    if buffer.peek() is not None:
+        raise buffer.error('end of document')
+
+
+if __name__ == '__main__':
+    print("=== JSON stream ===")
@@ -0,0 +1,133 @@
+# log.py
+# Logging facade over loguru for hot paths.
+# - Messages use loguru '{}' placeholders. Arguments are only formatted if the record is actually emitted, so
+#   disabled levels cost a comparison instead of an f-string.
+# - Each Log belongs to a subsystem (normally the module __name__). Subsystems can be quietened individually,
+#   e.g. set_level('ib.clientportal_websockets', 'INFO') or disable('lib.configuration').
+# - payload() truncates large payloads at format time and sample() thins out per-message logging.
+import weakref
+
+from loguru import logger
+
+# minimum level per subsystem prefix. Longest matching prefix wins
+_subsystem_levels = {}
+_instances = weakref.WeakSet()
+
+# above every loguru level: nothing passes
+_DISABLED = 1000
+
+
+def _level_no(level):
+    return level if isinstance(level, int) else logger.level(level).no
+
+
+def set_level(subsystem, level):
+    """ Minimum level logged for a subsystem and its children (e.g. 'ib' covers 'ib.clientportal_http') """
+    _subsystem_levels[subsystem] = _level_no(level)
+    _refresh_all()
+
+
+def disable(subsystem):
+    """ Turn off all logging for a subsystem and its children """
+    _subsystem_levels[subsystem] = _DISABLED
+    _refresh_all()
+
+
+def enable(subsystem):
+    """ Remove a level or disable() set for exactly this subsystem """
+    _subsystem_levels.pop(subsystem, None)
+    _refresh_all()
+
+
+def _refresh_all():
+    for instance in list(_instances):
+        instance.refresh()
+
+
+class Payload:
+    """ Deferred str() of a (possibly large) payload, truncated to limit characters when formatted """
+    __slots__ = ('value', 'limit')
+
+    def __init__(self, value, limit=256):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        text = str(self.value)
+        if self.limit is not None and len(text) > self.limit:
+            return f'{text[:self.limit]}...(+{len(text) - self.limit} chars)'
+        return text
+
+    def __format__(self, format_spec):
+        return format(str(self), format_spec)
+
+
+class Log:
+    """
+    Log
+    Subsystem logger. Usage:
+        log = Log(__name__)
+        log.debug('GET({}), status={}', endpoint, status)
+    Parameters:
+        - subsystem = Name used for per-subsystem level control. Dotted names inherit their parents' settings.
+        - payload_limit (256) = Default truncation length used by payload(). None disables truncation.
+    """
+    def __init__(self, subsystem, payload_limit=256):
+        self.subsystem = subsystem
+        self.payload_limit = payload_limit
+        self.min_level = 0
+        self.__samples = {}
+        # depth=1 reports the caller's location rather than this module
+        self.__logger = logger.opt(depth=1)
+        _instances.add(self)
+        self.refresh()
+
+    def refresh(self):
+        """ Re-read the subsystem level settings """
+        level = 0
+        match = -1
+        for prefix, prefix_level in _subsystem_levels.items():
+            if (self.subsystem == prefix or self.subsystem.startswith(prefix + '.')) and len(prefix) > match:
+                level = prefix_level
+                match = len(prefix)
+        self.min_level = level
+
+    def enabled(self, level='DEBUG'):
+        """ False if the subsystem settings suppress level. Use to skip building expensive arguments. """
+        return _level_no(level) >= self.min_level
+
+    def log(self, level, msg, *args):
+        if _level_no(level) >= self.min_level:
+            self.__logger.log(level, msg, *args)
+
+    def debug(self, msg, *args):
+        if self.min_level <= 10:
+            self.__logger.log('DEBUG', msg, *args)
+
+    def info(self, msg, *args):
+        if self.min_level <= 20:
+            self.__logger.log('INFO', msg, *args)
+
+    def warning(self, msg, *args):
+        if self.min_level <= 30:
+            self.__logger.log('WARNING', msg, *args)
+
+    def error(self, msg, *args):
+        if self.min_level <= 40:
+            self.__logger.log('ERROR', msg, *args)
+
+    def payload(self, value, limit=-1):
+        """ Wrap a payload for logging. It is converted (and truncated) only if the record is emitted. """
+        return Payload(value, self.payload_limit if limit == -1 else limit)
+
+    def sample(self, key, every_n):
+        """ True once every every_n calls for key. Use to log only a sample of high rate events. """
+        if every_n <= 1:
+            return True
+        count = self.__samples.get(key, 0)
+        self.__samples[key] = count + 1
+        return count % every_n == 0
+
+
+if __name__ == '__main__':
+    print("=== Log ===")
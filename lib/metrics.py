@@ -0,0 +1,247 @@
+# metrics.py
+# In-process request and message metrics with a Prometheus style text export
+import bisect
+import os
+import threading
+import time
+
+from lib.log import Log
+
+log = Log(__name__)
+
+
+def default_buckets(start_sec=0.0001, end_sec=60.0, factor=1.25):
+    """ Geometric histogram bucket upper bounds (seconds). factor 1.25 keeps percentiles within 25% """
+    bounds = []
+    bound = start_sec
+    while bound < end_sec:
+        bounds.append(bound)
+        bound *= factor
+    bounds.append(end_sec)
+    return tuple(bounds)
+
+
+class LatencyHistogram:
+    """
+    LatencyHistogram
+    Fixed-bucket histogram of durations. Recording is O(log buckets) and memory does not grow with the count.
+    Percentiles are reported as the upper bound of the bucket holding the rank (capped at the exact maximum).
+    Parameters:
+        - buckets (default_buckets()) = Ascending bucket upper bounds in seconds. Larger values go to +Inf.
+    """
+    def __init__(self, buckets=None):
+        self.buckets = tuple(buckets) if buckets is not None else default_buckets()
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        """ Estimated duration below which fraction of the recorded durations fall (0 when empty) """
+        if self.count == 0:
+            return 0.0
+        rank = max(1, int(fraction * self.count + 0.999999))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                bound = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {'count': self.count, 'sum': self.sum, 'mean': self.sum / self.count if self.count else 0.0,
+                'p50': self.percentile(0.50), 'p99': self.percentile(0.99), 'max': self.max}
+
+
+class RateCounter:
+    """
+    RateCounter
+    Event count with the rate over a sliding window of whole seconds.
+    Parameters:
+        - window_sec (10) = Number of complete seconds averaged by rate(). At least 1.
+    """
+    def __init__(self, window_sec=10, clock=time.monotonic):
+        if window_sec < 1:
+            raise ValueError('window_sec must be at least 1')
+
+        self.window_sec = window_sec
+        self.clock = clock
+        self.count = 0
+        # one slot per complete second in the window, plus the current (incomplete) second
+        self.__slots = [0] * (window_sec + 1)
+        self.__second = int(clock())
+
+    def add(self, n=1):
+        self.count += n
+        self.__advance()
+        self.__slots[self.__second % len(self.__slots)] += n
+
+    def rate(self):
+        """ Events per second over the last window_sec complete seconds """
+        self.__advance()
+        current = self.__second % len(self.__slots)
+        return sum(n for index, n in enumerate(self.__slots) if index != current) / self.window_sec
+
+    def __advance(self):
+        second = int(self.clock())
+        size = len(self.__slots)
+        if second - self.__second >= size:
+            self.__slots = [0] * size
+        else:
+            for skipped in range(self.__second + 1, second + 1):
+                self.__slots[skipped % size] = 0
+        self.__second = max(second, self.__second)
+
+
+class MetricsRegistry:
+    """
+    MetricsRegistry
+    Collects per-endpoint request metrics (count, errors, latency histogram) and websocket metrics (messages and
+    rate per topic, receive-to-dispatch lag, heartbeat round-trip). Thread safe; may be shared by several clients.
+    Attach with HttpEndpoints(metrics_registry=...) and ClientPortalWebsocketsBase.enable_metrics(...).
+    snapshot() returns the current values; export_text()/write() produce a Prometheus text exposition.
+    Parameters:
+        - prefix ('ib') = Metric name prefix in the text export.
+        - buckets (default_buckets()) = Latency histogram bucket bounds in seconds.
+        - rate_window_sec (10) = Window for message rates.
+    """
+    def __init__(self, prefix='ib', buckets=None, rate_window_sec=10, clock=time.monotonic):
+        self.prefix = prefix
+        self.buckets = tuple(buckets) if buckets is not None else default_buckets()
+        self.rate_window_sec = rate_window_sec
+        self.clock = clock
+        self.started = clock()
+        self.__requests = {}
+        self.__topics = {}
+        self.__dispatch_lag = LatencyHistogram(self.buckets)
+        self.__heartbeat_rtt = LatencyHistogram(self.buckets)
+        self.__lock = threading.Lock()
+        self.__export_task = None
+
+    def register_endpoints(self, endpoints):
+        """ Pre-create request metrics so endpoints without traffic are reported with zero counts """
+        with self.__lock:
+            for endpoint in endpoints:
+                self.__request_entry(endpoint)
+
+    def record_request(self, endpoint, seconds, error=False):
+        """ Record a gateway request. seconds is None when no request was sent (e.g. throttled locally) """
+        with self.__lock:
+            entry = self.__request_entry(endpoint)
+            entry['count'] += 1
+            if error:
+                entry['errors'] += 1
+            if seconds is not None:
+                entry['latency'].record(seconds)
+
+    def record_message(self, topic, lag_sec=None):
+        """ Record a dispatched websocket message and its receive-to-dispatch lag """
+        with self.__lock:
+            counter = self.__topics.get(topic)
+            if counter is None:
+                counter = self.__topics[topic] = RateCounter(self.rate_window_sec, self.clock)
+            counter.add()
+            if lag_sec is not None:
+                self.__dispatch_lag.record(lag_sec)
+
+    def record_heartbeat_rtt(self, seconds):
+        with self.__lock:
+            self.__heartbeat_rtt.record(seconds)
+
+    def snapshot(self):
+        """ Current metrics as plain data """
+        with self.__lock:
+            return {
+                'uptime_sec': self.clock() - self.started,
+                'requests': {endpoint: {'count': entry['count'], 'errors': entry['errors'],
+                                        'latency': entry['latency'].snapshot()}
+                             for endpoint, entry in self.__requests.items()},
+                'topics': {topic: {'count': counter.count, 'rate_per_sec': counter.rate()}
+                           for topic, counter in self.__topics.items()},
+                'dispatch_lag': self.__dispatch_lag.snapshot(),
+                'heartbeat_rtt': self.__heartbeat_rtt.snapshot(),
+            }
+
+    def export_text(self):
+        """ Prometheus text exposition of all metrics """
+        prefix = self.prefix
+        lines = []
+        with self.__lock:
+            lines += [f'# HELP {prefix}_request_total Gateway requests by endpoint',
+                      f'# TYPE {prefix}_request_total counter']
+            lines += [f'{prefix}_request_total{{endpoint="{self.__label(e)}"}} {entry["count"]}'
+                      for e, entry in self.__requests.items()]
+            lines += [f'# HELP {prefix}_request_errors_total Failed gateway requests by endpoint',
+                      f'# TYPE {prefix}_request_errors_total counter']
+            lines += [f'{prefix}_request_errors_total{{endpoint="{self.__label(e)}"}} {entry["errors"]}'
+                      for e, entry in self.__requests.items()]
+            lines += [f'# HELP {prefix}_request_seconds Gateway request latency',
+                      f'# TYPE {prefix}_request_seconds histogram']
+            for endpoint, entry in self.__requests.items():
+                lines += self.__histogram_lines(f'{prefix}_request_seconds', entry['latency'],
+                                                f'endpoint="{self.__label(endpoint)}"')
+            lines += [f'# HELP {prefix}_ws_messages_total Websocket messages by topic',
+                      f'# TYPE {prefix}_ws_messages_total counter']
+            lines += [f'{prefix}_ws_messages_total{{topic="{self.__label(t)}"}} {counter.count}'
+                      for t, counter in self.__topics.items()]
+            lines += [f'# HELP {prefix}_ws_message_rate Websocket messages per second by topic',
+                      f'# TYPE {prefix}_ws_message_rate gauge']
+            lines += [f'{prefix}_ws_message_rate{{topic="{self.__label(t)}"}} {counter.rate():.3f}'
+                      for t, counter in self.__topics.items()]
+            lines += [f'# HELP {prefix}_ws_dispatch_lag_seconds Websocket receive to dispatch lag',
+                      f'# TYPE {prefix}_ws_dispatch_lag_seconds histogram']
+            lines += self.__histogram_lines(f'{prefix}_ws_dispatch_lag_seconds', self.__dispatch_lag)
+            lines += [f'# HELP {prefix}_ws_heartbeat_rtt_seconds Websocket heartbeat round-trip',
+                      f'# TYPE {prefix}_ws_heartbeat_rtt_seconds histogram']
+            lines += self.__histogram_lines(f'{prefix}_ws_heartbeat_rtt_seconds', self.__heartbeat_rtt)
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """ Write export_text() to path, replacing the file atomically """
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as file:
+            file.write(self.export_text())
+        os.replace(temp_path, path)
+
+    def export_every(self, path, interval_sec, scheduler):
+        """ write(path) every interval_sec on a PeriodicScheduler. Returns the ScheduledTask """
+        if self.__export_task is not None:
+            self.__export_task.cancel()
+        self.__export_task = scheduler.schedule(lambda: self.write(path), interval_sec, name='MetricsExport')
+        return self.__export_task
+
+    def __request_entry(self, endpoint):
+        entry = self.__requests.get(endpoint)
+        if entry is None:
+            entry = self.__requests[endpoint] = {'count': 0, 'errors': 0, 'latency': LatencyHistogram(self.buckets)}
+        return entry
+
+    @staticmethod
+    def __label(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    @staticmethod
+    def __histogram_lines(name, histogram, labels=''):
+        separator = ',' if labels else ''
+        lines = []
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{separator}le="{bound:.6g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{separator}le="+Inf"}} {histogram.count}')
+        suffix = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{suffix} {histogram.sum:.6f}')
+        lines.append(f'{name}_count{suffix} {histogram.count}')
+        return lines
+
+
+if __name__ == '__main__':
+    print("=== Metrics ===")
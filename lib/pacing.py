@@ -0,0 +1,194 @@
+# pacing.py
+import asyncio
+import threading
+import time
+from enum import Enum, IntEnum
+
+from lib.log import Log
+
+log = Log(__name__)
+
+
+class RequestPriority(IntEnum):
+    """ Order in which waiting requests are released. Lower values go first. """
+    Order = 0           # order placement/modification path
+    Normal = 1
+    Housekeeping = 2    # keep-alive, session status and other background polling
+
+
+class RequestThrottled(Exception):
+    """ Request was not sent because no pacing token became available within the allowed wait """
+    def __init__(self, endpoint='', wait_sec=0.0):
+        super().__init__(f'Throttled: {endpoint} (waited {wait_sec:.3f}s)')
+        self.endpoint = endpoint
+        self.wait_sec = wait_sec
+
+
+class TokenBucket:
+    """
+    TokenBucket
+    Allows rate_per_sec operations on average with bursts of up to burst operations.
+    """
+    def __init__(self, rate_per_sec, burst=1, clock=time.monotonic):
+        if rate_per_sec <= 0 or burst < 1:
+            raise ValueError('rate_per_sec must be positive and burst at least 1')
+
+        self.rate_per_sec = rate_per_sec
+        self.burst = burst
+        self.__tokens = float(burst)
+        self.__clock = clock
+        self.__updated = clock()
+
+    def wait_time(self, now=None):
+        """ Seconds until a token is available (0 when one is available now) """
+        now = self.__clock() if now is None else now
+        self.__refill(now)
+        if self.__tokens >= 1:
+            return 0.0
+        return (1 - self.__tokens) / self.rate_per_sec
+
+    def consume(self, now=None):
+        """ Take a token. Caller must have checked wait_time() == 0 """
+        now = self.__clock() if now is None else now
+        self.__refill(now)
+        self.__tokens -= 1
+
+    def __refill(self, now):
+        elapsed = now - self.__updated
+        if elapsed > 0:
+            self.__tokens = min(self.burst, self.__tokens + elapsed * self.rate_per_sec)
+            self.__updated = now
+
+
+class PacingScheduler:
+    """
+    PacingScheduler
+    Keep request rates under the gateway limits. Every request takes a token from the global bucket and from its
+    endpoint's bucket (if one is configured). Waiting requests are released in RequestPriority order, so order-path
+    calls overtake housekeeping. May be shared by several clients, threaded (acquire) and asyncio (acquire_async).
+    Parameters:
+        - rate_per_sec (10) = Global request rate.
+        - burst (rate_per_sec) = Global burst size.
+        - endpoint_rates ({}) = Per endpoint rate: {endpoint: rate_per_sec} or {endpoint: (rate_per_sec, burst)}.
+                                Keys are endpoint strings or Endpoints members.
+        - max_wait_sec (30) = Longest a request waits for a token before it is reported as throttled.
+    """
+    # longest an asyncio waiter sleeps before re-checking whether it is next in line
+    async_poll_sec = 0.005
+
+    def __init__(self, rate_per_sec=10, burst=None, endpoint_rates=None, max_wait_sec=30, clock=time.monotonic):
+        self.max_wait_sec = max_wait_sec
+        self.granted = 0
+        self.throttled = 0
+        self.__clock = clock
+        self.__global = TokenBucket(rate_per_sec, burst if burst is not None else max(1, int(rate_per_sec)), clock)
+        self.__endpoints = {}
+        self.__waiters = []
+        self.__sequence = 0
+        self.__cond = threading.Condition()
+
+        for endpoint, rate in (endpoint_rates or {}).items():
+            rate, endpoint_burst = rate if isinstance(rate, tuple) else (rate, 1)
+            self.set_endpoint_rate(endpoint, rate, endpoint_burst)
+
+    def set_endpoint_rate(self, endpoint, rate_per_sec, burst=1):
+        """ Limit a single endpoint in addition to the global rate """
+        with self.__cond:
+            self.__endpoints[self.__endpoint_name(endpoint)] = TokenBucket(rate_per_sec, burst, self.__clock)
+
+    def acquire(self, endpoint, priority=RequestPriority.Normal, timeout_sec=None):
+        """ Block until the request may be sent. Returns False if it could not be paced within timeout_sec. """
+        timeout_sec = self.max_wait_sec if timeout_sec is None else timeout_sec
+        entry = self.__enter(endpoint, priority)
+        start = self.__clock()
+
+        with self.__cond:
+            try:
+                while True:
+                    now = self.__clock()
+                    wait = self.__try_grant(entry, now)
+                    if wait == 0:
+                        return True
+
+                    remaining = start + timeout_sec - now
+                    if remaining <= 0:
+                        return self.__throttle(entry, now - start)
+
+                    self.__cond.wait(min(wait, remaining))
+            finally:
+                self.__leave(entry)
+
+    async def acquire_async(self, endpoint, priority=RequestPriority.Normal, timeout_sec=None):
+        """ asyncio version of acquire() """
+        timeout_sec = self.max_wait_sec if timeout_sec is None else timeout_sec
+        entry = self.__enter(endpoint, priority)
+        start = self.__clock()
+
+        try:
+            while True:
+                with self.__cond:
+                    now = self.__clock()
+                    wait = self.__try_grant(entry, now)
+                    if wait == 0:
+                        return True
+
+                    remaining = start + timeout_sec - now
+                    if remaining <= 0:
+                        return self.__throttle(entry, now - start)
+
+                await asyncio.sleep(min(wait, remaining, self.async_poll_sec))
+        finally:
+            with self.__cond:
+                self.__leave(entry)
+
+    def __enter(self, endpoint, priority):
+        with self.__cond:
+            self.__sequence += 1
+            entry = (int(priority), self.__sequence, self.__endpoint_name(endpoint))
+            self.__waiters.append(entry)
+            return entry
+
+    def __leave(self, entry):
+        """ Remove a waiter and let the others re-evaluate. Lock must be held. """
+        self.__waiters.remove(entry)
+        self.__cond.notify_all()
+
+    def __throttle(self, entry, waited_sec):
+        self.throttled += 1
+        log.debug('Pacing: Throttled {} after {:.3f}s', entry[2], waited_sec)
+        return False
+
+    def __try_grant(self, entry, now):
+        """ Consume tokens for entry if it is the highest priority waiter able to go.
+            Returns 0 when granted, otherwise the time to wait before checking again. Lock must be held.
+        """
+        global_wait = self.__global.wait_time(now)
+        if global_wait > 0:
+            return global_wait
+
+        own_wait = None
+        for waiter in sorted(self.__waiters):
+            bucket = self.__endpoints.get(waiter[2])
+            waiter_wait = bucket.wait_time(now) if bucket is not None else 0.0
+            if waiter is entry:
+                own_wait = waiter_wait
+                if waiter_wait == 0:
+                    self.__global.consume(now)
+                    if bucket is not None:
+                        bucket.consume(now)
+                    self.granted += 1
+                    return 0
+            elif waiter_wait == 0:
+                # a waiter ahead of us can go. Wake it and wait for it to take the token
+                self.__cond.notify_all()
+                break
+
+        return own_wait if own_wait else self.async_poll_sec
+
+    @staticmethod
+    def __endpoint_name(endpoint):
+        return endpoint.value if isinstance(endpoint, Enum) else endpoint
+
+
+if __name__ == '__main__':
+    print("=== Pacing Scheduler ===")
@@ -0,0 +1,115 @@
+# responsecache.py
+import copy
+import threading
+import time
+from collections import OrderedDict
+from enum import Enum
+
+from lib.log import Log
+
+from ib.error import Error
+
+log = Log(__name__)
+
+
+class ResponseCache:
+    """
+    ResponseCache
+    Time-limited (TTL) cache of successful RequestResults, bounded in size with least-recently-used eviction.
+    Only endpoints with a TTL are cached. Cached results are returned as shallow copies, so their .json payload
+    is shared between readers and must be treated as read-only.
+    Parameters:
+        - ttl_sec ({}) = Time to live per endpoint in seconds. Keys are endpoint strings or Endpoints members.
+        - default_ttl_sec (0) = Time to live for endpoints not listed in ttl_sec. 0 disables caching for them.
+        - max_entries (128) = Maximum number of cached responses.
+    """
+    def __init__(self, ttl_sec=None, default_ttl_sec=0, max_entries=128, clock=time.monotonic):
+        if max_entries < 1:
+            raise ValueError('max_entries must be at least 1')
+
+        self.default_ttl_sec = default_ttl_sec
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__ttl_sec = {}
+        self.__entries = OrderedDict()
+        self.__clock = clock
+        self.__lock = threading.Lock()
+
+        for endpoint, ttl in (ttl_sec or {}).items():
+            self.set_ttl(endpoint, ttl)
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def set_ttl(self, endpoint, ttl_sec):
+        """ Set (or with 0, disable) the time to live for an endpoint """
+        with self.__lock:
+            self.__ttl_sec[self.__endpoint_name(endpoint)] = ttl_sec
+
+    def ttl(self, endpoint):
+        """ Time to live in seconds for an endpoint """
+        return self.__ttl_sec.get(self.__endpoint_name(endpoint), self.default_ttl_sec)
+
+    def get(self, method, endpoint, payload=''):
+        """ Return a copy of the cached RequestResult, or None if not cached or expired """
+        key = self.__key(method, endpoint, payload)
+        now = self.__clock()
+
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                expires, result = entry
+                if now < expires:
+                    self.__entries.move_to_end(key)
+                    self.hits += 1
+                    return copy.copy(result)
+                del self.__entries[key]
+
+            self.misses += 1
+            return None
+
+    def put(self, method, endpoint, result, payload=''):
+        """ Cache a RequestResult if it was successful and its endpoint has a TTL """
+        ttl = self.ttl(endpoint)
+        if ttl <= 0 or result.error != Error.No_Error:
+            return
+
+        # decode once here rather than in every copy handed out on a hit
+        result.json
+        key = self.__key(method, endpoint, payload)
+        with self.__lock:
+            self.__entries[key] = (self.__clock() + ttl, copy.copy(result))
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, endpoint=None):
+        """ Drop cached responses for one endpoint, or all responses when no endpoint is given """
+        with self.__lock:
+            if endpoint is None:
+                self.__entries.clear()
+            else:
+                name = self.__endpoint_name(endpoint)
+                for key in [key for key in self.__entries if key[1] == name]:
+                    del self.__entries[key]
+        log.debug('ResponseCache: Invalidated {}', endpoint if endpoint is not None else "all")
+
+    def stats(self):
+        """ Snapshot of cache counters """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self.__entries)}
+
+    @staticmethod
+    def __endpoint_name(endpoint):
+        return endpoint.value if isinstance(endpoint, Enum) else endpoint
+
+    @staticmethod
+    def __key(method, endpoint, payload):
+        return method, ResponseCache.__endpoint_name(endpoint), repr(payload)
+
+
+if __name__ == '__main__':
+    print("=== Response Cache ===")
@@ -0,0 +1,242 @@
+# scheduler.py
+# Shared periodic task scheduler. Many periodic callbacks (e.g. watchdog tasks of many clients) run from a single
+# thread (PeriodicScheduler) or a single asyncio task (AsyncPeriodicScheduler) instead of one thread each.
+import asyncio
+import heapq
+import inspect
+import itertools
+import random
+import threading
+import time
+
+from lib.log import Log
+
+log = Log(__name__)
+
+
+class ScheduledTask:
+    """ A periodic callback registered with a scheduler.
+        runs = completed calls, errors = calls which raised, missed = whole periods skipped because the scheduler was
+        late, max_lag_sec = worst delay between the planned and actual start of a call.
+    """
+    __slots__ = ('callback', 'interval_sec', 'jitter_sec', 'name', 'due', 'run_at',
+                 'runs', 'errors', 'missed', 'max_lag_sec', 'cancelled')
+
+    def __init__(self, callback, interval_sec, jitter_sec=0.0, name=''):
+        self.callback = callback
+        self.interval_sec = interval_sec
+        self.jitter_sec = jitter_sec
+        self.name = name or getattr(callback, '__qualname__', repr(callback))
+        # due = deadline on the regular interval grid, run_at = due plus jitter
+        self.due = 0.0
+        self.run_at = 0.0
+        self.runs = 0
+        self.errors = 0
+        self.missed = 0
+        self.max_lag_sec = 0.0
+        self.cancelled = False
+
+    def __repr__(self):
+        return f'ScheduledTask({self.name}, every {self.interval_sec}s, runs={self.runs}, missed={self.missed})'
+
+    def cancel(self):
+        """ Stop further calls. The scheduler drops the task when it next comes due """
+        self.cancelled = True
+
+
+class PeriodicScheduler:
+    """
+    PeriodicScheduler
+    Runs periodic tasks from one background thread, ordered by a heap of deadlines. Tasks are called one at a time,
+    so a slow callback delays the others (the delay is visible in max_lag_sec / missed).
+    Parameters:
+        - name ('Scheduler') = Thread name.
+        - autostart (True) = Start the thread immediately. Use start() otherwise.
+    """
+    def __init__(self, name='Scheduler', autostart=True, clock=time.monotonic):
+        self.name = name
+        self.clock = clock
+        self.__heap = []
+        self.__sequence = itertools.count()
+        self.__cond = threading.Condition()
+        self.__thread = None
+        self.__stopping = False
+        if autostart:
+            self.start()
+
+    def __len__(self):
+        return len(self.__heap)
+
+    def schedule(self, callback, interval_sec, jitter_sec=0.0, first_delay_sec=None, name=''):
+        """ Call callback() every interval_sec. Each call is shifted randomly by up to +/- jitter_sec so that many
+            tasks with the same interval spread out. The first call happens after first_delay_sec (default: now).
+        """
+        if interval_sec <= 0:
+            raise ValueError('interval_sec must be positive')
+
+        task = ScheduledTask(callback, interval_sec, jitter_sec, name)
+        task.due = self.clock() + (first_delay_sec or 0.0)
+        task.run_at = task.due + self.__jitter(task)
+        self.push(task)
+        return task
+
+    def tasks(self):
+        """ Scheduled (not cancelled) tasks """
+        with self.__cond:
+            return [entry[2] for entry in self.__heap if not entry[2].cancelled]
+
+    def stats(self):
+        """ Run/missed/lag counters per task name """
+        return {task.name: {'runs': task.runs, 'errors': task.errors, 'missed': task.missed,
+                            'max_lag_sec': task.max_lag_sec} for task in self.tasks()}
+
+    def push(self, task):
+        with self.__cond:
+            heapq.heappush(self.__heap, (task.run_at, next(self.__sequence), task))
+            self.__cond.notify()
+
+    def next_delay(self, now=None):
+        """ Seconds until the next task is due (None if there are no tasks) """
+        now = self.clock() if now is None else now
+        with self.__cond:
+            return max(0.0, self.__heap[0][0] - now) if self.__heap else None
+
+    def pop_due(self, now=None):
+        """ Remove and return the tasks due at now, in deadline order """
+        now = self.clock() if now is None else now
+        due = []
+        with self.__cond:
+            while self.__heap and self.__heap[0][0] <= now:
+                task = heapq.heappop(self.__heap)[2]
+                if not task.cancelled:
+                    due.append(task)
+        return due
+
+    def reschedule(self, task, started):
+        """ Record a call which started at started, and queue the task's next call """
+        lag = started - task.run_at
+        task.max_lag_sec = max(task.max_lag_sec, lag)
+        # whole periods that passed while the task was waiting are skipped rather than run back to back
+        missed = int((started - task.due) // task.interval_sec)
+        if missed > 0:
+            task.missed += missed
+        task.due += task.interval_sec * (max(missed, 0) + 1)
+        task.run_at = task.due + self.__jitter(task)
+        if not task.cancelled:
+            self.push(task)
+
+    def run_pending(self, now=None):
+        """ Call every task that is due. Returns the number of calls """
+        tasks = self.pop_due(now)
+        for task in tasks:
+            started = self.clock()
+            try:
+                task.callback()
+                task.runs += 1
+            except Exception as e:
+                task.errors += 1
+                log.debug('Scheduler({}): Task {} failed: {}', self.name, task.name, e)
+            self.reschedule(task, started)
+        return len(tasks)
+
+    def start(self):
+        """ Start the scheduler thread """
+        if self.__thread is None or not self.__thread.is_alive():
+            self.__stopping = False
+            self.__thread = threading.Thread(target=self.__run, name=self.name, daemon=True)
+            self.__thread.start()
+
+    def stop(self, timeout_sec=None):
+        """ Stop the scheduler thread. Scheduled tasks are kept and resume on start() """
+        with self.__cond:
+            self.__stopping = True
+            self.__cond.notify()
+        if self.__thread is not None and self.__thread is not threading.current_thread():
+            self.__thread.join(timeout_sec)
+
+    def __run(self):
+        log.debug('Scheduler({}): Started', self.name)
+        while True:
+            with self.__cond:
+                while not self.__stopping:
+                    delay = self.__heap[0][0] - self.clock() if self.__heap else None
+                    if delay is not None and delay <= 0:
+                        break
+                    self.__cond.wait(delay)
+                if self.__stopping:
+                    break
+            self.run_pending()
+        log.debug('Scheduler({}): Stopped', self.name)
+
+    @staticmethod
+    def __jitter(task):
+        return random.uniform(-task.jitter_sec, task.jitter_sec) if task.jitter_sec > 0 else 0.0
+
+
+class AsyncPeriodicScheduler(PeriodicScheduler):
+    """
+    AsyncPeriodicScheduler
+    PeriodicScheduler running as a task on an asyncio event loop. Callbacks may be plain functions or coroutine
+    functions. Start with start() from within the running loop, or await run().
+    """
+    def __init__(self, name='AsyncScheduler', clock=time.monotonic):
+        self.__wake = None
+        self.__task = None
+        super().__init__(name=name, autostart=False, clock=clock)
+
+    def push(self, task):
+        super().push(task)
+        # schedule() may be called from other threads
+        wake = self.__wake
+        if wake is not None:
+            self.__loop.call_soon_threadsafe(wake.set)
+
+    def start(self):
+        """ Run the scheduler as a task on the running event loop """
+        if self.__task is None or self.__task.done():
+            self.__task = asyncio.get_running_loop().create_task(self.run())
+        return self.__task
+
+    def stop(self, timeout_sec=None):
+        if self.__task is not None:
+            self.__task.cancel()
+
+    async def run(self):
+        """ Call tasks as they come due, until cancelled """
+        self.__loop = asyncio.get_running_loop()
+        self.__wake = asyncio.Event()
+        log.debug('Scheduler({}): Started', self.name)
+        try:
+            while True:
+                delay = self.next_delay()
+                self.__wake.clear()
+                if delay is None or delay > 0:
+                    try:
+                        await asyncio.wait_for(self.__wake.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self.run_pending_async()
+        finally:
+            self.__wake = None
+            log.debug('Scheduler({}): Stopped', self.name)
+
+    async def run_pending_async(self, now=None):
+        """ Call (and await) every task that is due. Returns the number of calls """
+        tasks = self.pop_due(now)
+        for task in tasks:
+            started = self.clock()
+            try:
+                result = task.callback()
+                if inspect.isawaitable(result):
+                    await result
+                task.runs += 1
+            except Exception as e:
+                task.errors += 1
+                log.debug('Scheduler({}): Task {} failed: {}', self.name, task.name, e)
+            self.reschedule(task, started)
+        return len(tasks)
+
+
+if __name__ == '__main__':
+    print("=== Periodic Scheduler ===")
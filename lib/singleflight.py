@@ -0,0 +1,105 @@
+# singleflight.py
+import asyncio
+import threading
+
+
+class _Call:
+    """ One outstanding call shared by every caller using the same key """
+    __slots__ = ('done', 'result', 'exception')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+class SingleFlight:
+    """
+    SingleFlight
+    Coalesce concurrent identical calls (threads). While a call for a key is outstanding, other callers with the
+    same key wait for it and receive its result (or exception) instead of repeating the work.
+    Parameters:
+        - share (None) = Applied to the result handed to waiting callers, e.g. copy.copy. None shares the object.
+    """
+    def __init__(self, share=None):
+        self.share = share
+        self.coalesced = 0
+        self.__calls = {}
+        self.__lock = threading.Lock()
+
+    def do(self, key, fn):
+        """ Return fn(), or the result of an identical call already in flight for key """
+        with self.__lock:
+            call = self.__calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self.__calls[key] = call
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.exception is not None:
+                raise call.exception
+            return call.result if self.share is None else self.share(call.result)
+
+        try:
+            call.result = fn()
+            return call.result
+
+        except BaseException as e:
+            call.exception = e
+            raise
+
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """
+    AsyncSingleFlight
+    asyncio counterpart of SingleFlight. Concurrent awaits with the same key share one outstanding coroutine.
+    Parameters:
+        - share (None) = Applied to the result handed to waiting callers, e.g. copy.copy. None shares the object.
+    """
+    def __init__(self, share=None):
+        self.share = share
+        self.coalesced = 0
+        self.__calls = {}
+
+    async def do(self, key, coro_fn):
+        """ Return await coro_fn(), or the result of an identical call already in flight for key """
+        future = self.__calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # shield so a cancelled waiter does not cancel the shared call
+            result = await asyncio.shield(future)
+            return result if self.share is None else self.share(result)
+
+        future = asyncio.get_running_loop().create_future()
+        # mark the outcome as retrieved so an unshared failure does not log 'exception was never retrieved'
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.__calls[key] = future
+
+        try:
+            result = await coro_fn()
+            future.set_result(result)
+            return result
+
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+
+        finally:
+            del self.__calls[key]
+
+
+if __name__ == '__main__':
+    print("=== Single Flight ===")
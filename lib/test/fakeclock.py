@@ -0,0 +1,10 @@
+# fakeclock.py
+# Test helper: manually advanced replacement for time.monotonic, passed as clock= to the classes under test
+
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
@@ -1,6 +1,14 @@
 # test_certificate.py
+import os
+import shutil
+
+import certifi
+import pytest
+
+from lib.asynchttpendpoints import AsyncHttpSessionPool
 from lib.certificate import Certificate
 from lib.certificate import CertificateError
+from lib.httpsession import HttpSessionPool
 from pathlib import Path
 
 
@@ -28,4 +36,77 @@ def test_get_certificate_happy():
     result = Certificate.get_certificate(certificate_path=local_test_path)
 
     assert result.ssl_context is not None
-    assert result.error is CertificateError.Ok
\ No newline at end of file
+    assert result.error is CertificateError.Ok
+
+
+def test_get_certificate_default_path():
+    """ No path gives a usable default context, with or without the cache """
+    for cached in (True, False):
+        result = Certificate.get_certificate(cached=cached)
+
+        assert result.ssl_context is not None
+        assert result.error is CertificateError.Ok
+
+
+def test_get_certificate_default_path_cached(monkeypatch):
+    """ The default context is shared, without checking any file """
+    Certificate.clear_cache()
+    first = Certificate.get_certificate()
+    assert Certificate.get_certificate(cached=False).ssl_context is not first.ssl_context
+
+    monkeypatch.setattr(os, 'stat', None)
+    assert Certificate.get_certificate().ssl_context is first.ssl_context
+    Certificate.clear_cache()
+
+
+def test_get_certificate_cached(tmp_path, monkeypatch):
+    """ Contexts are shared until the file changes """
+    path = tmp_path / 'ca.pem'
+    shutil.copy(certifi.where(), path)
+    monkeypatch.setattr(Certificate, 'revalidate_sec', 0)
+    Certificate.clear_cache()
+
+    first = Certificate.get_certificate(certificate_path=path)
+    assert first.error is CertificateError.Ok
+    assert Certificate.get_certificate(certificate_path=str(path)).ssl_context is first.ssl_context
+    assert Certificate.get_certificate(certificate_path=path, cached=False).ssl_context is not first.ssl_context
+
+    pool = HttpSessionPool(certificate_path=path)
+    session = pool.session
+    assert pool.ssl_context is first.ssl_context
+
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    changed = Certificate.get_certificate(certificate_path=path)
+    assert changed.ssl_context is not first.ssl_context
+    assert pool.session is not session
+    assert pool.ssl_context is changed.ssl_context
+    pool.close()
+
+    path.unlink()
+    assert Certificate.get_certificate(certificate_path=path).error is CertificateError.Invalid_Path
+    Certificate.clear_cache()
+
+
+@pytest.mark.asyncio
+async def test_async_session_pool_certificate_change(tmp_path, monkeypatch):
+    """ The asyncio pool opens a new session when the certificate file changes """
+    path = tmp_path / 'ca.pem'
+    shutil.copy(certifi.where(), path)
+    monkeypatch.setattr(Certificate, 'revalidate_sec', 0)
+    Certificate.clear_cache()
+
+    pool = AsyncHttpSessionPool(certificate_path=path)
+    session = pool.session
+    assert pool.session is session
+    assert pool.ssl_context is Certificate.get_certificate(certificate_path=path).ssl_context
+
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    changed = pool.session
+    assert changed is not session
+    assert pool.ssl_context is Certificate.get_certificate(certificate_path=path).ssl_context
+
+    await pool.close()
+    assert session.closed and changed.closed
+    Certificate.clear_cache()
@@ -0,0 +1,220 @@
+# test_httpendpoints.py
+import json
+import threading
+import time
+from unittest.mock import MagicMock
+
+import requests
+
+from ib.error import Error
+from lib.httpendpoints import HttpEndpoints
+from lib.httpsession import HttpSessionPool
+from lib.pacing import PacingScheduler
+from lib.responsecache import ResponseCache
+from lib.scheduler import PeriodicScheduler
+
+
+class FakeGateway:
+    """ Stand-in for HttpSessionPool which answers with the requested url after an optional delay """
+    def __init__(self, delay_sec=0.0):
+        self.pool_size = 4
+        self.delay_sec = delay_sec
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def respond(self, method, url, **kwargs):
+        with self.lock:
+            self.calls.append((method, url, kwargs.get('json')))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        time.sleep(self.delay_sec)
+
+        with self.lock:
+            self.in_flight -= 1
+
+        return MagicMock(ok=True, status_code=200, content=json.dumps({'url': url}).encode())
+
+    def get(self, url, **kwargs):
+        return self.respond('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.respond('POST', url, **kwargs)
+
+
+def make_client(gateway):
+    client = HttpEndpoints(autostart=False, session_pool=gateway)
+    client.url_http = 'https://gateway'
+    return client
+
+
+def test_batch_results_in_order():
+    """ Results come back in input order regardless of completion order """
+    gateway = FakeGateway(delay_sec=0.01)
+    client = make_client(gateway)
+    items = [('GET', f'/item{i}') for i in range(8)]
+
+    results = client.clientrequest_batch(items, max_concurrency=4)
+
+    assert [r.json['url'] for r in results] == [f'https://gateway/item{i}' for i in range(8)]
+    assert all(r.error == Error.No_Error for r in results)
+
+
+def test_batch_concurrency_limit():
+    """ No more than max_concurrency requests are in flight at once """
+    gateway = FakeGateway(delay_sec=0.02)
+    client = make_client(gateway)
+
+    client.clientrequest_batch([('GET', f'/a{i}') for i in range(6)], max_concurrency=2)
+
+    assert gateway.max_in_flight == 2
+
+
+def test_batch_post_payload():
+    """ Payload is sent as the POST body """
+    gateway = FakeGateway()
+    client = make_client(gateway)
+
+    client.clientrequest_batch([('post', '/order', {'conid': 1})])
+
+    assert gateway.calls == [('POST', 'https://gateway/order', {'conid': 1})]
+
+
+def test_batch_bad_item():
+    """ Malformed items produce an error result without affecting the other items """
+    gateway = FakeGateway()
+    client = make_client(gateway)
+
+    results = client.clientrequest_batch([('DELETE', '/a'), ('GET', '/b'), ('GET',)])
+
+    assert results[0].error == Error.Invalid_Request
+    assert results[1].error == Error.No_Error
+    assert results[2].error == Error.Invalid_Request
+
+
+def test_batch_default_concurrency():
+    """ Default concurrency follows the connection pool size """
+    client = HttpEndpoints(autostart=False, session_pool=HttpSessionPool(pool_size=3))
+    assert client.batch_concurrency == 3
+
+
+def test_watchdog_jitter():
+    """ jitter_sec reaches the watchdog task on the scheduler """
+    client = HttpEndpoints(timeout_sec=10, session_pool=FakeGateway(), scheduler=PeriodicScheduler(autostart=False),
+                           jitter_sec=2)
+    assert client.watchdog_scheduled.interval_sec == 10
+    assert client.watchdog_scheduled.jitter_sec == 2
+
+
+def test_get_served_from_cache():
+    """ Repeat GETs within the TTL do not reach the gateway """
+    gateway = FakeGateway()
+    client = HttpEndpoints(autostart=False, session_pool=gateway, response_cache=ResponseCache(default_ttl_sec=60))
+    client.url_http = 'https://gateway'
+
+    first = client.clientrequest_get('/iserver/accounts')
+    second = client.clientrequest_get('/iserver/accounts')
+
+    assert len(gateway.calls) == 1
+    assert second.json == first.json
+
+
+def test_concurrent_gets_coalesced():
+    """ Identical concurrent GETs share one gateway request """
+    gateway = FakeGateway(delay_sec=0.05)
+    client = make_client(gateway)
+
+    results = client.clientrequest_batch([('GET', '/iserver/account/trades')] * 4, max_concurrency=4)
+
+    assert len(gateway.calls) == 1
+    assert len({id(r) for r in results}) == 4
+    assert all(r.json['url'] == 'https://gateway/iserver/account/trades' for r in results)
+
+
+def test_posts_not_coalesced_by_default():
+    gateway = FakeGateway(delay_sec=0.02)
+    client = make_client(gateway)
+
+    client.clientrequest_batch([('POST', '/tickle')] * 3, max_concurrency=3)
+
+    assert len(gateway.calls) == 3
+
+
+def test_throttled_request_not_sent():
+    """ Requests the pacing scheduler cannot release report Error.Throttled without reaching the gateway """
+    gateway = FakeGateway()
+    pacing = PacingScheduler(rate_per_sec=1000, endpoint_rates={'/sso/validate': 1 / 60}, max_wait_sec=0.05)
+    client = HttpEndpoints(autostart=False, session_pool=gateway, pacing=pacing)
+    client.url_http = 'https://gateway'
+
+    assert client.clientrequest_get('/sso/validate').error == Error.No_Error
+    assert client.clientrequest_get('/sso/validate').error == Error.Throttled
+    assert len(gateway.calls) == 1
+
+
+def test_gateway_429_is_throttled():
+    resp = MagicMock(ok=False, status_code=429)
+    result = HttpEndpoints.check_response('https://gateway/tickle', resp, None)
+    assert result.error == Error.Throttled
+    assert result.statusCode == 429
+
+
+class StreamedResponse:
+    """ Streamed response delivering the body in chunks, optionally failing after some chunks """
+    def __init__(self, body, status_code=200, chunk_size=7, fail_after=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.body = body
+        self.chunk_size = chunk_size
+        self.fail_after = fail_after
+        self.chunks_read = 0
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), self.chunk_size):
+            if self.fail_after is not None and self.chunks_read >= self.fail_after:
+                raise requests.ConnectionError('connection reset')
+            self.chunks_read += 1
+            yield self.body[start:start + self.chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+def test_get_stream_records():
+    """ Records are decoded as chunks arrive, and the response is closed once they are read """
+    trades = [{'execution_id': f'e{i}', 'price': 1.5 * i} for i in range(50)]
+    resp = StreamedResponse(json.dumps(trades).encode())
+    gateway = MagicMock()
+    gateway.get.return_value = resp
+    client = make_client(gateway)
+
+    result = client.clientrequest_get_stream('/iserver/account/trades')
+    first = next(result.records)
+
+    assert first == trades[0]
+    assert resp.chunks_read < len(resp.body) // resp.chunk_size
+    assert [first] + list(result.records) == trades
+    assert result.error == Error.No_Error and result.statusCode == 200
+    assert resp.closed
+    assert gateway.get.call_args.kwargs['stream'] is True
+
+
+def test_get_stream_errors():
+    """ HTTP errors give an empty records iterator; a dropped connection ends records with an error """
+    gateway = MagicMock()
+    gateway.get.return_value = failed = StreamedResponse(b'', status_code=500)
+    client = make_client(gateway)
+
+    result = client.clientrequest_get_stream('/iserver/account/trades')
+    assert result.error == Error.Invalid_URL
+    assert list(result.records) == []
+    assert failed.closed
+
+    gateway.get.return_value = StreamedResponse(json.dumps(list(range(100))).encode(), fail_after=3)
+    result = client.clientrequest_get_stream('/iserver/account/trades')
+    records = list(result.records)
+    assert 0 < len(records) < 100
+    assert result.error == Error.Connection_or_Timeout
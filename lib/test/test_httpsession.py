@@ -0,0 +1,42 @@
+# test_httpsession.py
+from unittest.mock import patch, MagicMock
+
+from lib.httpendpoints import HttpEndpoints
+from lib.httpsession import HttpSessionPool
+
+
+def test_session_reused():
+    """ Every request through the pool uses the same keep-alive session """
+    pool = HttpSessionPool(pool_size=4)
+    assert pool.session is pool.session
+
+
+def test_adapter_pool_size():
+    """ Pool size is applied to the mounted adapters """
+    pool = HttpSessionPool(pool_size=7, pool_block=False)
+    adapter = pool.session.get_adapter('https://localhost:5000/v1/portal')
+    assert adapter._pool_maxsize == 7
+    assert adapter._pool_block is False
+
+
+def test_close_recreates_session():
+    """ A closed pool opens a fresh session when used again """
+    pool = HttpSessionPool()
+    first = pool.session
+    pool.close()
+    assert pool.session is not first
+
+
+def test_endpoints_share_pool():
+    """ Clients given the same pool send requests through it """
+    pool = HttpSessionPool()
+    resp = MagicMock(ok=True, status_code=200, content=b'{"authenticated": true}')
+
+    with patch.object(pool, 'get', return_value=resp) as patched:
+        client_a = HttpEndpoints(autostart=False, session_pool=pool)
+        client_b = HttpEndpoints(autostart=False, session_pool=pool)
+        client_a.clientrequest_get('/a')
+        client_b.clientrequest_get('/b')
+
+    assert client_a.session_pool is client_b.session_pool
+    assert patched.call_count == 2
@@ -0,0 +1,47 @@
+# test_jsonstream.py
+import json
+
+import pytest
+
+from lib.jsonstream import iter_json
+
+
+def chunked(text, size):
+    data = text.encode()
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('size', [1, 2, 5, 64, 1 << 16])
+def test_array_elements(size):
+    """ Elements split anywhere across chunks, including numbers and multi-byte characters """
+    records = [{'id': i, 'price': 1.25 * i, 'name': 'Zürich' * (i % 4)} for i in range(200)]
+    records += [12345, -1.5e-7, True, None, 'text', [], {}]
+
+    assert list(iter_json(chunked(json.dumps(records), size))) == records
+
+
+def test_other_documents():
+    assert list(iter_json(chunked(' [ ] ', 1))) == []
+    assert list(iter_json(chunked('{"accounts": ["U1"]}', 3))) == [{'accounts': ['U1']}]
+    assert list(iter_json(chunked('12345.5', 1))) == [12345.5]
+    assert list(iter_json(['[1, ', '2]'])) == [1, 2]
+
+
+def test_records_before_end():
+    """ Records are yielded before the rest of the document is read """
+    consumed = []
+
+    def chunks():
+        for chunk in chunked(json.dumps(list(range(1000))), 16):
+            consumed.append(chunk)
+            yield chunk
+
+    records = iter_json(chunks())
+    assert next(records) == 0
+    assert len(consumed) == 1
+
+
+@pytest.mark.parametrize('text', ['', '[1 2]', '[1,', '[', '{"a":', '[1]x', '[1,]'])
+def test_malformed(text):
+    with pytest.raises(ValueError):
+        list(iter_json(chunked(text, 2)))
@@ -0,0 +1,69 @@
+# test_log.py
+import pytest
+from loguru import logger
+
+from lib import log as log_facade
+from lib.log import Log
+
+
+class CountingArg:
+    """ Records how often it is converted to a string """
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return 'arg'
+
+
+@pytest.fixture
+def records():
+    messages = []
+    handler = logger.add(lambda message: messages.append(message.record['message']), level='DEBUG')
+    yield messages
+    logger.remove(handler)
+
+
+def test_message_formatted(records):
+    log = Log('test.formatted')
+    log.debug('value={}', 5)
+    assert records == ['value=5']
+
+
+def test_disabled_subsystem_skips_formatting(records):
+    log = Log('test.disabled.child')
+    arg = CountingArg()
+    log_facade.disable('test.disabled')
+    try:
+        log.debug('{}', arg)
+        log.error('{}', arg)
+    finally:
+        log_facade.enable('test.disabled')
+
+    assert arg.formatted == 0
+    assert records == []
+    log.debug('{}', arg)
+    assert arg.formatted == 1
+
+
+def test_subsystem_level(records):
+    log = Log('test.level')
+    log_facade.set_level('test.level', 'INFO')
+    try:
+        log.debug('hidden')
+        log.info('shown')
+        assert log.enabled('DEBUG') is False
+    finally:
+        log_facade.enable('test.level')
+    assert records == ['shown']
+
+
+def test_payload_truncated(records):
+    log = Log('test.payload', payload_limit=10)
+    log.debug('msg={}', log.payload('x' * 25))
+    assert records == ['msg=xxxxxxxxxx...(+15 chars)']
+
+
+def test_sample():
+    log = Log('test.sample')
+    assert [log.sample('rx', 3) for _ in range(6)] == [True, False, False, True, False, False]
@@ -0,0 +1,77 @@
+# test_metrics.py
+import pytest
+
+from lib.metrics import LatencyHistogram, MetricsRegistry, RateCounter
+from lib.test.fakeclock import FakeClock
+
+
+def test_histogram_percentiles():
+    histogram = LatencyHistogram()
+    for _ in range(98):
+        histogram.record(0.001)
+    histogram.record(0.5)
+    histogram.record(2.0)
+
+    assert histogram.count == 100
+    assert histogram.max == 2.0
+    assert histogram.percentile(0.5) == pytest.approx(0.001, rel=0.25)
+    assert histogram.percentile(0.99) == pytest.approx(0.5, rel=0.25)
+    assert histogram.percentile(1.0) == 2.0
+    assert LatencyHistogram().percentile(0.5) == 0.0
+
+
+def test_rate_counter_window():
+    clock = FakeClock()
+    counter = RateCounter(window_sec=5, clock=clock)
+    for second in range(5):
+        clock.now = second + 0.5
+        counter.add(10)
+    # the current second is incomplete and not counted
+    clock.now = 5.5
+    counter.add(100)
+    assert counter.rate() == pytest.approx(10)
+
+    clock.now = 20
+    assert counter.rate() == 0
+    assert counter.count == 150
+
+
+def test_rate_counter_one_second():
+    clock = FakeClock()
+    counter = RateCounter(window_sec=1, clock=clock)
+    counter.add(3)
+    clock.now = 1.5
+    assert counter.rate() == 3
+    with pytest.raises(ValueError):
+        RateCounter(window_sec=0)
+
+
+def test_registry_snapshot_and_export(tmp_path):
+    clock = FakeClock()
+    registry = MetricsRegistry(clock=clock)
+    registry.register_endpoints(['/tickle', '/iserver/accounts'])
+    registry.record_request('/iserver/accounts', 0.010)
+    registry.record_request('/iserver/accounts', 0.020, error=True)
+    registry.record_request('/iserver/accounts', None, error=True)
+    registry.record_message('smd', 0.001)
+    registry.record_heartbeat_rtt(0.004)
+
+    snapshot = registry.snapshot()
+    accounts = snapshot['requests']['/iserver/accounts']
+    assert accounts['count'] == 3
+    assert accounts['errors'] == 2
+    assert accounts['latency']['count'] == 2
+    assert accounts['latency']['max'] == 0.020
+    assert snapshot['requests']['/tickle']['count'] == 0
+    assert snapshot['topics']['smd']['count'] == 1
+    assert snapshot['heartbeat_rtt']['count'] == 1
+
+    path = tmp_path / 'metrics.prom'
+    registry.write(path)
+    text = path.read_text()
+    assert 'ib_request_total{endpoint="/iserver/accounts"} 3' in text
+    assert 'ib_request_errors_total{endpoint="/iserver/accounts"} 2' in text
+    assert 'ib_request_seconds_bucket{endpoint="/iserver/accounts",le="+Inf"} 2' in text
+    assert 'ib_request_seconds_count{endpoint="/tickle"} 0' in text
+    assert 'ib_ws_messages_total{topic="smd"} 1' in text
+    assert 'ib_ws_heartbeat_rtt_seconds_count 1' in text
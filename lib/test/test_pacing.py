@@ -0,0 +1,68 @@
+# test_pacing.py
+import asyncio
+import threading
+import time
+
+import pytest
+
+from lib.pacing import PacingScheduler, RequestPriority, TokenBucket
+from lib.test.fakeclock import FakeClock
+
+
+def test_token_bucket_refill():
+    clock = FakeClock()
+    bucket = TokenBucket(rate_per_sec=2, burst=2, clock=clock)
+    bucket.consume()
+    bucket.consume()
+    assert bucket.wait_time() == pytest.approx(0.5)
+
+    clock.now = 0.5
+    assert bucket.wait_time() == 0
+
+
+def test_priority_order():
+    """ Order-path requests are released before housekeeping requests waiting on the same token """
+    scheduler = PacingScheduler(rate_per_sec=20, burst=1)
+    assert scheduler.acquire('/drain')
+    granted = []
+
+    def request(endpoint, priority):
+        scheduler.acquire(endpoint, priority)
+        granted.append(endpoint)
+
+    housekeeping = threading.Thread(target=request, args=('/tickle', RequestPriority.Housekeeping))
+    order = threading.Thread(target=request, args=('/order', RequestPriority.Order))
+    # both must be queued before the next token arrives (50ms)
+    housekeeping.start()
+    order.start()
+    housekeeping.join()
+    order.join()
+
+    assert granted == ['/order', '/tickle']
+
+
+def test_endpoint_limit_does_not_block_others():
+    """ A request blocked only by its endpoint limit does not hold up other endpoints """
+    scheduler = PacingScheduler(rate_per_sec=1000, endpoint_rates={'/iserver/account/trades': 0.1})
+    assert scheduler.acquire('/iserver/account/trades')
+
+    start = time.monotonic()
+    assert scheduler.acquire('/iserver/accounts', timeout_sec=1)
+    assert time.monotonic() - start < 0.5
+
+
+def test_timeout_reports_throttled():
+    scheduler = PacingScheduler(rate_per_sec=1000, endpoint_rates={'/sso/validate': 1 / 60})
+    assert scheduler.acquire('/sso/validate')
+    assert scheduler.acquire('/sso/validate', timeout_sec=0.05) is False
+    assert scheduler.throttled == 1
+
+
+@pytest.mark.asyncio
+async def test_acquire_async_paces():
+    scheduler = PacingScheduler(rate_per_sec=50, burst=1)
+    start = time.monotonic()
+    await asyncio.gather(*[scheduler.acquire_async('/a') for _ in range(4)])
+    # first token is immediate, the remaining three arrive at 20ms intervals
+    assert time.monotonic() - start >= 0.055
+    assert scheduler.granted == 4
@@ -0,0 +1,74 @@
+# test_responsecache.py
+from ib.endpoints import Endpoints
+from ib.error import Error
+from ib.resultrequest import RequestResult
+from lib.responsecache import ResponseCache
+from lib.test.fakeclock import FakeClock
+
+
+def make_result(json=None, error=Error.No_Error):
+    result = RequestResult()
+    result.json = json
+    result.error = error
+    result.statusCode = 200
+    return result
+
+
+def test_hit_returns_copy():
+    """ Cached results are returned as new RequestResult objects with the same contents """
+    cache = ResponseCache(ttl_sec={Endpoints.Validate: 5})
+    original = make_result({'RESULT': True})
+    cache.put('GET', Endpoints.Validate.value, original)
+
+    cached = cache.get('GET', Endpoints.Validate.value)
+
+    assert isinstance(cached, RequestResult)
+    assert cached is not original
+    assert cached.json == {'RESULT': True}
+    assert cached.statusCode == 200
+    assert cache.hits == 1
+
+
+def test_expiry():
+    clock = FakeClock()
+    cache = ResponseCache(ttl_sec={'/sso/validate': 5}, clock=clock)
+    cache.put('GET', '/sso/validate', make_result())
+
+    clock.now = 4.9
+    assert cache.get('GET', '/sso/validate') is not None
+    clock.now = 5.0
+    assert cache.get('GET', '/sso/validate') is None
+    assert cache.misses == 1
+
+
+def test_uncached_endpoint_and_errors():
+    """ Endpoints without a TTL and failed results are never cached """
+    cache = ResponseCache(ttl_sec={'/a': 5})
+    cache.put('GET', '/b', make_result())
+    cache.put('GET', '/a', make_result(error=Error.Invalid_URL))
+    assert len(cache) == 0
+
+
+def test_lru_eviction():
+    cache = ResponseCache(default_ttl_sec=10, max_entries=2)
+    cache.put('GET', '/a', make_result('a'))
+    cache.put('GET', '/b', make_result('b'))
+    cache.get('GET', '/a')
+    cache.put('GET', '/c', make_result('c'))
+
+    assert cache.get('GET', '/b') is None
+    assert cache.get('GET', '/a').json == 'a'
+    assert cache.evictions == 1
+
+
+def test_invalidate():
+    cache = ResponseCache(default_ttl_sec=10)
+    cache.put('GET', '/a', make_result())
+    cache.put('GET', '/b', make_result())
+
+    cache.invalidate('/a')
+    assert cache.get('GET', '/a') is None
+    assert cache.get('GET', '/b') is not None
+
+    cache.invalidate()
+    assert len(cache) == 0
@@ -0,0 +1,113 @@
+# test_scheduler.py
+import asyncio
+import threading
+import time
+
+import pytest
+
+from lib.scheduler import AsyncPeriodicScheduler, PeriodicScheduler
+from lib.test.fakeclock import FakeClock
+from lib.watchdog import Watchdog
+
+
+def test_run_pending_order_and_interval():
+    clock = FakeClock()
+    scheduler = PeriodicScheduler(autostart=False, clock=clock)
+    calls = []
+    scheduler.schedule(lambda: calls.append('a'), 10)
+    b = scheduler.schedule(lambda: calls.append('b'), 5, first_delay_sec=1)
+
+    assert scheduler.run_pending() == 1
+    assert calls == ['a']
+    assert scheduler.next_delay() == pytest.approx(1)
+
+    clock.now = 6
+    scheduler.run_pending()
+    assert calls == ['a', 'b']      # b ran once for its periods at 1 and 6
+    assert b.missed == 1
+    assert scheduler.next_delay() == pytest.approx(4)
+
+
+def test_missed_deadlines_are_skipped_and_counted():
+    clock = FakeClock()
+    scheduler = PeriodicScheduler(autostart=False, clock=clock)
+    calls = []
+    task = scheduler.schedule(lambda: calls.append(clock.now), 1)
+    scheduler.run_pending()
+
+    clock.now = 4.5
+    scheduler.run_pending()
+    assert calls == [0, 4.5]
+    assert task.missed == 3
+    assert task.max_lag_sec == pytest.approx(3.5)
+    # stays on the original grid
+    assert scheduler.next_delay() == pytest.approx(0.5)
+
+
+def test_cancel_and_errors():
+    clock = FakeClock()
+    scheduler = PeriodicScheduler(autostart=False, clock=clock)
+
+    def fail():
+        raise RuntimeError('boom')
+
+    failing = scheduler.schedule(fail, 1)
+    cancelled = scheduler.schedule(lambda: None, 1)
+    cancelled.cancel()
+    assert scheduler.run_pending() == 1
+    assert failing.errors == 1
+    assert scheduler.tasks() == [failing]
+
+
+def test_jitter_stays_in_range():
+    clock = FakeClock()
+    scheduler = PeriodicScheduler(autostart=False, clock=clock)
+    task = scheduler.schedule(lambda: None, 10, jitter_sec=2)
+    for _ in range(20):
+        clock.now = task.run_at
+        scheduler.run_pending()
+        assert abs(task.run_at - task.due) <= 2
+    assert task.missed == 0
+
+
+def test_thread_runs_many_watchdogs():
+    scheduler = PeriodicScheduler()
+    counts = {}
+    done = threading.Event()
+
+    class Counter(Watchdog):
+        def watchdog_task(self):
+            counts[self.watchdog_name] = counts.get(self.watchdog_name, 0) + 1
+            if len(counts) == 20 and min(counts.values()) >= 2:
+                done.set()
+
+    before = threading.active_count()
+    watchdogs = [Counter(name=f'w{i}', timeout_sec=1, autostart=True, scheduler=scheduler) for i in range(20)]
+    # the watchdogs share the scheduler thread
+    assert threading.active_count() == before
+    for task in scheduler.tasks():
+        task.interval_sec = 0.01
+
+    assert done.wait(5)
+    for watchdog in watchdogs:
+        watchdog.kill_watchdog()
+    assert all(watchdog.watchdog_scheduled.cancelled for watchdog in watchdogs)
+    scheduler.stop(1)
+
+
+@pytest.mark.asyncio
+async def test_async_scheduler():
+    scheduler = AsyncPeriodicScheduler()
+    calls = []
+
+    async def tick():
+        calls.append(time.monotonic())
+
+    scheduler.schedule(tick, 0.01)
+    scheduler.schedule(lambda: calls.append(None), 0.01)
+    task = scheduler.start()
+    await asyncio.sleep(0.1)
+    scheduler.stop()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert len(calls) >= 6
@@ -0,0 +1,80 @@
+# test_singleflight.py
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from lib.singleflight import SingleFlight, AsyncSingleFlight
+
+
+def test_concurrent_calls_share_result():
+    """ Identical concurrent calls execute once and all callers receive the result """
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        release.wait(2)
+        return {'accounts': ['U1']}
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(flight.do, 'key', slow) for _ in range(4)]
+        while flight.coalesced < 3:
+            pass
+        release.set()
+        results = [f.result() for f in futures]
+
+    assert len(calls) == 1
+    assert all(r == {'accounts': ['U1']} for r in results)
+
+
+def test_different_keys_not_shared():
+    flight = SingleFlight()
+    assert flight.do('a', lambda: 1) == 1
+    assert flight.do('b', lambda: 2) == 2
+    assert flight.coalesced == 0
+
+
+def test_exception_raised_to_caller():
+    flight = SingleFlight()
+
+    def fail():
+        raise RuntimeError('gateway down')
+
+    with pytest.raises(RuntimeError):
+        flight.do('a', fail)
+    # key is released after failure
+    assert flight.do('a', lambda: 3) == 3
+
+
+@pytest.mark.asyncio
+async def test_async_concurrent_calls_share_result():
+    flight = AsyncSingleFlight(share=dict)
+    calls = []
+
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {'conid': 265598}
+
+    results = await asyncio.gather(*[flight.do('key', slow) for _ in range(5)])
+
+    assert len(calls) == 1
+    assert flight.coalesced == 4
+    assert all(r == {'conid': 265598} for r in results)
+    # followers receive shared copies, not the leader's object
+    assert results[1] is not results[0]
+
+
+@pytest.mark.asyncio
+async def test_async_exception_raised_to_all():
+    flight = AsyncSingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError('gateway down')
+
+    results = await asyncio.gather(*[flight.do('key', fail) for _ in range(3)], return_exceptions=True)
+    assert all(isinstance(r, RuntimeError) for r in results)
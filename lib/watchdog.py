@@ -1,7 +1,9 @@
 # watchdog.py
 import time
 from threading import Thread
-from loguru import logger
+from lib.log import Log
+
+log = Log(__name__)
 
 
 class Watchdog(Thread):
@@ -12,33 +14,49 @@ class Watchdog(Thread):
     Parameters:
         - timeout_sec (10)= Interval for watchdog timer in seconds.
         - autostart (False) = Start background task immediately. Use start() for manual initiation.
+        - scheduler (None) = PeriodicScheduler to run watchdog_task on, instead of a dedicated thread.
+        - jitter_sec (0) = Random shift of each scheduled period, spreading out watchdogs sharing a scheduler.
     """
-    def __init__(self, name='Unknown', timeout_sec=10, autostart=False):
+    def __init__(self, name='Unknown', timeout_sec=10, autostart=False, scheduler=None, jitter_sec=0):
         Thread.__init__(self)
         self.daemon = True
         self.watchdog_timeout_sec = timeout_sec
         self.watchdog_name = name
+        self.watchdog_scheduler = scheduler
+        self.watchdog_jitter_sec = jitter_sec
+        self.watchdog_scheduled = None
 
         # False => user will manually call start() sometime in the future
         if autostart is True:
             self.start()
 
+    def start(self):
+        """ Start the watchdog. With a scheduler, watchdog_task is registered there and no thread is started """
+        if self.watchdog_scheduler is None:
+            Thread.start(self)
+        elif self.watchdog_scheduled is None and self.watchdog_timeout_sec >= 1:
+            self.watchdog_scheduled = self.watchdog_scheduler.schedule(self.watchdog_task, self.watchdog_timeout_sec,
+                                                                       jitter_sec=self.watchdog_jitter_sec,
+                                                                       name=self.watchdog_name)
+
     def run(self):
         while True:
             if self.watchdog_timeout_sec >= 1:
                 self.watchdog_task()
                 time.sleep(self.watchdog_timeout_sec)
             else:
-                logger.log('DEBUG', 'Watchdog disabled')
+                log.debug('Watchdog disabled')
                 break
 
     def kill_watchdog(self):
         """ Permanently halts operation of the watchdog task """
         self.watchdog_timeout_sec = 0
+        if self.watchdog_scheduled is not None:
+            self.watchdog_scheduled.cancel()
 
     def watchdog_task(self):
         """ Called once each watchdog period """
-        logger.log('DEBUG', f'Watchdog({self.watchdog_name}) Timeout(sec)={self.watchdog_timeout_sec}')
+        log.debug('Watchdog({}) Timeout(sec)={}', self.watchdog_name, self.watchdog_timeout_sec)
 
 
 if __name__ == '__main__':